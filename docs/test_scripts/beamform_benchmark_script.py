@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for beamforming on a synthetic 35x35 planar aperture (no data files needed)
+
+@author: ajw5
+"""
+
+#%% imports
+import os
+import timeit
+import tempfile
+import tracemalloc
+import numpy as np
+
+from samurai.analysis.support.SamuraiBeamform import SamuraiBeamform
+from samurai.analysis.support.SamuraiBeamform import beamform_frequency_block,beamform_blocks
+from samurai.analysis.support.SamuraiPostProcess import get_k
+from samurai.base.TouchstoneEditor import SnpEditor
+from samurai.base.MUF.MUFResult import MUFResult,calculate_statistics_from_array
+from samurai.analysis.support.MetafileController import MetafileController
+
+#%% build a synthetic aperture
+def make_synthetic_beamform(num_steps=35,step_mm=3.,freqs=np.linspace(26.5e9,40e9,28)):
+    '''
+    @brief create a SamuraiBeamform object with random measurements on a planar grid
+    @param[in/OPT] num_steps - number of positions along x and y
+    @param[in/OPT] step_mm - spacing of the grid in mm
+    @param[in/OPT] freqs - frequencies of the synthetic measurements
+    '''
+    rng = np.random.default_rng(1)
+    locs = np.arange(num_steps)*step_mm
+    [X,Y] = np.meshgrid(locs,locs)
+    pos = np.zeros((X.size,6))
+    pos[:,0] = X.flatten(); pos[:,1] = Y.flatten()
+    mybf = SamuraiBeamform(units='mm')
+    mybf.all_positions = pos
+    s_data = []
+    for i in range(X.size):
+        snp = SnpEditor([2,freqs])
+        snp.raw = rng.normal(size=snp.shape)+1j*rng.normal(size=snp.shape)
+        s_data.append(snp)
+    mybf.all_s_parameter_data = s_data
+    return mybf
+
+def make_muf_metafile(out_dir,num_steps=15,step_mm=3.,num_mc=20,freqs=np.linspace(26.5e9,40e9,28)):
+    '''
+    @brief write a metafile of *.meas files with random nominal and monte carlo measurements on a planar grid
+    @param[in] out_dir - directory to write the measurements and metafile to
+    @param[in/OPT] num_steps,step_mm,freqs - see make_synthetic_beamform
+    @param[in/OPT] num_mc - number of monte carlo realizations of each measurement
+    @return path to the metafile
+    '''
+    rng = np.random.default_rng(1)
+    mf = MetafileController(None)
+    mf.set_wdir(out_dir)
+    for i in range(num_steps**2):
+        paths = []
+        for name in ['nominal']+['mc_{}'.format(r) for r in range(num_mc)]:
+            snp = SnpEditor([2,freqs])
+            snp.raw = rng.normal(size=snp.shape)+1j*rng.normal(size=snp.shape)
+            paths.append(snp.write(os.path.join(out_dir,'pos_{}_{}.s2p_binary'.format(i,name))))
+        res = MUFResult()
+        res.set_nominal(paths[0])
+        res.set_monte_carlo(paths[1:])
+        meas_path = os.path.join(out_dir,'pos_{}.meas'.format(i))
+        res.write_xml(meas_path)
+        mf.add_measurement(meas_path,position=[(i%num_steps)*step_mm,(i//num_steps)*step_mm,0,0,0,0],units='mm')
+    return mf.write(os.path.join(out_dir,'metafile.json'))
+
+def beamform_per_frequency(s_vals,weights,psv_vecs,freqs):
+    '''@brief previous per-frequency implementation (complex exponential and dot for each frequency)'''
+    psv_vecs = psv_vecs.astype(np.complex64)
+    return np.array([np.dot(s_vals[:,i]*weights,np.exp(-1j*get_k(f)*psv_vecs))/weights.sum()
+                     for i,f in enumerate(freqs)])
+
+#%% time the beamforming kernels
+if __name__=='__main__':
+    num_reps = 3
+    mybf = make_synthetic_beamform()
+    freqs = mybf.freq_list
+    s_vals = mybf.s_parameter_data[...,0].astype(np.complex64)
+    weights = mybf.weights.astype(np.complex64)
+
+    for name,az,el in [('full 2D grid (90x90 angles)',np.arange(-90,90,2),np.arange(-90,90,2)),
+                       ('azimuth cut (181 angles)',np.arange(-90,91,1),[0])]:
+        [AZ,EL] = np.meshgrid(az,el)
+        psv_vecs = mybf.get_partial_steering_vectors(AZ,EL).astype(np.float32)
+        t_old = min(timeit.repeat(lambda: beamform_per_frequency(s_vals,weights,psv_vecs,freqs),number=1,repeat=num_reps))
+        s_weighted = (s_vals*weights[:,np.newaxis]).T
+        block_size = max(2**25//(psv_vecs.size*8),1) #same as beamform with freq_block_size='auto'
+        block_kernel = lambda: [beamform_frequency_block(s_weighted[i:i+block_size],psv_vecs,get_k(freqs[i:i+block_size]))
+                                for i in range(0,len(freqs),block_size)]
+        t_new = min(timeit.repeat(block_kernel,number=1,repeat=num_reps))
+        print("Kernel %s, %d freqs: per-frequency %.3f s, block %.3f s (%.1fx)" %(name,len(freqs),t_old,t_new,t_old/t_new))
+        for bs in [1,'auto']:
+            t_bf = min(timeit.repeat(lambda: mybf.beamform_azel(np.deg2rad(az),np.deg2rad(el),freq_block_size=bs,phase_recurrence=False),number=1,repeat=num_reps))
+            print("    beamform_azel freq_block_size=%s: %.3f s" %(bs,t_bf))
+        #angle tiled blocks without the data loading overhead of beamform_azel
+        out_vals = np.zeros((AZ.size,len(freqs)),dtype=np.cdouble)
+        for recurrence in [False,True]:
+            t_bf = min(timeit.repeat(lambda: beamform_blocks(s_weighted/weights.sum(),mybf.get_positions('m'),AZ.flatten(),EL.flatten(),
+                                                             freqs,out_vals,phase_recurrence=recurrence),number=1,repeat=num_reps))
+            print("    beamform_blocks phase_recurrence=%s: %.3f s" %(recurrence,t_bf))
+
+    #peak memory while beamforming finer angular grids (numpy allocations are tracked by tracemalloc)
+    for step in [4,2,1]:
+        az = np.deg2rad(np.arange(-90,90,step))
+        tracemalloc.start()
+        mycsa = mybf.beamform_azel(az,az,freq_list=freqs[:4])
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print("Peak memory %dx%d angles, 4 freqs: %.1f MB (output values %.1f MB)" 
+              %(len(az),len(az),peak/2**20,mycsa.complex_values.nbytes/2**20))
+
+    #split the frequencies across processes
+    az = np.deg2rad(np.arange(-90,90,2))
+    for n_workers in sorted(set([1,os.cpu_count()])):
+        t_bf = min(timeit.repeat(lambda: mybf.beamform_azel(az,az,n_workers=n_workers),number=1,repeat=num_reps))
+        print("beamform_azel 90x90 angles n_workers=%d: %.3f s" %(n_workers,t_bf))
+
+    #fft backend for the uniform planar grid
+    for step in [2,1]:
+        az = np.deg2rad(np.arange(-90,90,step))
+        direct_csa = mybf.beamform_azel(az,az)
+        fft_csa = mybf.beamform_azel(az,az,backend='fft')
+        err = np.abs(fft_csa.complex_values-direct_csa.complex_values).max()/np.abs(direct_csa.complex_values).max()
+        t_direct = min(timeit.repeat(lambda: mybf.beamform_azel(az,az),number=1,repeat=num_reps))
+        t_fft = min(timeit.repeat(lambda: mybf.beamform_azel(az,az,backend='fft'),number=1,repeat=num_reps))
+        print("%dx%d angles: direct %.3f s, fft %.3f s (%.1fx), max relative error %.2g" 
+              %(len(az),len(az),t_direct,t_fft,t_direct/t_fft,err))
+
+    #nufft backend for perturbed (tracked) positions
+    mybf.perturb_positions_normal([0.5,0.5,0.5,0,0,0],units='mm')
+    az = np.deg2rad(np.arange(-90,90,2))
+    direct_csa = mybf.beamform_azel(az,az)
+    t_direct = min(timeit.repeat(lambda: mybf.beamform_azel(az,az),number=1,repeat=num_reps))
+    print("Perturbed positions 90x90 angles: direct %.3f s" %(t_direct))
+    for tol in [1e-2,1e-3,1e-4,1e-6]:
+        nufft_csa = mybf.beamform_azel(az,az,backend='nufft',nufft_tol=tol)
+        err = np.abs(nufft_csa.complex_values-direct_csa.complex_values).max()/np.abs(direct_csa.complex_values).max()
+        t_nufft = min(timeit.repeat(lambda: mybf.beamform_azel(az,az,backend='nufft',nufft_tol=tol),number=1,repeat=num_reps))
+        print("    nufft_tol=%g: %.3f s (%.1fx), max relative error %.2g" %(tol,t_nufft,t_direct/t_nufft,err))
+
+    #monte carlo position uncertainty (azimuth cut at one frequency)
+    mybf.clear_position_perturbation()
+    az = np.deg2rad(np.arange(-90,90.5,0.5))
+    num_mc = 50
+    def mc_loop():
+        vals = []
+        for i in range(num_mc):
+            mybf.perturb_positions_normal([0.5,0.5,0.5,0,0,0],units='mm')
+            vals.append(mybf.beamform_azel(az,0,freq_list=freqs[-1]).mag_db)
+        mybf.clear_position_perturbation()
+        return np.std(vals,axis=0)
+    t_loop = min(timeit.repeat(mc_loop,number=1,repeat=num_reps))
+    t_mc = min(timeit.repeat(lambda: mybf.beamform_monte_carlo(az,0,num_mc,[0.5,0.5,0.5,0,0,0],freq_list=freqs[-1],units='mm'),
+                             number=1,repeat=num_reps))
+    tracemalloc.start()
+    mybf.beamform_monte_carlo(az,0,num_mc,[0.5,0.5,0.5,0,0,0],freq_list=freqs[-1],units='mm')
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print("Monte Carlo %d reps, %d angles: loop %.3f s, beamform_monte_carlo %.3f s (%.1fx), peak memory %.1f MB"
+          %(num_mc,len(az),t_loop,t_mc,t_loop/t_mc,peak/2**20))
+
+    #sweep over sub-apertures with masks (the loaded data cube is not repacked or copied)
+    az = np.deg2rad(np.arange(-90,91,1))
+    num_rows = 10
+    def sweep_sub_apertures():
+        for row in range(35-num_rows+1):
+            mybf.set_mask(np.arange(row*35,(row+num_rows)*35))
+            mybf.beamform_azel(az,0)
+        mybf.clear_mask()
+    t_sweep = min(timeit.repeat(sweep_sub_apertures,number=1,repeat=num_reps))
+    print("Sweep of %d %d row sub-apertures (181 angles): %.3f s" %(35-num_rows+1,num_rows,t_sweep))
+
+    #uncertainty of the pattern from MUF monte carlo data (one beamform per data_meas_num vs. one pass)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        num_mc = 20
+        mf_path = make_muf_metafile(tmp_dir,num_mc=num_mc)
+        az = np.deg2rad(np.arange(-90,91,1)); el = np.deg2rad(np.arange(-30,31,5))
+        def muf_loop():
+            vals = []
+            for i in range(num_mc):
+                mcbf = SamuraiBeamform(mf_path,units='mm',data_type='monte_carlo',data_meas_num=i)
+                vals.append(mcbf.beamform_azel(az,el).complex_values)
+            return calculate_statistics_from_array(np.array(vals))
+        mufbf = SamuraiBeamform(mf_path,units='mm')
+        t_loop = min(timeit.repeat(muf_loop,number=1,repeat=num_reps))
+        t_muf = min(timeit.repeat(lambda: mufbf.beamform_muf(az,el),number=1,repeat=num_reps))
+        tracemalloc.start()
+        mufbf.beamform_muf(az,el)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print("MUF %d monte carlo, %d positions, %dx%d angles: loop %.3f s, beamform_muf %.3f s (%.1fx), peak memory %.1f MB"
+              %(num_mc,len(mufbf.all_positions),len(el),len(az),t_loop,t_muf,t_loop/t_muf,peak/2**20))
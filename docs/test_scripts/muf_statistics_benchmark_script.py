@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for calculating the MUF statistics (estimate, confidence interval, standard uncertainty)
+from the Monte Carlo data in the unit test data
+
+@author: ajw5
+"""
+
+#%% imports
+import os
+import timeit
+import tracemalloc
+import numpy as np
+
+from samurai.base.TouchstoneEditor import SnpEditor
+from samurai.base.generic import complex2magphase,magphase2complex
+from samurai.base.MUF.MUFResult import calculate_statistics,calculate_statistics_streaming
+
+#%% previous implementation (each statistic packs and converts the data for each key)
+def calculate_statistics_per_key(data,confidence_interval=95):
+    '''@brief previous implementation of the estimate, confidence interval, and standard uncertainty'''
+    def get_data_dict():
+        return {k:np.array([tnp.S[k].raw for tnp in data]) for k in data[0].wave_dict_keys}
+    def new_editor():
+        return type(data[0])([data[0].num_ports,data[0].freq_list])
+    #estimate
+    data_dict = get_data_dict(); est = new_editor()
+    for k in est.wave_dict_keys:
+        m,p = complex2magphase(data_dict[k])
+        est[('S',k)][:] = magphase2complex(m.mean(0),p.mean(0))
+    #confidence interval
+    data_dict = get_data_dict(); ci_p = new_editor(); ci_m = new_editor()
+    lo_index = max(int(0.5*(1-confidence_interval/100)*len(data)),1); hi_index = len(data)-lo_index
+    for k in ci_p.wave_dict_keys:
+        m,p = complex2magphase(data_dict[k])
+        m.sort(0); p.sort(0)
+        ci_p[('S',k)][:] = magphase2complex(m[hi_index],p[hi_index])
+        ci_m[('S',k)][:] = magphase2complex(m[lo_index],p[lo_index])
+    #standard uncertainty
+    data_dict = get_data_dict(); su_p = new_editor(); su_m = new_editor()
+    for k in su_p.wave_dict_keys:
+        m,p = complex2magphase(data_dict[k])
+        su_p[('S',k)][:] = magphase2complex(m.mean(0)+m.std(0),p.mean(0)+p.std(0))
+        su_m[('S',k)][:] = magphase2complex(m.mean(0)-m.std(0),p.mean(0)-p.std(0))
+    return {'estimate':est,'confidence_interval':(ci_p,ci_m),'standard_uncertainty':(su_p,su_m)}
+
+#%% time the calculations
+if __name__=='__main__':
+    num_reps = 5
+    mc_dir = os.path.join(os.path.dirname(__file__),'..','..','samurai','base','unittest_data','meas_test','MonteCarlo')
+    mc_paths = sorted([os.path.join(mc_dir,f) for f in os.listdir(mc_dir)])
+    data = [SnpEditor(f) for f in mc_paths]
+    old = calculate_statistics_per_key(data)
+    new = calculate_statistics(data)
+    assert(old['estimate']==new['estimate'] and old['confidence_interval'][1]==new['confidence_interval'][1])
+    t_old = min(timeit.repeat(lambda: calculate_statistics_per_key(data),number=1,repeat=num_reps))
+    t_new = min(timeit.repeat(lambda: calculate_statistics(data),number=1,repeat=num_reps))
+    print("%d Monte Carlo s2p (%d frequencies): per key statistics %.4f s, calculate_statistics %.4f s (%.1fx)"
+          %(len(data),len(data[0].freq_list),t_old,t_new,t_old/t_new))
+    
+    #%% loading all of the files vs. streaming them one at a time (time and peak memory)
+    def peak_memory(funct):
+        tracemalloc.start()
+        funct()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak/2**20
+    load_all = lambda: calculate_statistics([SnpEditor(f) for f in mc_paths])
+    runs = {'load all':load_all}
+    for method in ['tails','p2']:
+        for n_workers in [1,4]:
+            runs['stream %s %d workers'%(method,n_workers)] = lambda m=method,n=n_workers: calculate_statistics_streaming(mc_paths,quantile_method=m,n_workers=n)
+    for name,funct in runs.items():
+        t = min(timeit.repeat(funct,number=1,repeat=num_reps))
+        print("%-24s %.4f s, peak memory %.1f MB"%(name,t,peak_memory(funct)))
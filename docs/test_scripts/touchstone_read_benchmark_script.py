@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for reading and writing text touchstone files (2, 4, and 8 port) with synthetic data (no data files needed)
+
+@author: ajw5
+"""
+
+#%% imports
+import os
+import re
+import timeit
+import tempfile
+import numpy as np
+
+from samurai.base.TouchstoneEditor import SnpEditor,MultilineFileParser
+from samurai.base.TouchstoneEditor import read_text_touchstone,write_text_touchstone,TouchstoneCache,TouchstoneArray
+from samurai.analysis.support.MetafileController import MetafileController
+from samurai.analysis.support.SamuraiBeamform import SamuraiBeamform
+from samurai.analysis.support.MetafileConverter import convert_metafile
+from samurai.analysis.support.ApertureCube import ApertureCube,write_aperture_cube
+
+#%% write synthetic files
+def write_synthetic_snp(file_path,num_ports,num_freqs=1601,pairs_per_line=None):
+    '''
+    @brief write a text snp file with random data
+    @param[in] file_path - path to write to
+    @param[in] num_ports - number of ports
+    @param[in/OPT] num_freqs - number of frequencies
+    @param[in/OPT] pairs_per_line - split records with this many real/imag pairs on each line
+        (e.g. 4 like many VNAs write *.s4p files). None writes each record on a single line
+    '''
+    rng = np.random.default_rng(1)
+    freqs = np.linspace(26.5,40,num_freqs)
+    data = rng.normal(size=(num_freqs,2*num_ports**2))
+    with open(file_path,'w') as fp:
+        fp.write('!Synthetic data for benchmarking\n#GHz S RI 50\n')
+        for f,vals in zip(freqs,data):
+            if pairs_per_line is None:
+                fp.write(' '.join([str(f)]+[str(v) for v in vals])+'\n')
+            else:
+                lines = [vals[i:i+2*pairs_per_line] for i in range(0,len(vals),2*pairs_per_line)]
+                fp.write(str(f)+' '+'\n'.join([' '.join([str(v) for v in l]) for l in lines])+'\n')
+    return file_path
+
+def read_text_touchstone_multiline(file_path):
+    '''@brief previous implementation (MultilineFileParser with a regex on each line into np.loadtxt)'''
+    fp = MultilineFileParser(file_path)
+    rc = re.compile(r'[ ,|\t]+')
+    raw_data = np.loadtxt((rc.sub(' ',l) for l in fp),comments=['#','!'])
+    fp.fid.close()
+    return raw_data
+
+def write_text_touchstone_per_value(file_path,out_data):
+    '''@brief previous implementation of writing text files (str(value).upper() for each value)'''
+    with open(file_path,'w+') as fp:
+        fp.write('#GHz S RI 50\n')
+        for line_data in out_data:
+            fp.write(' '.join([str(dat).upper() for dat in line_data])+'\n')
+    return file_path
+
+#%% time the readers
+if __name__=='__main__':
+    num_reps = 3
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for num_ports,pairs_per_line in [(2,None),(4,None),(4,4),(8,None),(8,4)]:
+            fpath = write_synthetic_snp(os.path.join(tmp_dir,'synthetic_%d_%s.s%dp' %(num_ports,pairs_per_line,num_ports)),
+                                        num_ports,pairs_per_line=pairs_per_line)
+            old_data = read_text_touchstone_multiline(fpath)
+            new_data = read_text_touchstone(fpath,read_header=True)['data']
+            assert(np.all(old_data==new_data))
+            t_old = min(timeit.repeat(lambda: read_text_touchstone_multiline(fpath),number=1,repeat=num_reps))
+            t_new = min(timeit.repeat(lambda: read_text_touchstone(fpath,read_header=True),number=1,repeat=num_reps))
+            t_snp = min(timeit.repeat(lambda: SnpEditor(fpath),number=1,repeat=num_reps))
+            print("%d port (%s): previous %.4f s, read_text_touchstone %.4f s (%.1fx), SnpEditor %.4f s"
+                  %(num_ports,'single line' if pairs_per_line is None else '%d pairs per line' %pairs_per_line,
+                    t_old,t_new,t_old/t_new,t_snp))
+            cache = TouchstoneCache(os.path.join(tmp_dir,'cache'))
+            cache.warm([fpath])
+            t_cache = min(timeit.repeat(lambda: cache.read_text_touchstone(fpath,read_header=True),number=1,repeat=num_reps))
+            print("    cached read %.4f s (%.1fx)" %(t_cache,t_new/t_cache))
+            data = read_text_touchstone(fpath)['data']
+            t_old = min(timeit.repeat(lambda: write_text_touchstone_per_value(fpath+'_out',data),number=1,repeat=num_reps))
+            t_new = min(timeit.repeat(lambda: write_text_touchstone(fpath+'_out',data),number=1,repeat=num_reps))
+            t_p10 = min(timeit.repeat(lambda: write_text_touchstone(fpath+'_out',data,precision=10),number=1,repeat=num_reps))
+            print("    write: previous %.4f s, write_text_touchstone %.4f s (%.1fx), precision=10 %.4f s (%.1fx)"
+                  %(t_old,t_new,t_old/t_new,t_p10,t_old/t_p10))
+
+    #partial reads of a 1351 point file (39-40 GHz and only the header)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for num_ports in [2,8]:
+            snp = SnpEditor(write_synthetic_snp(os.path.join(tmp_dir,'synthetic.s%dp' %num_ports),num_ports,num_freqs=1351))
+            for ftype in ['','_binary']:
+                fpath = snp.write(os.path.join(tmp_dir,'synthetic.s%dp%s' %(num_ports,ftype)))
+                t_full = min(timeit.repeat(lambda: SnpEditor(fpath).crop(39e9,40e9),number=1,repeat=num_reps))
+                t_range = min(timeit.repeat(lambda: SnpEditor(fpath,freq_range=(39e9,40e9)),number=1,repeat=num_reps))
+                t_header = min(timeit.repeat(lambda: SnpEditor(fpath,header_only=True),number=1,repeat=num_reps))
+                print("s%dp%s 1351 points: read and crop %.4f s, freq_range %.4f s (%.1fx), header_only %.4f s (%.1fx)"
+                      %(num_ports,ftype,t_full,t_range,t_full/t_range,t_header,t_full/t_header))
+
+    #open a 35x35 aperture of *.s2p_binary files
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        snp = SnpEditor(write_synthetic_snp(os.path.join(tmp_dir,'synthetic.s2p'),2))
+        fpaths = [snp.write(os.path.join(tmp_dir,'meas_%d.s2p_binary' %i)) for i in range(35*35)]
+        for memmap in [False,True]:
+            t_open = min(timeit.repeat(lambda: [SnpEditor(f,memmap=memmap) for f in fpaths],number=1,repeat=num_reps))
+            print("Open %d s2p_binary files memmap=%s: %.3f s" %(len(fpaths),memmap,t_open))
+            t_open = min(timeit.repeat(lambda: [TouchstoneArray(f,memmap=memmap) for f in fpaths],number=1,repeat=num_reps))
+            print("Open %d s2p_binary files with TouchstoneArray memmap=%s: %.3f s" %(len(fpaths),memmap,t_open))
+
+        #load the aperture from a metafile and from a single file aperture cube
+        mf = MetafileController(None)
+        mf.set_wdir(tmp_dir)
+        for i,f in enumerate(fpaths):
+            mf.add_measurement(f,position=[3*(i%35),3*(i//35),0,0,0,0],units='mm')
+        mf_path = mf.write(os.path.join(tmp_dir,'metafile.json'))
+        for n_workers,executor in [(1,'thread'),(4,'thread'),(4,'process')]:
+            t_load = min(timeit.repeat(lambda: MetafileController(mf_path).load_data(n_workers=n_workers,executor=executor),number=1,repeat=num_reps))
+            print("MetafileController.load_data n_workers=%d (%s): %.3f s" %(n_workers,executor,t_load))
+        t_convert = timeit.timeit(lambda: MetafileController(mf_path).to_aperture_cube(),number=1)
+        cube_path = MetafileController(mf_path).to_aperture_cube()
+        az = np.deg2rad(np.arange(-90,91,1))
+        for name,path,kwargs in [('metafile',mf_path,{}),('metafile (TouchstoneArray)',mf_path,{'touchstone_class':TouchstoneArray}),
+                                 ('aperture cube',cube_path,{})]:
+            t_load = min(timeit.repeat(lambda: SamuraiBeamform(path,units='mm',**kwargs),number=1,repeat=num_reps))
+            t_bf = min(timeit.repeat(lambda: SamuraiBeamform(path,units='mm',**kwargs).beamform_azel(az,0),number=1,repeat=num_reps))
+            print("Load from %s: %.3f s, load and beamform 181 angles: %.3f s" %(name,t_load,t_bf))
+        print("Conversion to aperture cube: %.3f s" %(t_convert))
+
+    #convert a 35x35 aperture of *.s2p files to binary files and to an aperture cube
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        snp = SnpEditor(write_synthetic_snp(os.path.join(tmp_dir,'synthetic.s2p'),2))
+        mf = MetafileController(None)
+        mf.set_wdir(tmp_dir)
+        for i in range(35*35):
+            mf.add_measurement(snp.write(os.path.join(tmp_dir,'meas_%d.s2p' %i)),position=[3*(i%35),3*(i//35),0,0,0,0],units='mm')
+        mf_path = mf.write(os.path.join(tmp_dir,'metafile.json'))
+        fpaths = MetafileController(mf_path).get_filename_list(abs_path=True)
+        t_old = timeit.timeit(lambda: [SnpEditor(f).write(os.path.join(tmp_dir,'old',os.path.basename(f)+'_binary'))
+                                       for f in fpaths if os.makedirs(os.path.join(tmp_dir,'old'),exist_ok=True) is None],number=1)
+        print("Convert %d s2p files with SnpEditor: %.3f s" %(len(fpaths),t_old))
+        for n_workers in [1,4]:
+            out_dir = os.path.join(tmp_dir,'binary_%d' %n_workers)
+            t_convert = timeit.timeit(lambda: convert_metafile(mf_path,out_dir,n_workers=n_workers),number=1)
+            t_restart = timeit.timeit(lambda: convert_metafile(mf_path,out_dir,n_workers=n_workers),number=1)
+            t_cube = timeit.timeit(lambda: convert_metafile(mf_path,out_dir,n_workers=n_workers,out_format='cube'),number=1)
+            print("convert_metafile n_workers=%d: binary %.3f s (%.1fx), rerun when finished %.3f s, cube %.3f s"
+                  %(n_workers,t_convert,t_old/t_convert,t_restart,t_cube))
+
+    #compressed binary files and cubes of the measured Monte Carlo data in the unit test data
+    mc_dir = os.path.join(os.path.dirname(__file__),'..','..','samurai','base','unittest_data','meas_test','MonteCarlo')
+    mc_paths = sorted([os.path.join(mc_dir,f) for f in os.listdir(mc_dir)])
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        mc = [TouchstoneArray(f) for f in mc_paths]
+        for compression in [None,'zlib','lzma']:
+            fpath = mc[0].write(os.path.join(tmp_dir,'mc_%s.s2p_binary' %compression),compression=compression)
+            t_write = min(timeit.repeat(lambda: mc[0].write(fpath,compression=compression),number=1,repeat=num_reps))
+            t_full = min(timeit.repeat(lambda: TouchstoneArray(fpath),number=1,repeat=num_reps))
+            t_range = min(timeit.repeat(lambda: TouchstoneArray(fpath,freq_range=(39e9,40e9)),number=1,repeat=num_reps))
+            print("s2p_binary compression=%s: %d bytes, write %.4f s, read %.4f s, 39-40 GHz read %.4f s"
+                  %(compression,os.path.getsize(fpath),t_write,t_full,t_range))
+        data = np.array([m.raw for m in mc])
+        for compression in [None,'zlib','lzma']:
+            cube_path = os.path.join(tmp_dir,'mc_%s.cube.json' %compression)
+            t_write = timeit.timeit(lambda: write_aperture_cube(cube_path,data,mc[0].freq_list,list(mc[0].columns),compression=compression),number=1)
+            cube = ApertureCube(cube_path)
+            t_pos = min(timeit.repeat(lambda: ApertureCube(cube_path).data[50],number=1,repeat=num_reps))
+            t_all = min(timeit.repeat(lambda: np.array(ApertureCube(cube_path).data[...]),number=1,repeat=num_reps))
+            print("%d position cube compression=%s: %d bytes, write %.3f s, read one position %.4f s, read all %.3f s"
+                  %(len(mc),compression,os.path.getsize(cube.data_path),t_write,t_pos,t_all))
+            del cube
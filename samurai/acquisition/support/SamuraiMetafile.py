@@ -14,6 +14,7 @@ import json
 import numpy as np
 from datetime import datetime as dt
 import six
+from copy import deepcopy
 import getpass
 
 from samurai.base.SamuraiDict import SamuraiDict
@@ -120,7 +121,7 @@ class SamuraiMetafile(OrderedDict):
         
         #add default values
         for k,v in DEFAULT_METADATA_DICT.items():
-            self[k] = v
+            self[k] = deepcopy(v) #dont share the measurements list between metafiles
 
         #Some other input values
         self['csv_path'] = csv_path
@@ -14,12 +14,14 @@
 
 #import sys
 import os
+import numpy as np
 
 #from samurai.analysis.support.snpEditor import s2pEditor as s2p
 from samurai.analysis.support.MetaFileController import MetaFileController as mfc
 from samurai.analysis.support.MetaFileController import set_metafile_meas_relative
 #from samurai.analysis.support.metaFileController import update_wdir
 from samurai.base.MUF.PostProcPy import PostProcPy as pppy
+from samurai.base.MUF.MUFModuleController import run_modules
 from samurai.base.generic import deprecated
 from samurai.analysis.support.MetaFileController import copy_touchstone_from_muf
 
@@ -84,31 +86,66 @@ class CalibrateSamurai:
         #path to our .meas error box file
         self.in_cal_path = in_cal_path
         self.switch_terms_path = gthru_file_path #only used for s parameters
+        self.result_menu_names = None #name of the menu that calibrated each measurement (when split into shards)
   
+    def _create_post_proc(self,dut_list,menu_name=None):
+        '''
+        @brief create a post processor menu to calibrate a list of DUTs
+        @param[in] dut_list - list of absolute paths of the DUTs to calibrate
+        @param[in/OPT] menu_name - name of the menu in self.out_dir (default to name of self.post_proc_template)
+        @return PostProcPy with the menu path set to the output directory
+        '''
+        ppc = pppy(self.post_proc_template,**self.options)
+        if menu_name is None:
+            menu_name = os.path.splitext(os.path.split(self.post_proc_template)[1])[0]
+        #now rename
+        ppc.rename(os.path.join(self.out_dir,menu_name+os.path.splitext(self.post_proc_template)[1]))
+        #now set cal path
+        ppc.setCalPath(self.in_cal_path)
+        if not (self.options['wave_params_flg']): #only set switch terms for wave params
+            ppc.set_switch_terms(self.switch_terms_path)
+        #and populate the duts
+        ppc.setDUTFromList(dut_list)
+        return ppc
+
     #calibrate in post processor and save in output directory
-    def populate_post_proc_and_calibrate(self):
-        '''@brief calibrate in the MUF post processor and save the output'''
+    def populate_post_proc_and_calibrate(self,**arg_options):
+        '''
+        @brief calibrate in the MUF post processor and save the output
+        @param[in/OPT] arg_options - keyword arguments as follows
+            num_shards - number of post processor menus to split the DUTs into (default 1)
+            n_workers - number of post processors to run at once. None runs all shards at once (default None)
+            text_function - function to pass each line of the post processor output to (default print)
+        @note each shard is a menu named <template name>_shard<i> in the output directory. Its results are 
+            copied back with the same names as a single menu would produce so the metafile is the same
+        '''
+        options = {}
+        options['num_shards'] = 1
+        options['n_workers'] = None
+        options['text_function'] = print
+        for k,v in arg_options.items():
+            options[k] = v
         #ensure our metafile is updated to the current folder it is in
         self.mfc.wdir = os.path.dirname(self.metaFile)
         #get our list of values from the old folder both with and without absolute path
         fnames_abs = self.mfc.get_filename_list(True)
-        #open our post proc object and rename to our new directory
         print(self.post_proc_template)
-        self.ppc = pppy(self.post_proc_template,**self.options)
-        out_name = os.path.split(self.post_proc_template)[1] #get the file name
-        #now rename
-        self.ppc.rename(os.path.join(self.out_dir,out_name))
-        #now set cal path
-        self.ppc.setCalPath(self.in_cal_path)
-        if not (self.options['wave_params_flg']): #only set switch terms for wave params
-            self.ppc.set_switch_terms(self.switch_terms_path)
-        #and populate the duts
-        self.ppc.setDUTFromList(fnames_abs)
-        #now check our checkboxes to see what we want to do
-        #self.ppc.convert_to_s2p(convert_to_s2p_flg);
-        #then write and run
-        print("Running Calibration in "+str(self.out_dir))
-        self.ppc.run()
+        num_shards = max(min(options['num_shards'],len(fnames_abs)),1)
+        if num_shards==1:
+            #open our post proc object in our new directory
+            self.ppc = self._create_post_proc(fnames_abs)
+            self.result_menu_names = None
+            #then write and run
+            print("Running Calibration in "+str(self.out_dir))
+            self.ppc.run(text_function=options['text_function'])
+        else:
+            menu_name = os.path.splitext(os.path.split(self.post_proc_template)[1])[0]
+            shard_menu_names = ['{}_shard{}'.format(menu_name,i) for i in range(num_shards)]
+            shard_idx = np.array_split(np.arange(len(fnames_abs)),num_shards) #keep measurements in order
+            self.ppc = [self._create_post_proc([fnames_abs[i] for i in idx],name) for idx,name in zip(shard_idx,shard_menu_names)]
+            self.result_menu_names = [name for idx,name in zip(shard_idx,shard_menu_names) for i in idx]
+            print("Running Calibration in {} with {} shards".format(self.out_dir,num_shards))
+            run_modules(self.ppc,n_workers=options['n_workers'],text_function=options['text_function'])
         print("Calibration Complete. Updating MetaFile and Moving Data...")
         #update metafile and move data
         mf_out_path = self.update_metafile_and_move() 
@@ -149,21 +186,23 @@ class CalibrateSamurai:
         fnames = self.mfc.filenames #get the original file names
         #our calibration folder name
         cal_menu_name = os.path.splitext(os.path.split(self.post_proc_template)[-1])[0] #get the name of our file (this is added to output names of *.meas files)
-        cal_folder_path = os.path.join(self.out_dir,cal_menu_name+'_post_Results') #full path to our calibration folder
         
         #make the subdir if it doesnt exist
         if not os.path.exists(os.path.join(self.out_dir,subdir)):
             os.mkdir(os.path.join(self.out_dir,subdir))
 
+        #menu each measurement was calibrated with (shards have their own results folders)
+        result_menu_names = self.result_menu_names
+        if result_menu_names is None:
+            result_menu_names = [cal_menu_name]*len(fnames)
         fname_out_list = []            
         #now loop through each name to copy the files
-        for fname in fnames:
+        for fname,result_menu_name in zip(fnames,result_menu_names):
             meas_name = os.path.split(fname)[-1] #in case the measurements are in some subdirectory
             meas_name,meas_ext = os.path.splitext(meas_name)
             #we will always have *.meas here
-            meas_name += '_'+cal_menu_name+'.meas'
-            copy_src = os.path.join(cal_folder_path,meas_name)
-            copy_dst = os.path.join(self.out_dir,subdir)#now set our copy destination
+            copy_src = os.path.join(self.out_dir,result_menu_name+'_post_Results',meas_name+'_'+result_menu_name+'.meas')
+            copy_dst = os.path.join(self.out_dir,subdir,meas_name+'_'+cal_menu_name+'.meas')#now set our copy destination
             #now we actually copy
             meas_out_name = copy(copy_src,copy_dst)
             #make list of output file names
@@ -212,6 +251,57 @@ class CalibrateSamurai:
         self._update_metafile(subdir)
         '''
 
+#%% Unit testing
+import unittest
+class TestCalibrateSamurai(unittest.TestCase):
+    '''@brief tests for calibrating with the post processor (a stub script stands in for the MUF)'''
+
+    #writes <menu>_post_Results/<dut>_<menu>.meas for each DUT like the post processor
+    stub_script = '\n'.join([
+        "import os,sys,shutil",
+        "sys.path.insert(0,{repo_dir!r})",
+        "from samurai.base.MUF.PostProcPy import PostProcPy",
+        "from samurai.base.MUF.MUFModuleController import MUFItemList",
+        "from samurai.base.MUF.MUFResult import MUFResult",
+        "menu_path = sys.argv[sys.argv.index('-r')+1]",
+        "menu_name = os.path.splitext(os.path.basename(menu_path))[0]",
+        "res_dir = os.path.join(os.path.dirname(menu_path),menu_name+'_post_Results')",
+        "for item in MUFItemList(PostProcPy(menu_path).controls.find('MultipleMeasurementsList')):",
+        "    os.makedirs(os.path.join(res_dir,item[0]),exist_ok=True)",
+        "    nom_path = shutil.copy(item[1],os.path.join(res_dir,item[0],menu_name+'_0.s2p'))",
+        "    res = MUFResult(); res.set_nominal(nom_path)",
+        "    res.write_xml(os.path.join(res_dir,item[0]+'_'+menu_name+'.meas'))",
+        "    print('Calibrated '+item[0])"])
+
+    def test_sharded_calibration(self):
+        '''@brief calibrating in shards should give the same metafile and data as a single menu'''
+        import io
+        import sys
+        import tempfile
+        from contextlib import redirect_stdout
+        from samurai.analysis.support.MetafileController import write_random_metafile
+        repo_dir = os.path.abspath(os.path.join(file_dir,'../../..'))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            stub_path = os.path.join(tmp_dir,'post_processor_stub.py')
+            with open(stub_path,'w') as fp:
+                fp.write(self.stub_script.format(repo_dir=repo_dir))
+            meas_dir = os.path.join(tmp_dir,'synthetic_aperture')
+            mf_path = write_random_metafile(meas_dir,[[i,0,0,0,0,0] for i in range(5)])
+            out_paths = {}
+            for num_shards in [1,3]:
+                out_dir = os.path.join(tmp_dir,'calibrated_{}'.format(num_shards))
+                os.makedirs(out_dir)
+                cs = CalibrateSamurai(mf_path,out_dir,os.path.join(meas_dir,'meas_0.s2p'),
+                                      os.path.join(meas_dir,'meas_1.s2p'),exe_path=[sys.executable,stub_path])
+                lines = []
+                with redirect_stdout(io.StringIO()):
+                    out_paths[num_shards] = cs.populate_post_proc_and_calibrate(num_shards=num_shards,n_workers=2,text_function=lines.append)
+                self.assertEqual(len(lines),5)
+            serial,sharded = [mfc(out_paths[n]) for n in [1,3]]
+            self.assertEqual([os.path.basename(f) for f in serial.filenames],[os.path.basename(f) for f in sharded.filenames])
+            for s,t,m in zip(serial.load_data(),sharded.load_data(),mfc(mf_path).load_data()):
+                self.assertTrue(np.all(t.raw==m.raw) and np.all(s.raw==m.raw))
+
 if __name__=='__main__':
     '''
     mf_path = r"\\cfs2w\67_ctl\67Internal\DivisionProjects\Channel Model Uncertainty\Measurements\antennas\Measurements\6-25-2019\synthetic_aperture\metafile.json"
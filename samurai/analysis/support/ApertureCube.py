@@ -0,0 +1,438 @@
+# -*- coding: utf-8 -*-
+"""
+@brief Single file storage for all of the measurements of an aperture.
+    The data is stored as one contiguous (position x frequency x column) complex array in a *.cube.npy
+    file that can be memory mapped. A small json sidecar (*.cube.json) stores the frequencies,
+    touchstone columns (wave,key), positions, and the metafile header.
+    The data can also be compressed (zlib or lzma) in blocks of (positions x frequencies) in a *.cube.zdat
+    file (see CompressedFrames). Only the blocks needed for the requested positions and frequencies are decompressed.
+
+@author: ajw5
+"""
+import os
+import numpy as np
+
+from samurai.base.SamuraiDict import SamuraiDict
+from samurai.base.CompressedFrames import FrameWriter,FrameReader
+
+APERTURE_CUBE_EXTENSION      = '.cube.json' #sidecar
+APERTURE_CUBE_DATA_EXTENSION = '.cube.npy'  #data
+APERTURE_CUBE_COMPRESSED_DATA_EXTENSION = '.cube.zdat' #compressed data
+APERTURE_CUBE_VERSION = 1.0
+DEFAULT_CUBE_CHUNK_SHAPE = [32,256] #(positions,frequencies) of each compressed block
+
+def is_aperture_cube(file_path):
+    '''
+    @brief check if a path is an aperture cube sidecar (*.cube.json)
+    @param[in] file_path - path to check
+    '''
+    return isinstance(file_path,str) and file_path.endswith(APERTURE_CUBE_EXTENSION)
+
+class ApertureCube(SamuraiDict):
+    '''
+    @brief Class for the sidecar and data of a single file aperture.
+        The dictionary values are the sidecar and the data is accessed with self.data
+    @param[in/OPT] cube_path - path to the sidecar (*.cube.json) to load (default None)
+    @param[in/OPT] arg_options - keyword arguments as follows:
+        - memmap - memory map the data. Only the pages that are used are read from disk (default True)
+    @example
+        # convert a metafile to an aperture cube
+        cube_path = MetafileController('path/to/metafile.json').to_aperture_cube()
+
+        # load the data without creating TouchstoneEditors
+        cube = ApertureCube(cube_path)
+        s21 = cube.get_data(21) #(position x frequency x 1) view of the data
+
+        # or beamform directly from the cube
+        mybf = SamuraiBeamform(cube_path)
+
+        # compressed cube. Indexing only decompresses the blocks that are needed
+        cube_path = MetafileController('path/to/metafile.json').to_aperture_cube(compression='zlib')
+        s21_pos_10 = ApertureCube(cube_path).data[10,:,1]
+    '''
+    def __init__(self,cube_path=None,**arg_options):
+        '''@brief constructor'''
+        super().__init__()
+        self.options = {}
+        self.options['memmap'] = True
+        for k,v in arg_options.items():
+            self.options[k] = v
+        self.cube_path = None
+        self._data = None
+        if cube_path is not None:
+            self.load(cube_path)
+
+    @classmethod
+    def create(cls,cube_path,num_positions,freq_list,columns,**arg_options):
+        '''
+        @brief create a new aperture cube on disk to be filled in (e.g. one measurement at a time)
+        @param[in] cube_path - path of the sidecar to write (should end in *.cube.json)
+        @param[in] num_positions - number of positions (measurements) in the aperture
+        @param[in] freq_list - list of frequencies in Hz
+        @param[in] columns - list of (wave,key) touchstone columns (e.g. [('S',11),('S',21),...])
+        @param[in/OPT] arg_options - keyword arguments as follows:
+            - positions - [[x,y,z,alpha,beta,gamma],...] positions of each measurement (default None)
+            - header - touchstone header of the data (default 'GHz S RI 50')
+            - metafile - dictionary of the metafile header (default {})
+            - filenames - list of the files the data was created from (default [])
+            - compression - None for a memory mapped *.cube.npy or 'zlib'/'lzma' for a compressed
+                *.cube.zdat file (default None)
+            - compression_level - level of the compression. None uses the default of the library
+            - chunk_shape - (positions,frequencies) of each compressed block (default [32,256])
+        @note the sidecar is not written until self.write() is called
+        @note compressed data is write-only (one position at a time e.g. cube.data[i] = meas.raw) until self.write() is called.
+            Each block is compressed as soon as all of its positions are written
+        @return ApertureCube with a writable memory mapped self.data of zeros
+        '''
+        compression = arg_options.get('compression',None)
+        cube = cls()
+        cube['cube_version'] = APERTURE_CUBE_VERSION
+        cube['data_file'] = get_data_file_name(cube_path,compression is not None)
+        cube['shape'] = [int(num_positions),len(freq_list),len(columns)]
+        cube['freq_list'] = [float(f) for f in freq_list]
+        cube['columns'] = [[str(w),int(k)] for w,k in columns]
+        cube['positions'] = arg_options.get('positions',None)
+        cube['header'] = arg_options.get('header','GHz S RI 50')
+        cube['metafile'] = arg_options.get('metafile',{})
+        cube['filenames'] = arg_options.get('filenames',[])
+        cube.cube_path = cube_path
+        if compression is None:
+            cube._data = np.lib.format.open_memmap(cube.data_path,mode='w+',dtype=np.cdouble,shape=tuple(cube['shape']))
+        else:
+            cube['compression'] = compression
+            cube['chunk_shape'] = [int(c) for c in arg_options.get('chunk_shape',DEFAULT_CUBE_CHUNK_SHAPE)]
+            cube._data = CompressedCubeWriter(cube.data_path,cube['shape'],cube['chunk_shape'],compression,
+                                              arg_options.get('compression_level',None))
+        return cube
+
+    def load(self,cube_path,**kwargs):
+        '''
+        @brief load the sidecar of an aperture cube. The data is opened when it is first accessed
+        @param[in] cube_path - path to the sidecar (*.cube.json)
+        @param[in/OPT] kwargs - passed to SamuraiDict.load
+        '''
+        super().load(cube_path,**kwargs)
+        self.cube_path = cube_path
+        self._data = None
+
+    def write(self,cube_path=None,**kwargs):
+        '''
+        @brief write the sidecar and flush any changes to the data
+        @param[in/OPT] cube_path - path to write the sidecar to. This must be the same directory
+            as the data file (default self.cube_path)
+        @param[in/OPT] kwargs - passed to SamuraiDict.write
+        @return path to the sidecar
+        '''
+        if cube_path is None:
+            cube_path = self.cube_path
+        if isinstance(self._data,np.memmap):
+            self._data.flush()
+        if isinstance(self._data,CompressedCubeWriter): #finish the file and read it from now on
+            self._data.close()
+            self._data = None
+        return super().write(cube_path,**kwargs)
+
+    @property
+    def data_path(self):
+        '''@brief absolute path to the *.cube.npy data file'''
+        return os.path.join(os.path.dirname(os.path.abspath(self.cube_path)),self['data_file'])
+
+    @property
+    def compression(self):
+        '''@brief compression of the data (None if it is not compressed)'''
+        return self.get('compression',None)
+
+    @property
+    def data(self):
+        '''
+        @brief getter for the (position x frequency x column) complex data.
+            If self.options['memmap'] is True this is a read-only memory map of the file.
+            Compressed data is a CompressedCubeData that decompresses the blocks needed when indexed
+        '''
+        if self._data is None:
+            if self.compression is not None:
+                data = CompressedCubeData(self.data_path)
+            else:
+                data = np.load(self.data_path,mmap_mode='r' if self.options['memmap'] else None)
+            if list(data.shape)!=list(self['shape']):
+                raise ApertureCubeError("Shape of {} {} does not match the sidecar {}".format(self.data_path,data.shape,self['shape']))
+            self._data = data
+        return self._data
+
+    @property
+    def freq_list(self):
+        '''@brief getter for the frequencies in Hz'''
+        return np.array(self['freq_list'])
+
+    @property
+    def positions(self):
+        '''@brief getter for the positions as a numpy array'''
+        return None if self['positions'] is None else np.array(self['positions'])
+
+    @property
+    def columns(self):
+        '''@brief getter for a list of the (wave,key) touchstone columns of the data'''
+        return [(w,int(k)) for w,k in self['columns']]
+
+    @property
+    def num_positions(self):
+        '''@brief getter for the number of positions in the aperture'''
+        return self['shape'][0]
+
+    def get_column_index(self,keys,wave='S'):
+        '''
+        @brief get the index of the last axis of the data for a set of keys
+        @param[in] keys - key or list of keys (e.g. 21 or [11,21])
+        @param[in/OPT] wave - wave of the keys (default 'S')
+        @return a slice if the columns are evenly spaced, otherwise a list of indices
+        '''
+        if not hasattr(keys,'__len__'):
+            keys = [keys]
+        columns = self.columns
+        try:
+            idx = [columns.index((wave,int(k))) for k in keys]
+        except ValueError:
+            raise ApertureCubeError("Keys {} not all in columns {}".format(list(keys),columns))
+        steps = np.diff(idx)
+        if len(idx)==1 or (np.all(steps==steps[0]) and steps[0]>0):
+            return slice(idx[0],idx[-1]+1,int(steps[0]) if len(idx)>1 else 1)
+        return idx
+
+    def get_data(self,keys,wave='S'):
+        '''
+        @brief get the (position x frequency x key) data for a set of keys
+        @param[in] keys - key or list of keys (e.g. 21 or [11,21])
+        @param[in/OPT] wave - wave of the keys (default 'S')
+        @return array of the data. This is a view (no data read) when the keys are evenly spaced columns
+        '''
+        return self.data[...,self.get_column_index(keys,wave)]
+
+def get_data_file_name(cube_path,compressed=False):
+    '''
+    @brief get the name of the data file for a given sidecar path
+    @param[in] cube_path - path of the sidecar (*.cube.json)
+    @param[in/OPT] compressed - get the name of a compressed data file (default False)
+    '''
+    name = os.path.basename(cube_path)
+    if name.endswith(APERTURE_CUBE_EXTENSION):
+        name = name[:-len(APERTURE_CUBE_EXTENSION)]
+    return name+(APERTURE_CUBE_COMPRESSED_DATA_EXTENSION if compressed else APERTURE_CUBE_DATA_EXTENSION)
+
+def write_aperture_cube(cube_path,data,freq_list,columns,**arg_options):
+    '''
+    @brief write an aperture cube from an array of data
+    @param[in] cube_path - path of the sidecar to write (should end in *.cube.json)
+    @param[in] data - (position x frequency x column) complex data
+    @param[in] freq_list - list of frequencies in Hz
+    @param[in] columns - list of (wave,key) touchstone columns
+    @param[in/OPT] arg_options - keyword arguments passed to ApertureCube.create
+    @return path to the written sidecar
+    '''
+    cube = ApertureCube.create(cube_path,np.shape(data)[0],freq_list,columns,**arg_options)
+    if cube.compression is None:
+        cube.data[:] = data
+    else:
+        for i in range(np.shape(data)[0]):
+            cube.data[i] = data[i]
+    return cube.write()
+
+#%% Compressed data
+class CompressedCubeWriter(object):
+    '''
+    @brief write (position x frequency x column) data to a compressed file one position at a time.
+        Positions are buffered until all of the positions of a block are set and then each
+        (positions x frequencies) block is compressed and written to the file
+    @param[in] file_path - path of the *.cube.zdat file
+    @param[in] shape - (position,frequency,column) shape of the data
+    @param[in] chunk_shape - (positions,frequencies) of each block
+    @param[in/OPT] compression - 'zlib' or 'lzma' (default 'zlib')
+    @param[in/OPT] level - compression level. None uses the default of the library
+    '''
+    def __init__(self,file_path,shape,chunk_shape,compression='zlib',level=None):
+        '''@brief Constructor'''
+        self.shape = tuple(shape)
+        self.chunk_shape = tuple(chunk_shape)
+        self._writer = FrameWriter(file_path,compression,level)
+        self._blocks = {} #position block index -> [buffer,set of positions written]
+        self._written_blocks = set()
+
+    def __setitem__(self,idx,value):
+        '''@brief set the data of a single position (e.g. writer[i] = meas.raw)'''
+        if not isinstance(idx,(int,np.integer)):
+            raise ApertureCubeError("Compressed cubes can only be written one position at a time")
+        idx = int(range(self.shape[0])[idx])
+        bi,pc = divmod(idx,self.chunk_shape[0])
+        if bi in self._written_blocks:
+            raise ApertureCubeError("Position {} was already compressed and written".format(idx))
+        buffer,written = self._get_block(bi)
+        buffer[pc] = value
+        written.add(pc)
+        if len(written)==buffer.shape[0]: #all positions are set
+            self._write_block(bi)
+
+    def _get_block(self,bi):
+        '''@brief get the [buffer,set of positions written] of a position block'''
+        if bi not in self._blocks:
+            num_pos = min(self.chunk_shape[0],self.shape[0]-bi*self.chunk_shape[0])
+            self._blocks[bi] = [np.zeros((num_pos,)+self.shape[1:],dtype=np.cdouble),set()]
+        return self._blocks[bi]
+
+    def _write_block(self,bi):
+        '''@brief compress and write each frequency block of a position block'''
+        buffer,_ = self._blocks.pop(bi)
+        self._written_blocks.add(bi)
+        num_freq_blocks = get_num_blocks(self.shape[1],self.chunk_shape[1])
+        for fi in range(num_freq_blocks):
+            fslice = slice(fi*self.chunk_shape[1],(fi+1)*self.chunk_shape[1])
+            self._writer.write_frame(buffer[:,fslice],bi*num_freq_blocks+fi)
+
+    def close(self):
+        '''@brief write any partially set blocks (unset positions are zero) and finish the file'''
+        for bi in range(get_num_blocks(self.shape[0],self.chunk_shape[0])):
+            if bi not in self._written_blocks:
+                self._get_block(bi)
+                self._write_block(bi)
+        self._writer.info.update({'shape':list(self.shape),'chunk_shape':list(self.chunk_shape)})
+        self._writer.close()
+
+class CompressedCubeData(object):
+    '''
+    @brief read-only array like access to compressed cube data. Indexing (e.g. data[10:20,:,1])
+        only reads and decompresses the (positions x frequencies) blocks that contain the requested values
+    @param[in] file_path - path of the *.cube.zdat file
+    @param[in/OPT] cache_frames - number of decompressed blocks to keep (default 16)
+    '''
+    def __init__(self,file_path,cache_frames=16):
+        '''@brief Constructor'''
+        self._reader = FrameReader(file_path,cache_frames=cache_frames)
+        self.shape = tuple(self._reader.info['shape'])
+        self.chunk_shape = tuple(self._reader.info['chunk_shape'])
+        self.dtype = np.dtype(np.cdouble)
+
+    @property
+    def ndim(self): return len(self.shape)
+
+    def __len__(self): return self.shape[0]
+
+    def __array__(self,dtype=None):
+        return np.asarray(self[...],dtype=dtype)
+
+    def __getitem__(self,key):
+        '''@brief get the decompressed values of an index like a numpy array'''
+        if not isinstance(key,tuple):
+            key = (key,)
+        if any([k is Ellipsis for k in key]): #expand to all 3 axes
+            ei = [k is Ellipsis for k in key].index(True)
+            key = key[:ei]+(slice(None),)*(len(self.shape)-len(key)+1)+key[ei+1:]
+        key = key+(slice(None),)*(len(self.shape)-len(key))
+        #positions and frequencies to decompress
+        idx = [np.arange(n)[k] for n,k in zip(self.shape[:2],key[:2])]
+        if not all([np.size(i) for i in idx]): #nothing to read. Get the shape numpy would give
+            return np.broadcast_to(np.zeros((),dtype=self.dtype),self.shape)[key].copy()
+        lo = [int(np.min(i)) for i in idx]
+        hi = [int(np.max(i))+1 for i in idx]
+        buf = np.empty((hi[0]-lo[0],hi[1]-lo[1],self.shape[2]),dtype=self.dtype)
+        num_freq_blocks = get_num_blocks(self.shape[1],self.chunk_shape[1])
+        for bi in range(lo[0]//self.chunk_shape[0],-(-hi[0]//self.chunk_shape[0])):
+            for fi in range(lo[1]//self.chunk_shape[1],-(-hi[1]//self.chunk_shape[1])):
+                block = self._reader.read_frame(bi*num_freq_blocks+fi)
+                p0,f0 = bi*self.chunk_shape[0],fi*self.chunk_shape[1]
+                plo,phi = max(lo[0],p0),min(hi[0],p0+block.shape[0])
+                flo,fhi = max(lo[1],f0),min(hi[1],f0+block.shape[1])
+                buf[plo-lo[0]:phi-lo[0],flo-lo[1]:fhi-lo[1]] = block[plo-p0:phi-p0,flo-f0:fhi-f0]
+        #index the values that were read with the same key relative to lo so numpy handles 
+        # the broadcasting of index arrays and the placement of their axes
+        rel_key = []
+        for n,k,i,l in zip(self.shape[:2],key[:2],idx,lo):
+            if isinstance(k,slice): #slices stay slices (views)
+                r = range(n)[k]
+                rel_key.append(slice(r.start-l,r.stop-l if r.stop-l>=0 else None,r.step))
+            elif np.ndim(i)==0:
+                rel_key.append(int(i)-l)
+            else:
+                rel_key.append(i-l)
+        return buf[tuple(rel_key)+(key[2],)]
+
+def get_num_blocks(length,chunk_length):
+    '''@brief number of blocks of chunk_length needed to cover length values'''
+    return max(-(-length//chunk_length),1)
+
+class ApertureCubeError(Exception):
+    '''@brief error for malformed or mismatched aperture cubes'''
+    pass
+
+#%% Unit testing
+import unittest
+class TestApertureCube(unittest.TestCase):
+    '''@brief tests for writing, converting, and loading aperture cubes'''
+
+    def test_metafile_conversion(self):
+        '''@brief convert a metafile of s2p files to a cube and beamform from it'''
+        import tempfile
+        from samurai.analysis.support.MetafileController import MetafileController,write_random_metafile
+        from samurai.analysis.support.SamuraiBeamform import SamuraiBeamform
+        [X,Y] = np.meshgrid(np.arange(4)*3.,np.arange(4)*3.)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            mf_path = write_random_metafile(tmp_dir,[[x,y,0,0,0,0] for x,y in zip(X.flatten(),Y.flatten())],np.linspace(26.5e9,40e9,5))
+            cube_path = MetafileController(mf_path).to_aperture_cube()
+            cube = ApertureCube(cube_path)
+            snp_list = MetafileController(mf_path).load_data()
+            self.assertTrue(np.all(cube.get_data([21,22])[...,1]==np.array([s.S[22].raw for s in snp_list])))
+            self.assertTrue(np.all(cube.positions==MetafileController(mf_path).positions))
+            self.assertTrue(np.shares_memory(cube.get_data([11,22]),cube.data))
+            #beamforming from the cube should match the metafile
+            az = np.deg2rad(np.arange(-90,91,10))
+            csa_mf = SamuraiBeamform(mf_path,units='mm').beamform_azel(az,0)
+            mybf = SamuraiBeamform(cube_path,units='mm')
+            self.assertIsInstance(mybf.all_s_parameter_data,ApertureCube)
+            csa_cube = mybf.beamform_azel(az,0)
+            self.assertTrue(np.allclose(csa_mf.complex_values,csa_cube.complex_values))
+            self.assertTrue(np.all(csa_mf.freq_list==csa_cube.freq_list))
+            #compressed cube from the metafile should beamform the same
+            zcube_path = MetafileController(mf_path).to_aperture_cube(os.path.join(tmp_dir,'compressed'+APERTURE_CUBE_EXTENSION),
+                                                                      compression='zlib',chunk_shape=[5,2])
+            self.assertTrue(np.array_equal(ApertureCube(zcube_path).data[...],cube.data))
+            csa_zcube = SamuraiBeamform(zcube_path,units='mm').beamform_azel(az,0)
+            self.assertTrue(np.allclose(csa_mf.complex_values,csa_zcube.complex_values))
+            del cube,mybf #release the memory maps before removing the directory
+
+    def test_compressed_cube(self):
+        '''@brief compressed cubes should index like the uncompressed data and only decompress the blocks needed'''
+        import tempfile
+        from unittest import mock
+        freqs = np.linspace(26.5e9,40e9,50)
+        data = np.round(np.random.rand(23,50,4),3)+1j*np.round(np.random.rand(23,50,4),3)
+        columns = [('S',11),('S',21),('S',12),('S',22)]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            plain_path = write_aperture_cube(os.path.join(tmp_dir,'plain'+APERTURE_CUBE_EXTENSION),data,freqs,columns)
+            for compression in ['zlib','lzma']:
+                cube_path = write_aperture_cube(os.path.join(tmp_dir,compression+APERTURE_CUBE_EXTENSION),data,freqs,columns,
+                                                compression=compression,chunk_shape=[8,16])
+                cube = ApertureCube(cube_path)
+                self.assertEqual(cube.compression,compression)
+                self.assertTrue(cube.data_path.endswith(APERTURE_CUBE_COMPRESSED_DATA_EXTENSION))
+                self.assertLess(os.path.getsize(cube.data_path),os.path.getsize(ApertureCube(plain_path).data_path))
+                self.assertTrue(np.array_equal(np.asarray(cube.data),data))
+                for key in [(5,),(slice(3,20,2),slice(10,40)),(Ellipsis,1),(-1,[3,7,49],slice(1,3)),
+                            ([0,22],5,2),(slice(None),slice(None,None,-1)),(slice(5,5),),
+                            ([0,1],[2,3]),([0,1],slice(None),[1,3]),([[0],[4]],[1,2,3]),(slice(10,2,-3),[-1,0]),
+                            (np.arange(23)%3==0,slice(20,30)),(slice(2,9),[4,4])]:
+                    self.assertTrue(np.array_equal(cube.data[key],data[key]),msg=key)
+                self.assertTrue(np.array_equal(cube.get_data([21,22]),data[...,[1,3]]))
+                #only the blocks with positions 8-15 and frequencies 16-31 are decompressed
+                with mock.patch.object(cube.data._reader,'read_frame',wraps=cube.data._reader.read_frame) as read_frame:
+                    cube.data[10,20]
+                    self.assertEqual([c[0][0] for c in read_frame.call_args_list],[1*4+1])
+            #positions written out of order and missing positions (zeros)
+            cube = ApertureCube.create(os.path.join(tmp_dir,'order'+APERTURE_CUBE_EXTENSION),23,freqs,columns,compression='zlib',chunk_shape=[8,16])
+            for i in reversed(range(1,23)):
+                cube.data[i] = data[i]
+            with self.assertRaises(ApertureCubeError):
+                cube.data[20] = data[20] #already compressed
+            cube_path = cube.write()
+            expected = data.copy(); expected[0] = 0
+            self.assertTrue(np.array_equal(ApertureCube(cube_path).data[:],expected))
+
+if __name__=='__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestApertureCube)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -17,12 +17,15 @@ from copy import deepcopy
 import shutil
 import numpy as np
 from datetime import datetime #for timestamps
+from concurrent.futures import Executor,ThreadPoolExecutor,ProcessPoolExecutor,as_completed
 
 #plotly import
 import plotly.graph_objects as go
 
-from samurai.base.TouchstoneEditor import TouchstoneEditor
+from samurai.base.TouchstoneEditor import TouchstoneEditor,TouchstoneArray,get_touchstone_cache
+from samurai.analysis.support.ApertureCube import ApertureCube,ApertureCubeError,APERTURE_CUBE_EXTENSION,DEFAULT_CUBE_CHUNK_SHAPE
 from samurai.base.MUF.MUFResult import MUFResult,set_meas_relative
+from samurai.base.MUF.MUFMeasIndex import MeasIndex,get_meas_index_path
 from samurai.base.generic import deprecated, ProgressCounter
 from samurai.base.SamuraiPlotter import SamuraiPlotter
 from samurai.acquisition.support.SamuraiApertureBuilder import v1_to_v2_convert #import v1 to v2 conversion matrix
@@ -30,6 +33,53 @@ from samurai.acquisition.instrument_control.SamuraiMotive import MotiveInterface
 from samurai.acquisition.support.SamuraiMetafile import SamuraiMetafile,extract_data_from_raw
 from samurai.acquisition.instrument_control.SamuraiPositionTrack import SamuraiPositionDataDict
 
+#%% Loading of measurement data (module level so it can be run in a process pool)
+
+def get_muf_data_path(fname,data_type='nominal',data_meas_num=0):
+    '''
+    @brief get the path of the data file to load for a measurement
+    @param[in] fname - absolute path of the measurement in the metafile
+    @param[in/OPT] data_type - nominal,monte_carlo,perturbed. (default nominal)
+    @param[in/OPT] data_meas_num - which measurement of monte_carlo or perturbed to use
+    @note for monte_carlo and perturbed data the MUFResult *.meas file is parsed
+    @return absolute path to the file
+    '''
+    if data_type=='monte_carlo':
+        muf_res = MUFResult(fname,load_nominal=False)
+        fname = muf_res.monte_carlo[data_meas_num].get_filepath(working_directory=muf_res.working_directory)
+    if data_type=='perturbed':
+        muf_res = MUFResult(fname,load_nominal=False)
+        fname = muf_res.perturbed[data_meas_num].get_filepath(working_directory=muf_res.working_directory)
+    return fname
+
+def get_muf_data_paths(fname,data_type='monte_carlo'):
+    '''
+    @brief get the paths of all of the data files of a type for a measurement. The MUFResult 
+        *.meas file is only parsed once for all of the monte_carlo or perturbed paths
+    @param[in] fname - absolute path of the measurement in the metafile
+    @param[in/OPT] data_type - nominal,monte_carlo,perturbed. (default monte_carlo)
+    @return list of absolute paths ([fname] for nominal)
+    '''
+    if data_type not in ['monte_carlo','perturbed']:
+        return [fname]
+    muf_res = MUFResult(fname,load_nominal=False)
+    stat = getattr(muf_res,data_type)
+    return [it.get_filepath(working_directory=muf_res.working_directory) for it in stat.muf_items]
+
+def load_measurement_data(fname,data_type='nominal',data_meas_num=0,touchstone_class=TouchstoneEditor,**kwargs):
+    '''
+    @brief load the data of a single measurement. This is what MetafileController.load_data
+        runs for each measurement (in a thread or process pool when n_workers!=1)
+    @param[in] fname - absolute path of the measurement in the metafile
+    @param[in/OPT] data_type - nominal,monte_carlo,perturbed. (default nominal)
+    @param[in/OPT] data_meas_num - which measurement of monte_carlo or perturbed to use
+    @param[in/OPT] touchstone_class - class to load the data with (e.g. TouchstoneEditor or TouchstoneArray)
+    @param[in/OPT] kwargs - keyword arguments passed to touchstone_class (e.g. read_header,memmap,freq_range,header_only)
+    @return touchstone_class of the data
+    '''
+    fname = get_muf_data_path(fname,data_type,data_meas_num)
+    return touchstone_class(fname,**kwargs)
+
 #%% Quick way to just get information from the metafile
 
 def get_metafile_info(metafile_path):
@@ -215,6 +265,7 @@ class MetafileController(SamuraiDict):
             self.metafile = 'metafile.json'
             self.set_wdir('./') #set to current path (relative)
             self.update(SamuraiDict(SamuraiMetafile(None,None)))
+        self.meas_index = None #MeasIndex of the *.meas measurements (see load_meas_index)
         
         self.unit_conversion_dict = { #dictionary to get to meters
                 'mm': 0.001,
@@ -275,50 +326,254 @@ class MetafileController(SamuraiDict):
             outPath = os.path.join(self.wdir,self.metafile)
         return super().write(outPath)
             
-    def load_data(self,verbose=False,read_header=True,**arg_options):
+    def load_data(self,verbose=False,read_header=True,memmap=False,**arg_options):
         '''
         @brief load up all measurements into list of snp or wnp files
         @param[in/OPT] verbose - whether or not to be verbose when loading
         @param[in/OPT] read_header - whether or not to skip reading the header. Should be faster with false
+        @param[in/OPT] memmap - whether or not to memory map *_binary files instead of reading them
         @param[in/OPT] arg_options -keyword arguments as follows
             data_type - nominal,monte_carlo,perturbed,etc. If none do nominal
             data_meas_num - which measurement of monte_carlo or perturbed to use
             data_idx - which indices to load in (default to 'all')
+            n_workers - number of workers to load the files with. 1 loads serially,
+                None uses the default of the executor (default 1)
+            executor - 'thread' or 'process' pool to use when n_workers!=1. An already running
+                concurrent.futures.Executor can also be passed and will always be used (default 'thread')
+            touchstone_class - class to load each measurement with. TouchstoneArray is much faster to 
+                create than the pandas based TouchstoneEditor (default TouchstoneEditor)
+            freq_range - (lo,hi) only load frequencies with lo<=freq<=hi in Hz (default None loads all)
+            header_only - only load the ports and frequencies of each measurement (default False)
+        @note threads overlap file reads (e.g. from a network share) while processes also run the
+            parsing of text and MUFResult files in parallel. The returned list is always in measurement order
+        @note *.meas files that are not in self.meas_index or changed since they were indexed are parsed
+            in the same pool before loading (see load_meas_index)
         @return list of snp or wnp classes
         '''
         options = {}
         options['data_type'] = 'nominal'
         options['data_meas_num'] = 0
         options['data_idx'] = 'all'
+        options['n_workers'] = 1
+        options['executor'] = 'thread'
+        options['touchstone_class'] = TouchstoneEditor
+        options['freq_range'] = None
+        options['header_only'] = False
         for k,v in arg_options.items():
             options[k] = v
-        snpData = []
-        numLoadedMeas = 0
         #which measurements to load 
         if isinstance(options['data_idx'],str) and options['data_idx'] == 'all':
             load_measurements = self.measurements 
         else:
             load_measurements = [self.measurements[i] for i in options['data_idx']] #list not numpy array
-        #String of what data type and meas num we are loading 
-        data_type_string = 'nominal' if options['data_type']=='nominal' else '{}[{}]'.format(options['data_type'],options['data_meas_num'])
-        if verbose: pc = ProgressCounter(len(load_measurements),'Loading {} Data: '.format(data_type_string),update_period=5)
-        for meas in load_measurements:
-            fname = os.path.join(self.wdir,meas['filename'].strip())
-            #if options['data_type'] is None or options['data_type']=='nominal':
-            #    snpData.append(snp(fname,read_header=read_header))
-            if options['data_type']=='monte_carlo':
-                muf_res = MUFResult(fname,load_nominal=False)
-                fname = muf_res.monte_carlo[options['data_meas_num']].get_filepath(working_directory=muf_res.working_directory)
-            if options['data_type']=='perturbed':
-                muf_res = MUFResult(fname,load_nominal=False)
-                fname = muf_res.perturbed[options['data_meas_num']].get_filepath(working_directory=muf_res.working_directory)
-            snpData.append(TouchstoneEditor(fname,read_header=read_header))
-            numLoadedMeas+=1
-            #print(numLoadedMeas)
-            if verbose: pc.update()
+        executor = options['executor']
+        parallel = options['n_workers']!=1 or isinstance(executor,Executor)
+        if parallel and not isinstance(executor,Executor): #create our own pool
+            executor_types = {'thread':ThreadPoolExecutor,'process':ProcessPoolExecutor}
+            if executor not in executor_types:
+                raise ValueError("Executor '{}' not in {}".format(executor,list(executor_types.keys())))
+            executor = executor_types[executor](options['n_workers'])
+        try:
+            #parse new or changed *.meas files in the pool. Then the paths are a dictionary lookup so workers only load
+            if any([self._is_meas_file(meas['filename'].strip()) for meas in load_measurements]):
+                self.load_meas_index(data_idx=options['data_idx'],n_workers=options['n_workers'],
+                                     executor=executor if parallel else options['executor'])
+            fnames = [self.get_data_path(meas,options['data_type'],options['data_meas_num']) for meas in load_measurements]
+            load_args = ('nominal',0,options['touchstone_class'])
+            load_kwargs = {'read_header':read_header,'memmap':memmap,
+                           'freq_range':options['freq_range'],'header_only':options['header_only']}
+            #String of what data type and meas num we are loading 
+            data_type_string = 'nominal' if options['data_type']=='nominal' else '{}[{}]'.format(options['data_type'],options['data_meas_num'])
+            if verbose: pc = ProgressCounter(len(fnames),'Loading {} Data: '.format(data_type_string),update_period=5)
+            if not parallel:
+                snpData = []
+                for fname in fnames:
+                    snpData.append(load_measurement_data(fname,*load_args,**load_kwargs))
+                    if verbose: pc.update()
+            else:
+                snpData = [None]*len(fnames)
+                futures = {executor.submit(load_measurement_data,fname,*load_args,**load_kwargs):i for i,fname in enumerate(fnames)}
+                for future in as_completed(futures): #update as they finish but keep the order
+                    snpData[futures[future]] = future.result()
+                    if verbose: pc.update()
+        finally:
+            if executor is not options['executor']:
+                executor.shutdown(wait=True)
         if verbose: pc.finalize(); print('Loading Complete')
         return snpData
     
+    def get_data_path(self,meas,data_type='nominal',data_meas_num=0):
+        '''
+        @brief get the path of the data file to load for a measurement
+        @param[in] meas - measurement dictionary from self.measurements
+        @param[in/OPT] data_type - nominal,monte_carlo,perturbed. (default nominal)
+        @param[in/OPT] data_meas_num - which measurement of monte_carlo or perturbed to use
+        @note paths of *.meas files are found in self.meas_index (loaded with load_meas_index if needed).
+            A *.meas file that changed since it was indexed is parsed again
+        @return absolute path to the file
+        '''
+        fname = os.path.join(self.wdir,meas['filename'].strip())
+        if self._is_meas_file(fname):
+            if self.meas_index is None:
+                self.load_meas_index()
+            else:
+                self.meas_index.update_entries([fname]) #only parses if the file changed
+            return self.meas_index.get_path(fname,data_type,data_meas_num)
+        return get_muf_data_path(fname,data_type,data_meas_num)
+    
+    @staticmethod
+    def _is_meas_file(fname):
+        '''@brief check if a measurement is a MUFResult *.meas file'''
+        return os.path.splitext(fname)[-1].lower()=='.meas'
+    
+    def load_meas_index(self,**arg_options):
+        '''
+        @brief load the index of the nominal, monte_carlo, and perturbed paths of the *.meas 
+            measurements (see MeasIndex). The index is stored next to the metafile (metafile.meas_index.json)
+            and only *.meas files that are new or have changed since they were indexed are parsed
+        @param[in/OPT] arg_options - keyword arguments as follows
+            data_idx - which measurements to index (default to 'all')
+            n_workers - number of workers to parse the *.meas files with. 1 parses serially (default 1)
+            executor - 'thread' or 'process' pool to use when n_workers!=1. An already running 
+                concurrent.futures.Executor can also be passed and will always be used (default 'thread')
+            write - whether or not to write the index when it changed (default True)
+            verbose - whether or not to print progress (default False)
+        @note load_data, get_data_path, and get_muf_data_paths call this (or check the files they use) 
+            so changed *.meas files are always parsed again
+        @return MeasIndex
+        '''
+        options = {}
+        options['data_idx'] = 'all'
+        options['n_workers'] = 1
+        options['executor'] = 'thread'
+        options['write'] = True
+        options['verbose'] = False
+        for k,v in arg_options.items():
+            options[k] = v
+        metafile_path = os.path.join(self._in_dir,self.metafile)
+        index_path = get_meas_index_path(metafile_path) if os.path.exists(metafile_path) else None
+        index = self.meas_index if self.meas_index is not None else MeasIndex(index_path)
+        if isinstance(options['data_idx'],str) and options['data_idx'] == 'all':
+            measurements = self.measurements 
+        else:
+            measurements = [self.measurements[i] for i in options['data_idx']]
+        fnames = [os.path.join(self.wdir,meas['filename'].strip()) for meas in measurements]
+        meas_paths = [fname for fname in fnames if self._is_meas_file(fname)]
+        index.update_entries(meas_paths,n_workers=options['n_workers'],executor=options['executor'],verbose=options['verbose'])
+        if options['write'] and index.changed and index_path is not None:
+            try:
+                index.write()
+            except OSError: #e.g. read only directory. The index is still used from memory
+                pass
+        self.meas_index = index
+        return index
+    
+    def get_muf_data_paths(self,data_type='monte_carlo',**arg_options):
+        '''
+        @brief get the paths of all of the monte_carlo or perturbed data of each measurement.
+            Each MUFResult *.meas file is only parsed once (instead of once per data_meas_num like get_data_path)
+        @param[in/OPT] data_type - nominal,monte_carlo,perturbed. (default monte_carlo)
+        @param[in/OPT] arg_options - keyword arguments as follows
+            data_idx - which indices to get the paths of (default to 'all')
+            n_workers - number of workers to parse the *.meas files with. 1 parses serially (default 1)
+            executor - 'thread' or 'process' pool to use when n_workers!=1 (default 'thread')
+        @note paths of *.meas files are found in self.meas_index (see load_meas_index)
+        @return list (for each measurement) of lists of absolute paths (for each realization)
+        '''
+        options = {}
+        options['data_idx'] = 'all'
+        options['n_workers'] = 1
+        options['executor'] = 'thread'
+        for k,v in arg_options.items():
+            options[k] = v
+        if isinstance(options['data_idx'],str) and options['data_idx'] == 'all':
+            measurements = self.measurements 
+        else:
+            measurements = [self.measurements[i] for i in options['data_idx']]
+        fnames = [os.path.join(self.wdir,meas['filename'].strip()) for meas in measurements]
+        if any([self._is_meas_file(fname) for fname in fnames]):
+            self.load_meas_index(data_idx=options['data_idx'],n_workers=options['n_workers'],executor=options['executor'])
+        return [self.meas_index.get_paths(fname,data_type) if self._is_meas_file(fname) 
+                else get_muf_data_paths(fname,data_type) for fname in fnames]
+    
+    def warm_touchstone_cache(self,cache=None,verbose=False,**arg_options):
+        '''
+        @brief parse all of the text measurements into a TouchstoneCache ahead of time so
+            later calls to load_data (e.g. in the next session) read the cache instead
+        @param[in/OPT] cache - TouchstoneCache to fill (default get_touchstone_cache())
+        @param[in/OPT] verbose - whether or not to be verbose when parsing
+        @param[in/OPT] arg_options - keyword arguments as follows
+            data_type - nominal,monte_carlo,perturbed,etc. (default nominal)
+            data_meas_num - which measurement or list of measurements of monte_carlo or perturbed to use (default 0)
+        @return number of files that were parsed (files already in the cache are skipped)
+        '''
+        options = {}
+        options['data_type'] = 'nominal'
+        options['data_meas_num'] = 0
+        for k,v in arg_options.items():
+            options[k] = v
+        if cache is None:
+            cache = get_touchstone_cache()
+        if cache is None:
+            raise ValueError("No cache provided and no default cache set (see TouchstoneEditor.set_touchstone_cache)")
+        meas_nums = options['data_meas_num'] if np.ndim(options['data_meas_num']) else [options['data_meas_num']]
+        fnames = [self.get_data_path(meas,options['data_type'],meas_num) for meas_num in meas_nums for meas in self.measurements]
+        if verbose: pc = ProgressCounter(len(fnames),'Warming touchstone cache: ',update_period=5)
+        num_parsed = 0
+        for fname in fnames:
+            num_parsed += cache.warm([fname])
+            if verbose: pc.update()
+        if verbose: pc.finalize()
+        return num_parsed
+    
+    def to_aperture_cube(self,cube_path=None,verbose=False,**arg_options):
+        '''
+        @brief convert all of the measurements to a single file aperture cube (see ApertureCube).
+            Measurements are loaded and written one at a time so the aperture never has to fit in memory
+        @param[in/OPT] cube_path - path of the sidecar to write. Defaults to the metafile name
+            with a *.cube.json extension in the working directory
+        @param[in/OPT] verbose - whether or not to be verbose when converting
+        @param[in/OPT] arg_options - keyword arguments as follows
+            data_type - nominal,monte_carlo,perturbed,etc. (default nominal)
+            data_meas_num - which measurement of monte_carlo or perturbed to use (default 0)
+            compression - None, 'zlib', or 'lzma' to compress blocks of the cube (default None)
+            compression_level - level of the compression. None uses the default of the library
+            chunk_shape - (positions,frequencies) of each compressed block (default [32,256])
+        @return path to the written sidecar
+        '''
+        options = {}
+        options['data_type'] = 'nominal'
+        options['data_meas_num'] = 0
+        options['compression'] = None
+        options['compression_level'] = None
+        options['chunk_shape'] = DEFAULT_CUBE_CHUNK_SHAPE
+        for k,v in arg_options.items():
+            options[k] = v
+        if cube_path is None:
+            name = os.path.splitext(self.metafile)[0]
+            if options['data_type']!='nominal':
+                name += '_{}_{}'.format(options['data_type'],options['data_meas_num'])
+            cube_path = os.path.join(self.wdir,name+APERTURE_CUBE_EXTENSION)
+        fnames = [self.get_data_path(meas,options['data_type'],options['data_meas_num']) for meas in self.measurements]
+        if not len(fnames):
+            raise ApertureCubeError("No measurements to convert")
+        if verbose: pc = ProgressCounter(len(fnames),'Converting to aperture cube: ',update_period=5)
+        cube = None
+        for i,fname in enumerate(fnames):
+            meas = TouchstoneArray(fname,memmap=True)
+            if cube is None: #create from the first measurement
+                cube = ApertureCube.create(cube_path,len(fnames),meas.freq_list,list(meas.columns),
+                                           positions=self.positions,header=meas.options['header'],
+                                           metafile=self.get_header_dict(),filenames=self.get_filename_list(),
+                                           compression=options['compression'],compression_level=options['compression_level'],
+                                           chunk_shape=options['chunk_shape'])
+            elif meas.shape!=tuple(cube['shape'][1:]) or np.any(meas.freq_list!=cube.freq_list):
+                raise ApertureCubeError("Frequencies or ports of {} do not match the first measurement".format(fname))
+            cube.data[i] = meas.raw
+            if verbose: pc.update()
+        if verbose: pc.finalize()
+        return cube.write()
+    
     def update_format(self):
         '''
         @brief Update our metafile format to the most recent. This takes care
@@ -963,29 +1218,156 @@ def evenly_split_metafile(metafile_path,num_splits,label='split'):
 
 #from shutil import copyfile
 
-def copy_s_param_measurement_to_binary(metafile_path,output_directory):
+def copy_s_param_measurement_to_binary(metafile_path,output_directory,**kwargs):
     '''
     @brief move a metafile and corresponding measurements from s2p to s2p_binary
     @param[in] metafile_path - path of the metafile to move 
     @param[in] output_directory - location to output the binary data to 
+    @param[in/OPT] kwargs - keyword arguments passed to MetafileConverter.convert_metafile (e.g. n_workers)
     @return name of the new metafile (will simply append '_binary')
     '''
-    mfc = MetaFileController(metafile_path) #load the metafile
-
-    #now load in and save out all of the measurements
-    for i,f in enumerate(mfc.filenames):
-        print("Moving : %s" %(f))
-        s = snp(f) #load in the file
-        [_,name] = os.path.split(f) #get the file name
-        name = name+'_binary' #append _binary to extension
-        s.write(os.path.join(output_directory,name)) #write the file out
-        mfc.set_filename(name,i) #update the file name in the metafile
-    mfc.set_wdir(output_directory) #set the working directory to the output directory
-    new_name = 'metafile_binary.json'
-    mfc.write(os.path.join(output_directory,new_name)) #write out the metafile
-    return new_name
-            
-            
+    from samurai.analysis.support.MetafileConverter import convert_metafile
+    kwargs.setdefault('out_name','metafile_binary.json')
+    new_path = convert_metafile(metafile_path,output_directory,**kwargs)
+    return os.path.basename(new_path)
+
+#%% Unit testing
+def write_random_metafile(wdir,positions,freqs=None,data_dir=None,metafile_name='metafile.json'):
+    '''
+    @brief write a metafile of 2 port measurements of random data. This is shared by the unit tests
+    @param[in] wdir - directory to write the metafile to
+    @param[in] positions - [x,y,z,alpha,beta,gamma] position in mm of each measurement
+    @param[in/OPT] freqs - frequencies of the measurements (default 11 from 26.5 to 40 GHz)
+    @param[in/OPT] data_dir - subdirectory of wdir to write the *.s2p files to (default None writes them to wdir)
+    @param[in/OPT] metafile_name - name of the metafile in wdir (default 'metafile.json')
+    @return path to the metafile
+    '''
+    from samurai.base.TouchstoneEditor import SnpEditor
+    if freqs is None:
+        freqs = np.linspace(26.5e9,40e9,11)
+    meas_dir = wdir if data_dir is None else os.path.join(wdir,data_dir)
+    os.makedirs(meas_dir,exist_ok=True)
+    mf = MetafileController(None)
+    mf.set_wdir(wdir)
+    for i,position in enumerate(positions):
+        snp = SnpEditor([2,freqs])
+        snp.raw = np.random.rand(*snp.shape)+1j*np.random.rand(*snp.shape)
+        fpath = snp.write(os.path.join(meas_dir,'meas_{}.s2p'.format(i)))
+        mf.add_measurement(fpath,position=list(position),units='mm')
+    return mf.write(os.path.join(wdir,metafile_name))
+
+import unittest
+class TestMetafileController(unittest.TestCase):
+    '''@brief tests for loading the data of a metafile'''
+
+    def test_parallel_load_data(self):
+        '''@brief loading with thread and process pools should match serial loading in order'''
+        import io
+        import tempfile
+        from contextlib import redirect_stdout
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            mf = MetafileController(write_random_metafile(tmp_dir,[[i,0,0,0,0,0] for i in range(11)]))
+            serial = mf.load_data()
+            with ThreadPoolExecutor(2) as executor:
+                loads = {'thread':mf.load_data(n_workers=4),
+                         'process':mf.load_data(n_workers=2,executor='process'),
+                         'executor':mf.load_data(executor=executor),
+                         'data_idx':mf.load_data(n_workers=4,data_idx=[5,1,3]),
+                         'array':mf.load_data(n_workers=2,executor='process',touchstone_class=TouchstoneArray)}
+            for name,snp_list in loads.items():
+                expected = [serial[i] for i in [5,1,3]] if name=='data_idx' else serial
+                self.assertEqual(len(snp_list),len(expected),msg=name)
+                for s,e in zip(snp_list,expected):
+                    self.assertTrue(np.all(s.raw==e.raw),msg=name)
+            #partial reads
+            for snp,s in zip(mf.load_data(n_workers=2,freq_range=(35e9,40e9)),serial):
+                self.assertEqual(snp,s.crop(35e9,40e9))
+            for snp,s in zip(mf.load_data(header_only=True,touchstone_class=TouchstoneArray),serial):
+                self.assertTrue(np.all(snp.freq_list==s.freq_list) and snp.num_ports==s.num_ports)
+            #progress should count every measurement once (update_period=5 prints 1,6,11)
+            out = io.StringIO()
+            with redirect_stdout(out):
+                mf.load_data(verbose=True,n_workers=4)
+            self.assertIn('11/11',out.getvalue())
+            with self.assertRaises(ValueError):
+                mf.load_data(n_workers=2,executor='bad')
+
+    def test_warm_touchstone_cache(self):
+        '''@brief warming a cache for a metafile should parse each text file once'''
+        import tempfile
+        from samurai.base.TouchstoneEditor import TouchstoneCache
+        freqs = np.linspace(26.5e9,40e9,11)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            mf = MetafileController(write_random_metafile(tmp_dir,[[i,0,0,0,0,0] for i in range(4)],freqs))
+            cache = TouchstoneCache(os.path.join(tmp_dir,'cache'))
+            self.assertEqual(mf.warm_touchstone_cache(cache),4)
+            self.assertEqual(mf.warm_touchstone_cache(cache),0)
+            for fname,snp in zip(mf.get_filename_list(True),mf.load_data()):
+                self.assertTrue(np.all(cache.get(fname)['data'][:,1::2]==snp.raw.reshape(len(freqs),-1).real))
+
+    def test_meas_index(self):
+        '''@brief *.meas paths should come from an index next to the metafile that is only built once'''
+        import tempfile
+        from samurai.base.MUF.MUFMeasIndex import MEAS_INDEX_EXTENSION
+        unittest_dir = os.path.join(os.path.dirname(__file__),'../../base/unittest_data')
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            shutil.copytree(os.path.join(unittest_dir,'meas_test'),os.path.join(tmp_dir,'meas_test'))
+            meas_path = shutil.copy(os.path.join(unittest_dir,'meas_test.meas'),tmp_dir)
+            mf = MetafileController(None)
+            mf.set_wdir(tmp_dir)
+            for i in range(2):
+                mf.add_measurement(meas_path,position=[i,0,0,0,0,0],units='mm')
+            mf = MetafileController(mf.write(os.path.join(tmp_dir,'metafile.json')))
+            mc_paths = mf.get_muf_data_paths('monte_carlo')
+            self.assertTrue(os.path.exists(os.path.join(tmp_dir,'metafile'+MEAS_INDEX_EXTENSION)))
+            self.assertEqual(mc_paths[0],get_muf_data_paths(meas_path,'monte_carlo'))
+            self.assertEqual(mf.get_data_path(mf.measurements[1],'monte_carlo',4),get_muf_data_path(meas_path,'monte_carlo',4))
+            for snp in mf.load_data(data_type='monte_carlo',data_meas_num=4,touchstone_class=TouchstoneArray):
+                self.assertTrue(np.all(snp.raw==TouchstoneArray(mc_paths[0][4]).raw))
+            #a new controller reads the index instead of parsing
+            mf = MetafileController(os.path.join(tmp_dir,'metafile.json'))
+            self.assertFalse(mf.load_meas_index().changed)
+
+    def test_meas_index_parallel_load(self):
+        '''@brief load_data should index only the loaded *.meas files in its pool and notice changed files'''
+        import tempfile
+        from unittest import mock
+        from samurai.base.MUF.MUFMeasIndex import parse_meas_paths
+        submitted = []
+        class RecordingExecutor(ThreadPoolExecutor):
+            def submit(self,fn,*args,**kwargs):
+                submitted.append(fn)
+                return super().submit(fn,*args,**kwargs)
+        unittest_dir = os.path.join(os.path.dirname(__file__),'../../base/unittest_data')
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            shutil.copytree(os.path.join(unittest_dir,'meas_test'),os.path.join(tmp_dir,'meas_test'))
+            meas_paths = [shutil.copy(os.path.join(unittest_dir,'meas_test.meas'),os.path.join(tmp_dir,'meas_{}.meas'.format(i))) for i in range(3)]
+            mf = MetafileController(None)
+            mf.set_wdir(tmp_dir)
+            for i,meas_path in enumerate(meas_paths):
+                mf.add_measurement(meas_path,position=[i,0,0,0,0,0],units='mm')
+            mf = MetafileController(mf.write(os.path.join(tmp_dir,'metafile.json')))
+            with mock.patch.dict(globals(),{'ThreadPoolExecutor':RecordingExecutor}):
+                snp_list = mf.load_data(data_type='monte_carlo',data_meas_num=1,data_idx=[0,2],n_workers=2,touchstone_class=TouchstoneArray)
+            self.assertEqual(submitted.count(parse_meas_paths),2)
+            self.assertEqual(sorted(mf.meas_index['entries'].keys()),sorted([os.path.abspath(meas_paths[i]) for i in [0,2]]))
+            expected = TouchstoneArray(get_muf_data_path(meas_paths[0],'monte_carlo',1))
+            for snp in snp_list:
+                self.assertTrue(np.all(snp.raw==expected.raw))
+            #changed *.meas files are parsed again by the same controller
+            mc_paths = get_muf_data_paths(meas_paths[2],'monte_carlo')
+            res = MUFResult(meas_paths[2],load_nominal=False)
+            for num_mc,mtime in [(3,1),(4,2)]:
+                res.set_monte_carlo(mc_paths[:num_mc])
+                res.write_xml(meas_paths[2])
+                os.utime(meas_paths[2],ns=(0,mtime))
+                if num_mc==3:
+                    with self.assertRaises(IndexError):
+                        mf.get_data_path(mf.measurements[2],'monte_carlo',5)
+                else:
+                    self.assertEqual(len(mf.get_muf_data_paths('monte_carlo',data_idx=[2])[0]),4)
+
+
 if __name__=='__main__':
     #metafile_path = r'./metafile_v2.json'
     metafile_path = r"\\cfs2w\67_ctl\67Internal\DivisionProjects\Channel Model Uncertainty\Measurements\Synthetic_Aperture\calibrated\2019\3-20-2019\metafile.json"
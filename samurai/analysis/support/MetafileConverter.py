@@ -0,0 +1,549 @@
+# -*- coding: utf-8 -*-
+"""
+@brief Bulk conversion of the measurements of metafiles from text touchstone files
+    to *_binary files or to a single file aperture cube (see ApertureCube).
+    The files are converted in a process pool, checked after they are written, and the
+    progress is kept in a manifest (*.convert.json) so an interrupted conversion can be restarted.
+    This can also be run from the command line:
+        python -m samurai.analysis.support.MetafileConverter path/to/metafile.json --workers 8
+        python -m samurai.analysis.support.MetafileConverter path/to/data/tree --format cube
+
+@author: ajw5
+"""
+import os
+import re
+import sys
+import time
+import fnmatch
+import hashlib
+import argparse
+import numpy as np
+from concurrent.futures import Executor,ThreadPoolExecutor,ProcessPoolExecutor,as_completed
+
+from samurai.base.SamuraiDict import SamuraiDict
+from samurai.base.TouchstoneEditor import TouchstoneArray,DEFAULT_HEADER,get_file_key
+from samurai.base.generic import ProgressCounter
+from samurai.base.CompressedFrames import COMPRESSION_TYPES,is_framed_file
+from samurai.analysis.support.ApertureCube import ApertureCube,APERTURE_CUBE_EXTENSION
+from samurai.analysis.support.MetafileController import MetafileController
+
+CONVERT_MANIFEST_EXTENSION = '.convert.json' #progress of a conversion in the output directory
+CONVERT_MANIFEST_VERSION = 1.0
+CONVERT_FORMATS = ['binary','cube']
+DEFAULT_METAFILE_PATTERN = 'metafile*.json' #metafiles to find when converting a directory tree
+
+#%% Converting single files (module level so it can be run in a process pool)
+
+def get_file_checksum(file_path,block_size=2**20):
+    '''
+    @brief get the sha256 checksum of a file
+    @param[in] file_path - path of the file
+    @param[in/OPT] block_size - number of bytes to read at a time
+    @return hex string of the checksum
+    '''
+    h = hashlib.sha256()
+    with open(file_path,'rb') as fp:
+        for block in iter(lambda: fp.read(block_size),b''):
+            h.update(block)
+    return h.hexdigest()
+
+def get_data_checksum(*arrays):
+    '''
+    @brief get the sha256 checksum of the values in numpy arrays
+    @param[in] arrays - arrays to get the checksum of
+    @return hex string of the checksum
+    '''
+    h = hashlib.sha256()
+    for arr in arrays:
+        h.update(np.ascontiguousarray(arr).data)
+    return h.hexdigest()
+
+def convert_measurement(in_path,out_path,verify=True,compression=None):
+    '''
+    @brief convert a text touchstone file to a *_binary file without going through a TouchstoneEditor.
+        The file is written to a temporary name and only moved to out_path once it is complete
+    @param[in] in_path - path of the text (or binary) file to convert
+    @param[in] out_path - path of the *_binary file to write
+    @param[in/OPT] verify - read the written file back and check it matches the data of in_path (default True)
+    @param[in/OPT] compression - None, 'zlib', or 'lzma' compression of the binary file (default None)
+    @return dictionary {'source':get_file_key(in_path),'sha256':checksum of out_path,'compression':compression}
+    '''
+    source_key = get_file_key(in_path)
+    if os.path.abspath(in_path)!=os.path.abspath(out_path): #already binary in place otherwise
+        meas = TouchstoneArray(in_path,cache=False)
+        meas.set_header(DEFAULT_HEADER) #binary files are always read as GHz
+        fname,ext = os.path.splitext(out_path)
+        tmp_path = '{}.{}.partial{}'.format(fname,os.getpid(),ext) #keep the extension so it can be read back
+        try:
+            meas.write(tmp_path,ftype='binary',fix_extension=False,compression=compression)
+            if verify:
+                written = TouchstoneArray(tmp_path)
+                if get_data_checksum(written.freqs,written.raw)!=get_data_checksum(meas.freqs,meas.raw):
+                    raise MetafileConversionError("Data written to {} does not match {}".format(out_path,in_path))
+            os.replace(tmp_path,out_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return {'source':source_key,'sha256':get_file_checksum(out_path),'compression':compression}
+
+def read_measurement_row(in_path):
+    '''
+    @brief read a measurement to be written into an aperture cube
+    @param[in] in_path - path of the file to read
+    @return (freqs,raw,{'source':get_file_key(in_path),'sha256':checksum of raw})
+    '''
+    source_key = get_file_key(in_path)
+    meas = TouchstoneArray(in_path,cache=False)
+    return meas.freqs,meas.raw,{'source':source_key,'sha256':get_data_checksum(meas.raw)}
+
+def iter_completed(funct,args_list,n_workers=None,executor='process'):
+    '''
+    @brief run a function for a list of arguments in a pool and yield the results as they finish
+    @param[in] funct - function to run (must be picklable for a process pool)
+    @param[in] args_list - list of tuples of arguments to run funct with
+    @param[in/OPT] n_workers - number of workers. 1 runs serially, None uses the default of the executor
+    @param[in/OPT] executor - 'thread' or 'process' pool or a running concurrent.futures.Executor
+    @note calls that have not started are cancelled if the loop is stopped (e.g. KeyboardInterrupt)
+    @return generator of (index in args_list,result)
+    '''
+    if n_workers==1 and not isinstance(executor,Executor):
+        for i,args in enumerate(args_list):
+            yield i,funct(*args)
+        return
+    pool = executor
+    if not isinstance(pool,Executor): #create our own pool
+        executor_types = {'thread':ThreadPoolExecutor,'process':ProcessPoolExecutor}
+        if executor not in executor_types:
+            raise ValueError("Executor '{}' not in {}".format(executor,list(executor_types.keys())))
+        pool = executor_types[executor](n_workers)
+    futures = {}
+    try:
+        futures = {pool.submit(funct,*args):i for i,args in enumerate(args_list)}
+        for future in as_completed(futures):
+            yield futures[future],future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+        if pool is not executor:
+            pool.shutdown(wait=True)
+
+#%% Conversion manifest
+
+class ConvertManifest(SamuraiDict):
+    '''
+    @brief Progress of a conversion. Each converted output (file or cube row) has an entry
+        {'source':[path,size,mtime_ns],'sha256':checksum} so finished outputs are skipped when restarting
+    @param[in] manifest_path - path of the manifest. Loaded if it already exists
+    @param[in] metafile_path - path of the metafile being converted
+    @param[in] out_format - format being converted to ('binary' or 'cube')
+    '''
+    def __init__(self,manifest_path,metafile_path,out_format):
+        '''@brief constructor'''
+        super().__init__()
+        self.manifest_path = manifest_path
+        if os.path.exists(manifest_path):
+            self.load(manifest_path)
+        if self.get('metafile')!=os.path.abspath(metafile_path) or self.get('out_format')!=out_format:
+            self.clear() #a different conversion so start over
+        self['manifest_version'] = CONVERT_MANIFEST_VERSION
+        self['metafile'] = os.path.abspath(metafile_path)
+        self['out_format'] = out_format
+        self['complete'] = self.get('complete',False)
+        self['entries'] = self.get('entries',{})
+
+    def is_done(self,name,source_key):
+        '''
+        @brief check if an output was finished from the current version of its source
+        @param[in] name - name of the entry (output file or cube row)
+        @param[in] source_key - get_file_key() of the source
+        '''
+        entry = self['entries'].get(str(name),None)
+        return entry is not None and list(entry['source'])==list(source_key)
+
+    def set_entry(self,name,entry):
+        '''@brief set the entry of a finished output'''
+        self['complete'] = False
+        self['entries'][str(name)] = entry
+
+    def write(self):
+        '''
+        @brief write the manifest (to a temporary file that is then moved so it is never partially written)
+        @return path of the manifest
+        '''
+        tmp_path = self.manifest_path+'.tmp'
+        super().write(tmp_path)
+        os.replace(tmp_path,self.manifest_path)
+        return self.manifest_path
+
+def get_manifest_path(output_directory,metafile_path):
+    '''
+    @brief get the path of the manifest of a conversion
+    @param[in] output_directory - directory the data is being converted to
+    @param[in] metafile_path - path of the metafile being converted
+    '''
+    name = os.path.splitext(os.path.basename(metafile_path))[0]
+    return os.path.join(output_directory,name+CONVERT_MANIFEST_EXTENSION)
+
+#%% Converting metafiles
+
+def convert_metafile(metafile_path,output_directory=None,n_workers=None,verbose=False,**arg_options):
+    '''
+    @brief convert all of the measurements of a metafile to *_binary files or an aperture cube.
+        Progress is saved to a manifest in the output directory. If the conversion is interrupted,
+        running it again only converts the measurements that are not finished (or whose source changed)
+    @param[in] metafile_path - path to the metafile to convert
+    @param[in/OPT] output_directory - directory to write to. Defaults to the working directory of the metafile
+    @param[in/OPT] n_workers - number of workers to convert with. 1 converts serially,
+        None uses the default of the executor (the number of processors)
+    @param[in/OPT] verbose - whether or not to print the progress
+    @param[in/OPT] arg_options - keyword arguments as follows
+        - out_format - 'binary' for a *_binary file for each measurement and a new metafile
+            or 'cube' for a single aperture cube (default 'binary')
+        - executor - 'thread' or 'process' pool or a running concurrent.futures.Executor (default 'process')
+        - verify - read back the written data and check it matches the source. When restarting, the checksums
+            of finished outputs are also checked so anything that was changed is converted again (default True)
+        - out_name - name of the new metafile or cube sidecar. Defaults to the name of the metafile
+            with '_binary.json' or '.cube.json'
+        - data_type - nominal,monte_carlo,perturbed (default nominal)
+        - data_meas_num - which measurement of monte_carlo or perturbed to use (default 0)
+        - checkpoint_period - seconds between writing the manifest while converting (default 10)
+        - compression - None, 'zlib', or 'lzma' compression of the binary files (default None).
+            Use MetafileController.to_aperture_cube to write a compressed cube
+    @note text files in the working directory keep their relative paths in the output directory.
+        Files outside of it are written to the top of the output directory
+    @return path of the new metafile or the aperture cube sidecar
+    '''
+    options = {}
+    options['out_format'] = 'binary'
+    options['executor'] = 'process'
+    options['verify'] = True
+    options['out_name'] = None
+    options['data_type'] = 'nominal'
+    options['data_meas_num'] = 0
+    options['checkpoint_period'] = 10
+    options['compression'] = None
+    for k,v in arg_options.items():
+        options[k] = v
+    if options['out_format'] not in CONVERT_FORMATS:
+        raise ValueError("Format '{}' not in {}".format(options['out_format'],CONVERT_FORMATS))
+    if options['out_format']=='cube' and options['compression'] is not None: #rows are filled in place to restart
+        raise ValueError("Compression is only supported for binary conversions. Use MetafileController.to_aperture_cube")
+    mfc = MetafileController(metafile_path)
+    if output_directory is None:
+        output_directory = mfc.wdir
+    output_directory = os.path.abspath(output_directory)
+    os.makedirs(output_directory,exist_ok=True)
+    src_paths = []
+    for meas in mfc.measurements:
+        src = mfc.get_data_path(meas,options['data_type'],options['data_meas_num']) #nominal solution of *.meas files
+        src_paths.append(os.path.abspath(src))
+    if not len(src_paths):
+        raise MetafileConversionError("No measurements to convert in {}".format(metafile_path))
+    manifest = ConvertManifest(get_manifest_path(output_directory,metafile_path),metafile_path,options['out_format'])
+    convert_functs = {'binary':_convert_to_binary,'cube':_convert_to_cube}
+    return convert_functs[options['out_format']](mfc,src_paths,output_directory,manifest,n_workers,verbose,options)
+
+def _get_output_name(src_path,wdir):
+    '''@brief name (relative to the output directory) of the *_binary file for a source file'''
+    name = os.path.relpath(src_path,wdir)
+    if name.startswith(os.pardir): #not in the working directory
+        name = os.path.basename(src_path)
+    if not re.findall('binary',os.path.splitext(name)[-1]):
+        name += '_binary'
+    return name
+
+def _run_conversion(funct,args_list,names,manifest,n_workers,verbose,options,num_total,on_result=None):
+    '''
+    @brief run the conversion tasks that are not done and save the manifest as they finish
+    @param[in] funct - function of each task returning a manifest entry (or a tuple ending in one)
+    @param[in] args_list - list of arguments of the tasks that are not done
+    @param[in] names - list of manifest names of each task
+    @param[in] manifest - ConvertManifest of the conversion
+    @param[in] num_total - total number of tasks (including the ones already done)
+    @param[in/OPT] on_result - function called with (index,result) of each finished task in the main process
+    '''
+    if verbose and len(args_list)<num_total:
+        print('Restarting conversion: {} of {} already done'.format(num_total-len(args_list),num_total))
+    if verbose: pc = ProgressCounter(len(args_list),'Converting to {}: '.format(options['out_format']),update_period=5)
+    last_write = time.time()
+    try:
+        for i,result in iter_completed(funct,args_list,n_workers,options['executor']):
+            if on_result is not None:
+                on_result(i,result)
+            manifest.set_entry(names[i],result if isinstance(result,dict) else result[-1])
+            if time.time()-last_write>options['checkpoint_period']:
+                manifest.write(); last_write = time.time()
+            if verbose: pc.update()
+    finally:
+        manifest.write() #save the progress even if interrupted
+    if verbose: pc.finalize()
+
+def _convert_to_binary(mfc,src_paths,output_directory,manifest,n_workers,verbose,options):
+    '''@brief convert each measurement to a *_binary file and write a new metafile (see convert_metafile)'''
+    names = [_get_output_name(src,mfc.wdir) for src in src_paths]
+    out_paths = [os.path.join(output_directory,name) for name in names]
+    if len(set(out_paths))!=len(out_paths):
+        raise MetafileConversionError("Measurements of {} would be converted to the same file".format(mfc.metafile))
+    for out_path in set([os.path.dirname(p) for p in out_paths]):
+        os.makedirs(out_path,exist_ok=True)
+    todo = []
+    for i,(src,out_path) in enumerate(zip(src_paths,out_paths)):
+        done = manifest.is_done(names[i],get_file_key(src)) and os.path.exists(out_path)
+        done = done and manifest['entries'][names[i]].get('compression',None)==options['compression']
+        if done and options['verify']:
+            done = get_file_checksum(out_path)==manifest['entries'][names[i]]['sha256']
+        if not done:
+            todo.append(i)
+    _run_conversion(convert_measurement,[(src_paths[i],out_paths[i],options['verify'],options['compression']) for i in todo],
+                    [names[i] for i in todo],manifest,n_workers,verbose,options,len(src_paths))
+    #now write the metafile pointing to the binary files
+    out_name = options['out_name']
+    if out_name is None:
+        out_name = os.path.splitext(mfc.metafile)[0]+'_binary.json'
+    mfc.set_wdir(output_directory)
+    mfc.set_filename(out_paths)
+    mfc.set_wdir('./') #relative to the new metafile in the output directory
+    out_metafile = mfc.write(os.path.join(output_directory,out_name))
+    manifest['complete'] = True
+    manifest['output'] = out_name
+    manifest.write()
+    return out_metafile
+
+def _convert_to_cube(mfc,src_paths,output_directory,manifest,n_workers,verbose,options):
+    '''@brief convert all of the measurements to a single aperture cube (see convert_metafile)'''
+    out_name = options['out_name']
+    if out_name is None:
+        out_name = os.path.splitext(mfc.metafile)[0]
+        if options['data_type']!='nominal':
+            out_name += '_{}_{}'.format(options['data_type'],options['data_meas_num'])
+        out_name += APERTURE_CUBE_EXTENSION
+    cube_path = os.path.join(output_directory,out_name)
+    first = TouchstoneArray(src_paths[0],memmap=True,cache=False)
+    shape = [len(src_paths),len(first.freqs),len(first.columns)]
+    cube = None
+    if manifest.get('output',None)==out_name and os.path.exists(cube_path):
+        cube = ApertureCube(cube_path) #restart filling in the existing cube
+        if list(cube['shape'])!=shape or not os.path.exists(cube.data_path):
+            cube = None
+        else:
+            cube._data = np.lib.format.open_memmap(cube.data_path,mode='r+')
+    if cube is None: #start over with a new cube
+        manifest['entries'] = {}
+        cube = ApertureCube.create(cube_path,len(src_paths),first.freq_list,list(first.columns),
+                                   positions=mfc.positions,header=first.options['header'],
+                                   metafile=mfc.get_header_dict(),filenames=mfc.get_filename_list())
+        cube.write() #so the cube can be reopened if interrupted
+        manifest['output'] = out_name
+    todo = []
+    for i,src in enumerate(src_paths):
+        done = manifest.is_done(i,get_file_key(src))
+        if done and options['verify']:
+            done = get_data_checksum(cube.data[i])==manifest['entries'][str(i)]['sha256']
+        if not done:
+            todo.append(i)
+    def write_row(i,result):
+        '''@brief write a measurement into the cube'''
+        freqs,raw,_ = result
+        if raw.shape!=tuple(shape[1:]) or np.any(freqs!=cube.freq_list):
+            raise MetafileConversionError("Frequencies or ports of {} do not match the first measurement".format(src_paths[todo[i]]))
+        cube.data[todo[i]] = raw
+    try:
+        _run_conversion(read_measurement_row,[(src_paths[i],) for i in todo],todo,manifest,n_workers,verbose,options,
+                        len(src_paths),on_result=write_row)
+    finally:
+        cube.data.flush() #rows in the manifest must be on disk
+    del cube
+    if options['verify']: #check the rows from a new map of the file
+        cube = ApertureCube(cube_path)
+        for i in range(len(src_paths)):
+            if get_data_checksum(cube.data[i])!=manifest['entries'][str(i)]['sha256']:
+                manifest['entries'].pop(str(i)); manifest.write()
+                raise MetafileConversionError("Data of {} in {} does not match the source".format(src_paths[i],cube.data_path))
+        del cube
+    manifest['complete'] = True
+    manifest.write()
+    return cube_path
+
+def find_metafiles(root_dir,pattern=DEFAULT_METAFILE_PATTERN):
+    '''
+    @brief find all of the metafiles in a directory tree
+    @param[in] root_dir - top directory to search
+    @param[in/OPT] pattern - glob pattern of metafile names (default 'metafile*.json')
+    @note metafiles, manifests, and cube sidecars written by a conversion are skipped
+    @return sorted list of paths to the metafiles
+    '''
+    skip_endings = ['_binary.json',CONVERT_MANIFEST_EXTENSION,APERTURE_CUBE_EXTENSION]
+    metafile_paths = []
+    for dir_path,_,file_names in os.walk(root_dir):
+        for name in fnmatch.filter(file_names,pattern):
+            if not any([name.endswith(e) for e in skip_endings]):
+                metafile_paths.append(os.path.join(dir_path,name))
+    return sorted(metafile_paths)
+
+def convert_metafiles(paths,output_directory=None,n_workers=None,verbose=False,**arg_options):
+    '''
+    @brief convert metafiles and/or all of the metafiles in directory trees with a single pool
+    @param[in] paths - path or list of paths to metafiles or directories to search with find_metafiles
+    @param[in/OPT] output_directory - directory to write all conversions to. This is only allowed for a
+        single metafile. Defaults to the working directory of each metafile
+    @param[in/OPT] n_workers - number of workers to convert with (see convert_metafile)
+    @param[in/OPT] verbose - whether or not to print the progress
+    @param[in/OPT] arg_options - keyword arguments passed to convert_metafile. Also
+        - pattern - glob pattern of metafile names in directories (default 'metafile*.json')
+    @return list of paths of the new metafiles or cube sidecars
+    '''
+    options = {}
+    options['pattern'] = DEFAULT_METAFILE_PATTERN
+    options['executor'] = 'process'
+    for k,v in arg_options.items():
+        options[k] = v
+    pattern = options.pop('pattern')
+    executor = options.pop('executor')
+    if isinstance(paths,str):
+        paths = [paths]
+    metafile_paths = []
+    for path in paths:
+        metafile_paths += find_metafiles(path,pattern) if os.path.isdir(path) else [path]
+    if output_directory is not None and len(metafile_paths)>1:
+        raise ValueError("An output directory can only be used to convert a single metafile")
+    pool = executor
+    if not isinstance(executor,Executor) and n_workers!=1 and len(metafile_paths)>1: #share a pool for all metafiles
+        executor_types = {'thread':ThreadPoolExecutor,'process':ProcessPoolExecutor}
+        if executor not in executor_types:
+            raise ValueError("Executor '{}' not in {}".format(executor,list(executor_types.keys())))
+        pool = executor_types[executor](n_workers)
+    out_paths = []
+    try:
+        for metafile_path in metafile_paths:
+            if verbose: print('Converting {}'.format(metafile_path))
+            out_paths.append(convert_metafile(metafile_path,output_directory,n_workers,verbose,executor=pool,**options))
+    finally:
+        if pool is not executor:
+            pool.shutdown(wait=True)
+    return out_paths
+
+class MetafileConversionError(Exception):
+    '''@brief error when converting the measurements of a metafile'''
+    pass
+
+#%% Command line interface
+
+def main(argv=None):
+    '''
+    @brief convert metafiles from the command line (run with -h for the arguments)
+    @param[in/OPT] argv - list of arguments (default sys.argv[1:])
+    @return list of paths of the new metafiles or cube sidecars
+    '''
+    parser = argparse.ArgumentParser(description='Convert the measurements of metafiles (or directory trees of metafiles) '
+                                     'to *_binary files or aperture cubes. Interrupted conversions are restarted where they stopped.')
+    parser.add_argument('paths',nargs='+',help='metafiles or directories to search for metafiles')
+    parser.add_argument('-f','--format',dest='out_format',choices=CONVERT_FORMATS,default='binary',help='format to convert to (default binary)')
+    parser.add_argument('-o','--output-directory',default=None,help='directory to write to (default the working directory of each metafile)')
+    parser.add_argument('-w','--workers',type=int,default=None,help='number of processes (default the number of processors)')
+    parser.add_argument('-p','--pattern',default=DEFAULT_METAFILE_PATTERN,help='metafile names to find in directories (default %(default)s)')
+    parser.add_argument('--data-type',default='nominal',choices=['nominal','monte_carlo','perturbed'],help='data to convert (default nominal)')
+    parser.add_argument('--data-meas-num',type=int,default=0,help='which monte_carlo or perturbed measurement to convert (default 0)')
+    parser.add_argument('-c','--compression',default=None,choices=COMPRESSION_TYPES,help='compress the binary files (default no compression)')
+    parser.add_argument('--no-verify',dest='verify',action='store_false',help='do not check the written data')
+    parser.add_argument('-q','--quiet',action='store_true',help='do not print the progress')
+    args = parser.parse_args(argv)
+    out_paths = convert_metafiles(args.paths,args.output_directory,args.workers,not args.quiet,out_format=args.out_format,
+                                  pattern=args.pattern,data_type=args.data_type,data_meas_num=args.data_meas_num,verify=args.verify,
+                                  compression=args.compression)
+    for out_path in out_paths:
+        print(out_path)
+    return out_paths
+
+#%% Unit testing
+import unittest
+class TestMetafileConverter(unittest.TestCase):
+    '''@brief tests for converting metafiles to binary files and aperture cubes'''
+
+    def _write_metafile(self,wdir,num_meas=6):
+        '''@brief write a metafile of random s2p files in a subdirectory of wdir'''
+        from samurai.analysis.support.MetafileController import write_random_metafile
+        return write_random_metafile(wdir,[[3*i,0,0,0,0,0] for i in range(num_meas)],np.linspace(26.5e9,40e9,7),data_dir='data')
+
+    def test_convert_binary(self):
+        '''@brief convert to binary files in a pool and restart after an interruption'''
+        import tempfile
+        import unittest.mock
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            mf_path = self._write_metafile(tmp_dir)
+            out_dir = os.path.join(tmp_dir,'binary')
+            #interrupt after 2 files
+            done = []
+            def interrupt_convert(*args,convert=convert_measurement):
+                if len(done)==2:
+                    raise KeyboardInterrupt
+                done.append(args)
+                return convert(*args)
+            with unittest.mock.patch(__name__+'.convert_measurement',interrupt_convert):
+                with self.assertRaises(KeyboardInterrupt):
+                    convert_metafile(mf_path,out_dir,n_workers=1)
+            manifest = ConvertManifest(get_manifest_path(out_dir,mf_path),mf_path,'binary')
+            self.assertEqual(len(manifest['entries']),2)
+            self.assertFalse(manifest['complete'])
+            #change one of the finished files so it has to be converted again
+            done_name = list(manifest['entries'].keys())[0]
+            with open(os.path.join(out_dir,done_name),'ab') as fp:
+                fp.write(b'0')
+            mtimes = {n:os.stat(os.path.join(out_dir,n)).st_mtime_ns for n in manifest['entries'].keys()}
+            new_mf_path = convert_metafile(mf_path,out_dir,n_workers=2)
+            self.assertEqual(new_mf_path,os.path.join(out_dir,'metafile_binary.json'))
+            for name,mtime in mtimes.items(): #only the changed file was rewritten
+                self.assertEqual(os.stat(os.path.join(out_dir,name)).st_mtime_ns==mtime,name!=done_name)
+            self.assertFalse([f for f in os.listdir(os.path.join(out_dir,'data')) if 'partial' in f])
+            text_data = MetafileController(mf_path).load_data(touchstone_class=TouchstoneArray)
+            new_mf = MetafileController(new_mf_path)
+            self.assertTrue(all([f.endswith('.s2p_binary') for f in new_mf.get_filename_list(abs_path=True)]))
+            bin_data = new_mf.load_data(touchstone_class=TouchstoneArray)
+            self.assertEqual(text_data,bin_data)
+            self.assertTrue(np.all(new_mf.positions==MetafileController(mf_path).positions))
+            #everything is done so nothing is rewritten
+            mtimes = {f:os.stat(f).st_mtime_ns for f in new_mf.get_filename_list(abs_path=True)}
+            convert_metafile(mf_path,out_dir,n_workers=1)
+            self.assertTrue(all([os.stat(f).st_mtime_ns==t for f,t in mtimes.items()]))
+            self.assertTrue(ConvertManifest(get_manifest_path(out_dir,mf_path),mf_path,'binary')['complete'])
+            #changing the compression converts everything again
+            convert_metafile(mf_path,out_dir,n_workers=1,compression='lzma')
+            self.assertFalse(any([os.stat(f).st_mtime_ns==t for f,t in mtimes.items()]))
+            self.assertEqual(MetafileController(new_mf_path).load_data(touchstone_class=TouchstoneArray),text_data)
+            self.assertTrue(all([is_framed_file(f) for f in mtimes.keys()]))
+
+    def test_convert_cube_and_tree(self):
+        '''@brief convert a tree of metafiles to cubes from the command line'''
+        import io
+        import tempfile
+        from contextlib import redirect_stdout
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            mf_paths = [self._write_metafile(os.path.join(tmp_dir,'run_{}'.format(i)),4) for i in range(2)]
+            self.assertEqual(find_metafiles(tmp_dir),sorted(mf_paths))
+            with redirect_stdout(io.StringIO()):
+                cube_paths = main([tmp_dir,'--format','cube','--workers','2','--quiet'])
+            self.assertEqual(find_metafiles(tmp_dir),sorted(mf_paths)) #outputs are not found as metafiles
+            for mf_path,cube_path in zip(sorted(mf_paths),cube_paths):
+                cube = ApertureCube(cube_path)
+                text_data = MetafileController(mf_path).load_data(touchstone_class=TouchstoneArray)
+                self.assertTrue(np.all(cube.data==np.array([d.raw for d in text_data])))
+                self.assertTrue(ConvertManifest(get_manifest_path(os.path.dirname(cube_path),mf_path),mf_path,'cube')['complete'])
+                del cube
+            #a changed measurement is the only row rewritten on a restart
+            meas_path = MetafileController(mf_paths[0]).get_filename_list(abs_path=True)[1]
+            meas = TouchstoneArray(meas_path)
+            meas.raw[:] = 0
+            meas.write(meas_path)
+            cube_path = convert_metafile(mf_paths[0],out_format='cube',n_workers=1)
+            cube = ApertureCube(cube_path)
+            self.assertTrue(np.all(cube.data[1]==0))
+            self.assertFalse(np.any(cube.data[0]==0))
+            del cube
+            with self.assertRaises(ValueError):
+                convert_metafile(mf_paths[0],out_format='bad')
+
+if __name__=='__main__':
+    if len(sys.argv)>1:
+        main()
+    else:
+        suite = unittest.TestLoader().loadTestsFromTestCase(TestMetafileConverter)
+        unittest.TextTestRunner(verbosity=2).run(suite)
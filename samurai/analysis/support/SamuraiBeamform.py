@@ -5,13 +5,20 @@ Created on Fri Mar 22 15:41:34 2019
 @author: ajw5
 """
 from samurai.analysis.support.SamuraiPostProcess import SamuraiSyntheticApertureAlgorithm
-from samurai.analysis.support.SamuraiPostProcess import to_azel,get_k,to_uv
+from samurai.analysis.support.SamuraiPostProcess import to_azel,get_k,to_uv,get_k_vectors,calculate_partial_steering_vectors
 from samurai.analysis.support.SamuraiPostProcess import calculate_steering_vector_from_partial_k
-from samurai.analysis.support.SamuraiPostProcess import vector_mult_complex,vector_div_complex
 from samurai.analysis.support.SamuraiCalculatedSyntheticAperture import CalculatedSyntheticAperture
 from samurai.analysis.support.SamuraiCalculatedSyntheticAperture import Antenna
-from samurai.base.generic import ValueCounter
+from samurai.base.generic import ProgressCounter
+from samurai.base.TouchstoneEditor import TouchstoneArray
+from samurai.base.MUF.MUFResult import StreamingStatistics
 import numpy as np #import constants
+from numba import njit
+from scipy import ndimage
+from scipy.fft import next_fast_len,fftn
+import os
+from concurrent.futures import ProcessPoolExecutor,ThreadPoolExecutor,as_completed
+from multiprocessing import shared_memory
 
 import six #backward compatability
 
@@ -104,7 +111,28 @@ class SamuraiBeamform(SamuraiSyntheticApertureAlgorithm):
             verbose         - whether or not to be verbose (default False)
             antenna_pattern - AntennaPattern Class parameter to include (default None)
             unit_mult - unit multiplier for positions
-            use_vectorized - use vectorized numba operations (default true)
+            use_vectorized - use vectorized numba operations (default False)
+            freq_block_size - number of frequencies to beamform at once. 'auto' will fit
+                the block in max_block_memory (default 'auto')
+            angle_block_size - number of angles to beamform at once. 'auto' will fit
+                the block in max_block_memory (default 'auto')
+            max_block_memory - bytes allowed for a block of steering vectors when using 'auto' block sizes (default 32 MB).
+                Peak memory does not grow with the number of angles beyond the output values themselves
+            n_workers - number of processes to split the frequencies (or angles) across. 
+                None will use all cpus (default 1)
+            steering_cache - SteeringVectorCache to reuse partial steering vectors (default self.options['steering_cache'])
+            phase_recurrence - step the steering vector phase between frequencies instead of
+                calculating each directly. 'auto' does this when the frequencies are uniformly spaced (default 'auto')
+            renorm_period - number of frequencies between direct steering vector calculations when
+                using phase_recurrence (default 64)
+            backend - how to calculate the beamformed values (default 'direct'). Can be
+                'direct' - sum over all positions for each angle
+                'fft' - 2D FFT for positions on a uniform planar x/y grid (see beamform_fft)
+                'nufft' - nonuniform FFT for arbitrary positions (e.g. tracked or perturbed, see beamform_nufft)
+                'auto' - 'fft' if the positions are on a uniform planar grid otherwise 'direct'
+            fft_oversample - zero padding factor for the 'fft' backend (default 8)
+            fft_interp_order - spline order to interpolate the spectrum for the 'fft' backend (default 5)
+            nufft_tol - requested relative accuracy for the 'nufft' backend (default 1e-4)
         @note This is not the most efficient way to do this. Should convert directly to UV
         @return list of CalculatedSyntheticAperture objects
         '''
@@ -113,55 +141,107 @@ class SamuraiBeamform(SamuraiSyntheticApertureAlgorithm):
         options['verbose'] = self.options['verbose']
         options['antenna_pattern'] = self.options['antenna_pattern']
         options['use_vectorized'] = False
+        options['freq_block_size'] = 'auto'
+        options['angle_block_size'] = 'auto'
+        options['max_block_memory'] = 2**25
+        options['n_workers'] = 1
+        options['steering_cache'] = self.options['steering_cache']
+        options['phase_recurrence'] = 'auto'
+        options['renorm_period'] = 64
+        options['backend'] = 'direct'
+        options['fft_oversample'] = 8
+        options['fft_interp_order'] = 5
+        options['nufft_tol'] = 1e-4
         for key,val in six.iteritems(arg_options):
             options[key] = val #set kwargs
         antenna_pattern = options['antenna_pattern']
         verbose = options['verbose']
         
-        #validate our current data
-        self.validate_data()
-        
-        #list of calulcated synthetic apertures        
-        s_freq_list = self.freq_list
-        s21_vals = self.s_parameter_data.astype(np.complex64)
-        weights = self.weights.astype(np.complex64)
-        
-        #set our frequency list
-        if freq_list=='all': #make all frequcnies if 'all'
-            freq_list = s_freq_list
-        if not hasattr(freq_list,'__iter__'): #make a list if its not
-            freq_list = [freq_list] 
-        freq_list = np.array(freq_list)
+        #weighted measurements at the frequencies we have
+        [freqs,s21_weighted] = self.get_weighted_measurements(freq_list)
         
         #change our coordinates to uv
         [azimuth,elevation] = to_azel(az_u,el_v,coord)
         
+        #output values are filled in place one (angle,frequency) block at a time
+        mycsa = CalculatedSyntheticAperture(azimuth,elevation,**self.options)
+        if not len(freqs): #nothing to beamform
+            return mycsa
+        beamformed_vals = mycsa.allocate_frequency_data(freqs) #(angle,freq) view
+        
         #get our position data
         if verbose: print("Reading measurement positions")
         pos = self.get_positions('m') #get all of our positions in meters
-        pos-=pos.mean(axis=0) #normalize to the center of the array
-        az_angles = pos[:,5] #with current coordinates system azimuth=gamma
         
-        #now lets use this data to get our delta_r beamforming values
-        #this delta_r will be a 2D array with the first dimension being for each position
-        # the second dimeino will be each of the theta/phi pairs for the angles
-        if verbose: print("Finding Partial Steering Vectors vectors")
-        psv_vecs =  self.get_partial_steering_vectors(azimuth,elevation).astype(np.complex64) #k_vectors*position_vectors
+        #now lets loop through blocks of angles and frequencies
+        if verbose: print("Beginning beamforming for %d frequencies" %(len(freqs)))
+        block_options = {k:options[k] for k in ['verbose','antenna_pattern','use_vectorized','steering_cache',
+                                               'freq_block_size','angle_block_size','max_block_memory',
+                                               'phase_recurrence','renorm_period']}
+        az_flat = np.reshape(azimuth,(-1,)); el_flat = np.reshape(elevation,(-1,))
+        backend = options['backend']
+        if backend in ['fft','auto']: #check for a uniform planar grid
+            planar_grid = get_uniform_planar_grid(pos)
+            if backend=='auto':
+                use_fft = planar_grid is not None and (antenna_pattern is None or np.ptp(pos[:,5])==0)
+                backend = 'fft' if use_fft else 'direct'
+        if backend=='fft':
+            if verbose: print("Using FFT beamforming on a uniform planar grid")
+            beamform_fft(s21_weighted,pos,az_flat,el_flat,freqs,beamformed_vals,
+                         planar_grid=planar_grid,antenna_pattern=antenna_pattern,max_block_memory=options['max_block_memory'],
+                         fft_oversample=options['fft_oversample'],fft_interp_order=options['fft_interp_order'])
+        elif backend=='nufft':
+            if verbose: print("Using NUFFT beamforming")
+            beamform_nufft(s21_weighted,pos,az_flat,el_flat,freqs,beamformed_vals,
+                           nufft_tol=options['nufft_tol'],antenna_pattern=antenna_pattern,
+                           max_block_memory=options['max_block_memory'])
+        elif backend!='direct':
+            raise Exception("Beamforming backend '{}' not recognized".format(backend))
+        elif options['n_workers'] is None or options['n_workers']>1:
+            beamform_blocks_parallel(s21_weighted,pos,az_flat,el_flat,freqs,
+                                     beamformed_vals,options['n_workers'],**block_options)
+        else:
+            beamform_blocks(s21_weighted,pos,az_flat,el_flat,freqs,
+                            beamformed_vals,**block_options)
         
-        #set our antenna values
-        az_adj = -1*az_angles[:,np.newaxis]+np.reshape(azimuth,(-1,))
-        el_adj = np.zeros(az_adj.shape)
-        if(antenna_pattern is not None):
-            antenna_values = antenna_pattern.get_values(az_adj,el_adj).astype(np.complex64)
-        #else:
-            #antenna_values = np.ones(psv_vecs.shape,dtype=np.complex64)
+        return mycsa
+        #return csa_list,steering_vectors,s21_current,x_locs,y_locs,z_locs,delta_r
+    
+    def get_weighted_measurements(self,freq_list='all'):
+        '''
+        @brief get the measurements at a list of frequencies multiplied by the normalized weights
+        @param[in/OPT] freq_list - list of frequencies to get. 'all' will do all frequencies.
+            Frequencies that are not measured are skipped with a warning
+        @return [sorted frequencies,complex64 weighted measurements (frequency x position)]
+        '''
+        freq_idx_list = self.get_frequency_indices(freq_list)
+        #weighted s params for our frequencies (freq,position) normalized by the sum of the weights
+        s21_vals = self.get_s_parameter_data(freq_idx_list,0).astype(np.complex64) #only gather the masked values we need
+        weights = self.weights.astype(np.complex64)
+        s21_weighted = np.ascontiguousarray(s21_vals.T)*(weights/self.weights.sum())
+        return self.freq_list[freq_idx_list],s21_weighted
+    
+    def get_frequency_indices(self,freq_list='all'):
+        '''
+        @brief get the indices of a list of frequencies in the measured data
+        @param[in/OPT] freq_list - list of frequencies to get. 'all' will do all frequencies.
+            Frequencies that are not measured are skipped with a warning
+        @return integer array of indices into self.freq_list sorted by frequency
+        '''
+        #validate our current data
+        self.validate_data()
+        s_freq_list = self.freq_list
         
-        #now lets loop through each of our frequencies in freq_list
-        if verbose: print("Beginning beamforming for %d frequencies" %(len(freq_list)))
-        mycsa = CalculatedSyntheticAperture(azimuth,elevation,**self.options)
-        vc = ValueCounter(freq_list,'    Calculating for {:10G} Hz',update_period=10)
+        #set our frequency list
+        if isinstance(freq_list,str) and freq_list=='all': #make all frequcnies if 'all'
+            freq_list = s_freq_list
+        if not hasattr(freq_list,'__iter__'): #make a list if its not
+            freq_list = [freq_list] 
+        freq_list = np.array(freq_list)
+        
+        #find where each of our requested frequencies is in the measured data
+        freq_idx_list = []
         for freq in freq_list:
-            if verbose: vc.update(freq)
             freq_idx = np.where(s_freq_list==freq)[0]
             if(freq_idx.size<1):
                 print("    WARNING: Frequency %f Hz not found. Aborting." %(freq))
@@ -169,48 +249,1187 @@ class SamuraiBeamform(SamuraiSyntheticApertureAlgorithm):
             elif(freq_idx.size>1):
                 print("    WARNING: More than one frequency %f Hz found. Aborting" %(freq))
                 continue
+            freq_idx_list.append(freq_idx[0])
+        freq_idx_list = np.array(freq_idx_list,dtype=int)
+        return freq_idx_list[np.argsort(s_freq_list[freq_idx_list],kind='stable')] #CSA stores sorted frequencies
+
+    def beamform_monte_carlo(self,az_vals,el_vals,num_reps,pos_uncert,freq_list='all',**arg_options):
+        '''
+        @brief Monte Carlo analysis of the beamformed pattern with normally distributed position errors.
+            This gives the same statistics as calling perturb_positions_normal and beamform_azel num_reps times,
+            but all of the perturbations are drawn at once and beamformed in batches of realizations.
+        @param[in] az_vals - azimuth angles (radians)
+        @param[in] el_vals - elevation angles (radians)
+        @note az and el vals will be meshgridded like beamform_azel
+        @param[in] num_reps - number of realizations of the positions
+        @param[in] pos_uncert - standard deviation of the positions. Can be a scalar, [x,y,z,alpha,beta,gamma],
+            or a 2D array like perturb_positions_normal. This is added to any current perturbation of the positions
+        @param[in/OPT] freq_list - list of frequencies to calculate for 'all' will do all frequencies
+        @param[in/OPT] arg_options - keyword arguments as follows:
+            units - units of pos_uncert (default 'm')
+            data_type - type of data to calculate statistics of ('mag_db','mag','phase_d',etc.) (default 'mag_db')
+            percentiles - list of percentiles to calculate (default [2.5,97.5])
+            seed - seed for np.random.default_rng to repeat the perturbations (default None)
+            verbose,antenna_pattern,max_block_memory - see beamform
+            All options are also passed to beamform for the nominal values
+        @return dictionary with 'nominal' (CalculatedSyntheticAperture without the perturbations), 'mean', 'std',
+            and 'percentiles' (percentile x elevation x azimuth x frequency) of data_type, 'percentile_values'
+            and 'freq_list'. The statistics are the same shape as the nominal complex_values
+        @example
+            mc = mybf.beamform_monte_carlo(np.deg2rad(np.arange(-90,90,0.5)),0,100,[0.001,0.001,0.001,0,0,0])
+            az_std = mc['std'][0,:,0] #azimuth cut of the standard deviation in dB at the first frequency
+        '''
+        options = {}
+        options['units'] = 'm'
+        options['data_type'] = 'mag_db'
+        options['percentiles'] = [2.5,97.5]
+        options['seed'] = None
+        options['verbose'] = self.options['verbose']
+        options['antenna_pattern'] = self.options['antenna_pattern']
+        options['max_block_memory'] = 2**25
+        for key,val in six.iteritems(arg_options):
+            options[key] = val
+        [AZ,EL] = np.meshgrid(np.rad2deg(az_vals),np.rad2deg(el_vals))
+        bf_options = {k:v for k,v in options.items() if k not in ['units','data_type','percentiles','seed']}
+        nominal_csa = self.beamform(AZ,EL,freq_list=freq_list,coord='azel',**bf_options)
+
+        #draw all of the perturbations at once (in meters like get_positions('m'))
+        [freqs,s21_weighted] = self.get_weighted_measurements(freq_list)
+        pos = self.get_positions('m')
+        pos_uncert = self.expand_position_perturbation_val(pos_uncert)[self.mask_index]*self.unit_conversion_dict[options['units']]
+        rng = np.random.default_rng(options['seed'])
+        perturbations = rng.normal(0,pos_uncert,size=(num_reps,)+pos_uncert.shape)
+
+        if options['verbose']: print("Beamforming %d realizations for %d frequencies" %(num_reps,len(freqs)))
+        [mean_vals,std_vals,pct_vals] = beamform_monte_carlo_blocks(s21_weighted,pos,perturbations,
+                np.reshape(AZ,(-1,)),np.reshape(EL,(-1,)),freqs,data_type=options['data_type'],
+                percentiles=options['percentiles'],antenna_pattern=options['antenna_pattern'],
+                max_block_memory=options['max_block_memory'],verbose=options['verbose'])
+        out_shape = AZ.shape+(len(freqs),)
+        return {'nominal':nominal_csa,'mean':mean_vals.reshape(out_shape),'std':std_vals.reshape(out_shape),
+                'percentiles':pct_vals.reshape((-1,)+out_shape),'percentile_values':list(np.atleast_1d(options['percentiles'])),
+                'freq_list':freqs}
+
+    def beamform_muf(self,az_vals,el_vals,freq_list='all',**arg_options):
+        '''
+        @brief Beamform the nominal values and every monte_carlo (or perturbed) realization of MUF results 
+            in a single pass and calculate statistics of the patterns like the MUF.
+            Each position's *.meas file is only parsed once. Blocks of realizations are read as a 
+            (realization x position x frequency) cube and beamformed together with the same steering vectors
+            (see beamform_realizations). The statistics are accumulated one realization at a time (see StreamingStatistics)
+            so only a single block of realizations is ever in memory
+        @param[in] az_vals - azimuth angles (radians)
+        @param[in] el_vals - elevation angles (radians)
+        @note az and el vals will be meshgridded like beamform_azel
+        @param[in/OPT] freq_list - list of frequencies to calculate for 'all' will do all frequencies
+        @param[in/OPT] arg_options - keyword arguments as follows:
+            data_type - 'monte_carlo' or 'perturbed' (default 'monte_carlo')
+            confidence_interval - confidence interval percentage (default 95)
+            quantile_method - how to find the confidence interval (see StreamingStatistics) (default 'auto')
+            realization_block_size - number of realizations to read and beamform at once. 'auto' will fit 
+                the realizations and their beamformed values in max_block_memory (default 'auto')
+            n_workers - number of threads to parse the *.meas files and read the data with (default 1)
+            verbose,antenna_pattern,max_block_memory,use_vectorized - see beamform
+            All options are also passed to beamform for the nominal values
+        @note the data must be loaded from a metafile of *.meas files. Each measurement must have the same number of realizations
+        @return MUFBeamformResult with the nominal CalculatedSyntheticAperture and statistics of data_type
+        @example
+            mybf = SamuraiBeamform('path/to/metafile.json',load_key=21)
+            res = mybf.beamform_muf(np.deg2rad(np.arange(-90,90,1)),0)
+            res.monte_carlo.confidence_interval['+'].plot_azel()
+        '''
+        options = {}
+        options['data_type'] = 'monte_carlo'
+        options['confidence_interval'] = 95
+        options['quantile_method'] = 'auto'
+        options['realization_block_size'] = 'auto'
+        options['n_workers'] = 1
+        options['verbose'] = self.options['verbose']
+        options['antenna_pattern'] = self.options['antenna_pattern']
+        options['max_block_memory'] = 2**25
+        options['use_vectorized'] = False
+        for key,val in six.iteritems(arg_options):
+            options[key] = val
+        if self.metafile is None:
+            raise Exception("MUF realizations can only be beamformed for data loaded from a metafile")
+        [AZ,EL] = np.meshgrid(np.rad2deg(az_vals),np.rad2deg(el_vals))
+        bf_options = {k:v for k,v in options.items() if k not in ['data_type','confidence_interval','quantile_method',
+                                                                 'realization_block_size','n_workers']}
+        nominal_csa = self.beamform(AZ,EL,freq_list=freq_list,coord='azel',**bf_options)
+        
+        #parse each *.meas file once for the paths of all of the realizations
+        freq_idx = self.get_frequency_indices(freq_list)
+        freqs = self.freq_list[freq_idx]
+        meas_idx = np.arange(len(self.all_positions))[self.mask_index]
+        if options['verbose']: print("Reading {} paths".format(options['data_type']))
+        muf_paths = self.metafile.get_muf_data_paths(options['data_type'],data_idx=meas_idx,n_workers=options['n_workers'])
+        num_reps = len(muf_paths[0]) if len(muf_paths) else 0
+        if num_reps<1 or any([len(p)!=num_reps for p in muf_paths]):
+            raise Exception("Every measurement must have the same number of {} realizations".format(options['data_type']))
+        
+        #beamform blocks of realizations and accumulate the statistics
+        pos = self.get_positions('m')
+        weights = (self.weights/self.weights.sum()).astype(np.complex64)
+        load_key = self.options['load_key'][0] if hasattr(self.options['load_key'],'__len__') else self.options['load_key']
+        rep_block_size = options['realization_block_size']
+        if rep_block_size=='auto': #realization values and beamformed values
+            rep_block_size = options['max_block_memory']//(8*max(len(freqs),1)*(len(meas_idx)+AZ.size))
+        rep_block_size = min(max(int(rep_block_size),1),num_reps)
+        stats = StreamingStatistics(num_reps,options['confidence_interval'],options['quantile_method'])
+        rep_starts = range(0,num_reps,rep_block_size)
+        if options['verbose']: pc = ProgressCounter(len(rep_starts),'    Beamforming realization block',update_period=1)
+        with ThreadPoolExecutor(options['n_workers']) as executor:
+            for rep_start in rep_starts:
+                rep_slice = slice(rep_start,rep_start+rep_block_size)
+                block_paths = [p for rep_paths in muf_paths for p in rep_paths[rep_slice]] #(position,realization) order
+                read_args = ([load_key]*len(block_paths),[freq_idx]*len(block_paths))
+                s_vals = np.array(list(executor.map(_read_realization_values,block_paths,*read_args)),dtype=np.complex64)
+                s_vals = s_vals.reshape((len(meas_idx),-1,len(freqs))).transpose(1,2,0) #(realization,frequency,position)
+                rep_vals = beamform_realizations(s_vals*weights,pos,AZ.reshape(-1),EL.reshape(-1),freqs,
+                                                 antenna_pattern=options['antenna_pattern'],use_vectorized=options['use_vectorized'],
+                                                 max_block_memory=options['max_block_memory'])
+                for vals in rep_vals:
+                    stats.update(vals)
+                if options['verbose']: pc.update()
+        if options['verbose']: pc.finalize()
+        stat = BeamformStatistic(stats.get_statistics(),AZ,EL,freqs,num_reps,options['confidence_interval'],**self.options)
+        return MUFBeamformResult(nominal_csa,**{options['data_type']:stat})
+
+    beamforming_farfield = beamform #does not create meshgrid
+    beamforming_farfield_uv = beamform_uv #creates meshgrid
+    beamforming_farfield_azel = beamform_azel #creates meshgrid
+
+
+def get_block_sizes(num_positions,num_angles,angle_block_size='auto',freq_block_size='auto',max_block_memory=2**25):
+    '''
+    @brief get the number of angles and frequencies to beamform at once.
+        Each steering vector value in a block takes 8 bytes (real and imaginary float32).
+        When both are 'auto' all angles are done at once if a single frequency fits in max_block_memory,
+        otherwise the angles are tiled one frequency at a time.
+    @param[in] num_positions - number of positions in the aperture
+    @param[in] num_angles - total number of angles to beamform
+    @param[in/OPT] angle_block_size - number of angles per block or 'auto' (default 'auto')
+    @param[in/OPT] freq_block_size - number of frequencies per block or 'auto' (default 'auto')
+    @param[in/OPT] max_block_memory - bytes allowed for a block of steering vectors (default 32 MB)
+    @return [angle_block_size,freq_block_size]
+    '''
+    bytes_per_value = 2*np.dtype(np.float32).itemsize
+    max_values = max_block_memory//(bytes_per_value*max(num_positions,1)) #(angle,freq) pairs per block
+    if angle_block_size=='auto':
+        freq_per_block = 1 if freq_block_size=='auto' else freq_block_size
+        angle_block_size = max_values//freq_per_block
+    angle_block_size = min(max(int(angle_block_size),1),max(num_angles,1))
+    if freq_block_size=='auto':
+        freq_block_size = max_values//angle_block_size
+    freq_block_size = max(int(freq_block_size),1)
+    return [angle_block_size,freq_block_size]
+
+def beamform_blocks(s_weighted,positions,azimuth,elevation,freqs,out_vals,**arg_options):
+    '''
+    @brief Beamform blocks of angles and frequencies and write them into out_vals.
+        The angles are tiled so only a single block of steering vectors is in memory at a time.
+    @param[in] s_weighted - weighted measurements normalized by the sum of the weights (frequency x position)
+    @param[in] positions - measurement positions in meters (position x [x,y,z,alpha,beta,gamma])
+    @param[in] azimuth - flattened azimuth angles (degrees)
+    @param[in] elevation - flattened elevation angles (degrees)
+    @param[in] freqs - frequency of each row of s_weighted
+    @param[out] out_vals - (angle x frequency) array to write the beamformed values into
+    @param[in/OPT] arg_options - keyword arguments as follows:
+        verbose         - whether or not to print progress (default False)
+        antenna_pattern - AntennaPattern Class parameter to include (default None)
+        steering_cache  - SteeringVectorCache to get the partial steering vectors from (default None)
+        use_vectorized,freq_block_size,angle_block_size,max_block_memory - see SamuraiBeamform.beamform
+        phase_recurrence,renorm_period - see SamuraiBeamform.beamform
+    '''
+    options = {}
+    options['verbose'] = False
+    options['antenna_pattern'] = None
+    options['use_vectorized'] = False
+    options['freq_block_size'] = 'auto'
+    options['angle_block_size'] = 'auto'
+    options['max_block_memory'] = 2**25
+    options['steering_cache'] = None
+    options['phase_recurrence'] = 'auto'
+    options['renorm_period'] = 64
+    for key,val in six.iteritems(arg_options):
+        options[key] = val
+    antenna_pattern = options['antenna_pattern']
+    az_angles = positions[:,5]-positions[:,5].mean() #with current coordinates system azimuth=gamma
+    
+    #check if we can step the phase between uniformly spaced frequencies
+    use_recurrence = options['phase_recurrence']
+    if use_recurrence=='auto':
+        use_recurrence = (not options['use_vectorized']) and len(freqs)>2 and is_uniform_spacing(freqs)
+    
+    #get how many angles and frequencies to beamform at once
+    if use_recurrence and options['freq_block_size']=='auto':
+        #only the current steering vectors and phase step are stored so do all frequencies at once
+        [angle_block_size,_] = get_block_sizes(positions.shape[0],len(azimuth),
+                options['angle_block_size'],2,options['max_block_memory'])
+        freq_block_size = max(len(freqs),1)
+    else:
+        [angle_block_size,freq_block_size] = get_block_sizes(positions.shape[0],len(azimuth),
+                options['angle_block_size'],options['freq_block_size'],options['max_block_memory'])
+    angle_starts = range(0,len(azimuth),angle_block_size)
+    freq_starts = range(0,len(freqs),freq_block_size)
+    if options['verbose']: pc = ProgressCounter(len(angle_starts)*len(freq_starts),'    Calculating block',update_period=1)
+    for angle_start in angle_starts:
+        angle_slice = slice(angle_start,angle_start+angle_block_size)
+        #now lets use this data to get our delta_r beamforming values
+        #this delta_r will be a 2D array with the first dimension being for each position
+        # the second dimeino will be each of the theta/phi pairs for the angles
+        if options['steering_cache'] is not None:
+            psv_vecs = options['steering_cache'].get_partial_steering_vectors(
+                    positions,azimuth[angle_slice],elevation[angle_slice],dtype=np.float32)
+        else:
+            psv_vecs = calculate_partial_steering_vectors(
+                    positions,azimuth[angle_slice],elevation[angle_slice]).astype(np.float32) #k_vectors*position_vectors
+        #set our antenna values
+        antenna_values = None
+        if(antenna_pattern is not None):
+            az_adj = -1*az_angles[:,np.newaxis]+azimuth[angle_slice]
+            el_adj = np.zeros(az_adj.shape)
+            antenna_values = antenna_pattern.get_values(az_adj,el_adj).astype(np.complex64)
+        for freq_start in freq_starts:
+            freq_slice = slice(freq_start,freq_start+freq_block_size)
+            # sum(value_at_position*steering_vector) for each angle and frequency
+            if use_recurrence:
+                block_vals = beamform_frequency_block_recurrence(s_weighted[freq_slice],psv_vecs,get_k(freqs[freq_slice]),
+                                        antenna_values,renorm_period=options['renorm_period'])
             else:
-                freq_idx = freq_idx[0]
-            #if we make it here the frequency exists. now get our s params for the current frequency
-            s21_current = np.ascontiguousarray(s21_vals[...,freq_idx,0])
-            #now we can calculate the beam phases for each of the angles at each position
+                block_vals = beamform_frequency_block(s_weighted[freq_slice],psv_vecs,get_k(freqs[freq_slice]),
+                                        antenna_values,use_vectorized=options['use_vectorized'])
+            out_vals[angle_slice,freq_slice] = block_vals.T
+            if options['verbose']: pc.update()
+    if options['verbose']: pc.finalize()
+
+def beamform_frequency_block(s_weighted,psv_vecs,k_vals,antenna_values=None,use_vectorized=False):
+    '''
+    @brief Beamform a block of frequencies at once. The steering vectors for all frequencies
+        in the block are calculated as a single (frequency,position,angle) tensor and 
+        contracted with the weighted measurements using batched matrix multiplies.
+    @note The steering vectors are split into real and imaginary parts (cos/sin of the phase)
+        which is much faster to evaluate than a complex exponential.
+    @param[in] s_weighted - weighted measurement values (frequency x position)
+    @param[in] psv_vecs - real partial steering vectors (position x angle) from get_partial_steering_vectors.
+        This can also have leading batch dimensions (e.g. realization x position x angle for perturbed positions)
+    @param[in] k_vals - wavenumber for each frequency in the block
+    @param[in/OPT] antenna_values - antenna pattern values to divide out (shape of psv_vecs) (default None)
+    @param[in/OPT] use_vectorized - use vectorized numba operations for the steering vectors (default False)
+    @return complex64 array of beamformed values (frequency x [batch x] angle) that are not normalized by the weights
+    '''
+    sv_real,sv_imag = get_steering_vector_parts(psv_vecs,k_vals,antenna_values,use_vectorized)
+    s_weighted = np.asarray(s_weighted,dtype=np.complex64)
+    s_weighted = np.reshape(s_weighted,s_weighted.shape[:1]+(1,)*(np.ndim(psv_vecs)-1)+s_weighted.shape[-1:])
+    s_real = np.ascontiguousarray(s_weighted.real); s_imag = np.ascontiguousarray(s_weighted.imag)
+    beamformed_vals = np.empty(sv_real.shape[:-2]+sv_real.shape[-1:],dtype=np.complex64)
+    beamformed_vals.real = (np.matmul(s_real,sv_real)-np.matmul(s_imag,sv_imag))[...,0,:]
+    beamformed_vals.imag = (np.matmul(s_real,sv_imag)+np.matmul(s_imag,sv_real))[...,0,:]
+    return beamformed_vals
+
+def get_steering_vector_parts(psv_vecs,k_vals,antenna_values=None,use_vectorized=False):
+    '''
+    @brief calculate the real and imaginary parts of the steering vectors for a block of frequencies
+    @param[in] psv_vecs - real partial steering vectors ([batch x] position x angle)
+    @param[in] k_vals - wavenumber for each frequency in the block
+    @param[in/OPT] antenna_values - antenna pattern values to divide out (shape of psv_vecs) (default None)
+    @param[in/OPT] use_vectorized - use vectorized numba operations for the steering vectors (default False)
+    @return [real,imaginary] float32 arrays of (frequency x [batch x] position x angle)
+    '''
+    k_vals = np.reshape(np.asarray(k_vals,dtype=np.float32),(-1,)+(1,)*np.ndim(psv_vecs))
+    if use_vectorized:
+        steering_vectors = calculate_steering_vector_from_partial_k(
+                psv_vecs.astype(np.complex64),k_vals.astype(np.complex64))
+        sv_real = steering_vectors.real; sv_imag = steering_vectors.imag
+    else: #exp(-1j*phase) = cos(phase)-1j*sin(phase)
+        phase = k_vals*psv_vecs[np.newaxis,...]
+        sv_real = np.cos(phase); sv_imag = np.sin(phase,out=phase)
+        np.negative(sv_imag,out=sv_imag)
+    if antenna_values is not None: #multiply by 1/antenna_values
+        inv_ant = (1/np.asarray(antenna_values)).astype(np.complex64)
+        sv_real,sv_imag = (sv_real*inv_ant.real-sv_imag*inv_ant.imag,
+                           sv_real*inv_ant.imag+sv_imag*inv_ant.real)
+    return sv_real,sv_imag
+
+def is_uniform_spacing(values,rtol=1e-6):
+    '''
+    @brief check if values are uniformly spaced (e.g. a linear VNA frequency sweep)
+    @param[in] values - 1D array of values to check
+    @param[in/OPT] rtol - relative tolerance of each step compared to the mean step (default 1e-6)
+    '''
+    steps = np.diff(np.asarray(values,dtype=np.float64))
+    if steps.size<1 or steps.mean()==0:
+        return False
+    return bool(np.all(np.abs(steps-steps.mean())<=rtol*np.abs(steps.mean())))
+
+@njit(cache=True,fastmath=True)
+def _accumulate_and_step_phase(s_weighted,sv_real,sv_imag,step_real,step_imag,out_real,out_imag):
+    '''
+    @brief in a single pass over the steering vectors add s_weighted*steering_vectors to the output
+        and multiply the steering vectors by the phase step for the next frequency
+    '''
+    num_pos,num_angles = sv_real.shape
+    out_real[:] = 0; out_imag[:] = 0
+    for p in range(num_pos):
+        s_real = s_weighted[p].real; s_imag = s_weighted[p].imag
+        for a in range(num_angles):
+            sv_r = sv_real[p,a]; sv_i = sv_imag[p,a]
+            out_real[a] += s_real*sv_r-s_imag*sv_i
+            out_imag[a] += s_real*sv_i+s_imag*sv_r
+            sv_real[p,a] = sv_r*step_real[p,a]-sv_i*step_imag[p,a]
+            sv_imag[p,a] = sv_r*step_imag[p,a]+sv_i*step_real[p,a]
+
+def beamform_frequency_block_recurrence(s_weighted,psv_vecs,k_vals,antenna_values=None,renorm_period=64):
+    '''
+    @brief Beamform a block of uniformly spaced frequencies by stepping the phase of the steering vectors.
+        exp(-1j*k0*psv) and the phase step exp(-1j*dk*psv) are calculated once, then each following
+        frequency only needs a complex multiply instead of evaluating the trig functions again.
+        The steering vectors are renormalized every renorm_period frequencies by recalculating them
+        directly, which bounds the magnitude and phase drift from accumulated rounding errors.
+    @param[in] s_weighted - weighted measurement values (frequency x position)
+    @param[in] psv_vecs - real partial steering vectors (position x angle) from get_partial_steering_vectors
+    @param[in] k_vals - uniformly spaced wavenumber for each frequency in the block
+    @param[in/OPT] antenna_values - antenna pattern values to divide out (position x angle) (default None)
+    @param[in/OPT] renorm_period - number of frequencies between direct calculations (default 64)
+    @return complex64 array of beamformed values (frequency x angle) that are not normalized by the weights
+    '''
+    k_vals = np.reshape(np.asarray(k_vals,dtype=np.float64),(-1,))
+    s_weighted = np.ascontiguousarray(s_weighted,dtype=np.complex64)
+    psv_vecs = np.ascontiguousarray(psv_vecs,dtype=np.float32)
+    renorm_period = max(int(renorm_period),1)
+    out_real = np.empty((len(k_vals),psv_vecs.shape[-1]),dtype=np.float32)
+    out_imag = np.empty_like(out_real)
+    if len(k_vals)>1: #exp(-1j*dk*psv)
+        phase = np.float32((k_vals[-1]-k_vals[0])/(len(k_vals)-1))*psv_vecs
+        step_real = np.cos(phase); step_imag = -np.sin(phase)
+    else:
+        step_real = np.ones_like(psv_vecs); step_imag = np.zeros_like(psv_vecs)
+    for i,k in enumerate(k_vals):
+        if i%renorm_period==0: #calculate directly exp(-1j*k*psv)
+            phase = np.float32(k)*psv_vecs
+            sv_real = np.cos(phase); sv_imag = -np.sin(phase)
+            if antenna_values is not None: #multiply by 1/antenna_values
+                inv_ant = (1/np.asarray(antenna_values)).astype(np.complex64)
+                sv_real,sv_imag = (sv_real*inv_ant.real-sv_imag*inv_ant.imag,
+                                   sv_real*inv_ant.imag+sv_imag*inv_ant.real)
+        _accumulate_and_step_phase(s_weighted[i],sv_real,sv_imag,step_real,step_imag,out_real[i],out_imag[i])
+    return out_real+1j*out_imag
+
+#%% FFT beamforming for uniform planar apertures
+def get_uniform_grid_axis(values,atol=1e-6,rtol=1e-3):
+    '''
+    @brief find the uniform grid that a set of 1D values falls on
+    @param[in] values - values to check (e.g. x positions in meters)
+    @param[in/OPT] atol - values closer than this are treated as the same grid point (default 1e-6)
+    @param[in/OPT] rtol - allowed distance from a grid point relative to the step (default 1e-3)
+    @return [start,step,number of points,index of each value] or None if not on a uniform grid
+    '''
+    values = np.asarray(values,dtype=np.float64)
+    start = values.min()
+    distinct = np.sort(values)
+    distinct = distinct[np.append(True,np.diff(distinct)>atol)]
+    if len(distinct)<2: #all at a single point
+        return [start,0.,1,np.zeros(len(values),dtype=int)]
+    step = np.diff(distinct).min()
+    idx_float = (values-start)/step
+    idx = np.round(idx_float).astype(int)
+    if np.any(np.abs(idx_float-idx)>rtol):
+        return None
+    return [start,step,idx.max()+1,idx]
+
+def get_uniform_planar_grid(positions,atol=1e-6,rtol=1e-3):
+    '''
+    @brief check if positions are on a uniform x/y grid at a single z (e.g. from SamuraiApertureBuilder.gen_planar_aperture)
+    @param[in] positions - positions in meters (position x [x,y,z,...])
+    @param[in/OPT] atol - absolute tolerance in meters (default 1e-6)
+    @param[in/OPT] rtol - tolerance of grid indices relative to the step size (default 1e-3)
+    @return dictionary with 'origin' ([x0,y0,z0]), 'step' ([dx,dy]), 'shape' ([ny,nx]),
+        and 'index' ([iy,ix] of each position) or None if the positions are not on a uniform planar grid
+    '''
+    positions = np.asarray(positions,dtype=np.float64)
+    z_vals = positions[:,2]
+    if z_vals.max()-z_vals.min()>atol:
+        return None
+    x_grid = get_uniform_grid_axis(positions[:,0],atol,rtol)
+    y_grid = get_uniform_grid_axis(positions[:,1],atol,rtol)
+    if x_grid is None or y_grid is None:
+        return None
+    return {'origin':[x_grid[0],y_grid[0],z_vals.mean()],'step':[x_grid[1],y_grid[1]],
+            'shape':[y_grid[2],x_grid[2]],'index':[y_grid[3],x_grid[3]]}
+
+def interpolate_spectrum(spectrum,coords,order=5):
+    '''
+    @brief interpolate a periodic complex spectrum (e.g. from an FFT) at fractional bin locations
+    @param[in] spectrum - complex N dimensional spectrum
+    @param[in] coords - fractional bin index for each dimension of spectrum (one row per dimension)
+    @param[in/OPT] order - order of the spline interpolation (default 5)
+    @return complex interpolated values
+    '''
+    interp_vals = ndimage.map_coordinates(spectrum.real,coords,order=order,mode='grid-wrap')
+    return interp_vals+1j*ndimage.map_coordinates(spectrum.imag,coords,order=order,mode='grid-wrap')
+
+def beamform_fft(s_weighted,positions,azimuth,elevation,freqs,out_vals,**arg_options):
+    '''
+    @brief Beamform an aperture on a uniform planar x/y grid with a 2D spatial FFT.
+        The measurements are placed on the grid, zero padded by fft_oversample, and transformed for
+        a block of frequencies at once. The spectrum is then interpolated at the k-space location of each angle.
+        This is O(N*log(N)) per frequency instead of O(N*M) for the direct sum.
+    @param[in] s_weighted - weighted measurements normalized by the sum of the weights (frequency x position)
+    @param[in] positions - measurement positions in meters (position x [x,y,z,alpha,beta,gamma])
+    @param[in] azimuth - flattened azimuth angles (degrees)
+    @param[in] elevation - flattened elevation angles (degrees)
+    @param[in] freqs - frequency of each row of s_weighted
+    @param[out] out_vals - (angle x frequency) array to write the beamformed values into
+    @param[in/OPT] arg_options - keyword arguments as follows:
+        planar_grid - output of get_uniform_planar_grid. If None it will be found from positions (default None)
+        fft_oversample - zero padding factor of the grid which sets the k-space resolution (default 8)
+        fft_interp_order - spline order when interpolating the spectrum (default 5)
+        antenna_pattern - AntennaPattern Class parameter to include. All positions must have the same rotation (default None)
+        max_block_memory - bytes allowed for a block of spectra (default 32 MB)
+    @note The default oversampling and interpolation give a relative error of about 1e-5 compared to the direct sum
+    '''
+    options = {}
+    options['planar_grid'] = None
+    options['fft_oversample'] = 8
+    options['fft_interp_order'] = 5
+    options['antenna_pattern'] = None
+    options['max_block_memory'] = 2**25
+    for key,val in six.iteritems(arg_options):
+        options[key] = val
+    grid = options['planar_grid']
+    if grid is None:
+        grid = get_uniform_planar_grid(positions)
+    if grid is None:
+        raise Exception("Positions are not on a uniform planar grid. Use the 'direct' or 'nufft' backend")
+    [x0,y0,z0] = grid['origin']; [dx,dy] = grid['step']; [iy,ix] = grid['index']
+    fft_shape = [next_fast_len(int(np.ceil(n*options['fft_oversample']))) if n>1 else 1 for n in grid['shape']]
+    
+    #antenna values can only be divided out after the sum if all positions are rotated the same
+    antenna_values = 1
+    if options['antenna_pattern'] is not None:
+        if np.ptp(positions[:,5])>0:
+            raise Exception("The fft backend does not support an antenna_pattern with different position rotations")
+        antenna_values = options['antenna_pattern'].get_values(azimuth[np.newaxis,:],
+                            np.zeros((1,len(azimuth))))[0]
+    
+    k_vecs = get_k_vectors(azimuth,elevation)
+    freq_block_size = max(int(options['max_block_memory']//(np.prod(fft_shape)*16)),1) #complex128 spectra
+    for freq_start in range(0,len(freqs),freq_block_size):
+        freq_slice = slice(freq_start,freq_start+freq_block_size)
+        block_freqs = freqs[freq_slice]
+        #place on the zero padded grid (add in case multiple measurements are at the same location)
+        grid_vals = np.zeros([len(block_freqs)]+fft_shape,dtype=np.complex128)
+        np.add.at(grid_vals,(slice(None),iy,ix),s_weighted[freq_slice])
+        spectra = np.fft.fft2(grid_vals,axes=(-2,-1))
+        for i,freq in enumerate(block_freqs):
             k = get_k(freq)
-            if options['use_vectorized']:
-                steering_vectors = calculate_steering_vector_from_partial_k(psv_vecs,k)
-                s21_weighted = vector_mult_complex(s21_current,weights)
-                if(antenna_pattern is not None):
-                    sv_div_ants  = vector_div_complex(steering_vectors,antenna_values)
-                else:
-                    sv_div_ants = steering_vectors
-            else:
-                steering_vectors = np.exp(-1j*k*psv_vecs)    
-                s21_weighted = s21_current*weights
-                if(antenna_pattern is not None):
-                    sv_div_ants  = steering_vectors/antenna_values
-                else:
-                    sv_div_ants = steering_vectors            
+            #fractional fft bin of each angle (exp(-1j*k*dx*kx*ix) is bin k*dx*kx/(2*pi)*nfft)
+            coords = [(k*dy*k_vecs[1]/(2*np.pi)*fft_shape[0])%fft_shape[0],
+                      (k*dx*k_vecs[0]/(2*np.pi)*fft_shape[1])%fft_shape[1]]
+            vals = interpolate_spectrum(spectra[i],coords,options['fft_interp_order'])
+            #shift from the grid origin
+            vals *= np.exp(-1j*k*(x0*k_vecs[0]+y0*k_vecs[1]+z0*k_vecs[2]))
+            out_vals[:,freq_start+i] = vals/antenna_values
+
+#%% NUFFT beamforming for arbitrary (e.g. tracked or perturbed) positions
+NUFFT_OVERSAMPLE = 2 #spatial grid step is pi/(NUFFT_OVERSAMPLE*k) (lambda/4) and the fft is zero padded by 2
+
+def get_nufft_kernel(tol):
+    '''
+    @brief get the truncated gaussian kernel exp(-exponent*n**2) for n=-half_width...half_width grid points
+        where both the truncation and the aliasing of the 2x oversampled grids are below tol
+    @param[in] tol - requested relative accuracy (e.g. 1e-4)
+    @return [half_width,exponent]
+    '''
+    log_tol = np.log(1/tol)
+    half_width = int(np.ceil(np.sqrt(2)*log_tol/np.pi))
+    return [half_width,log_tol/half_width**2]
+
+@njit(cache=True,fastmath=True)
+def _gaussian_taps(coord,half_width,exponent,size,idx,weights):
+    '''@brief fill the periodic grid indices and gaussian weights around a fractional grid coordinate'''
+    nearest = int(np.floor(coord+0.5))
+    for i in range(2*half_width+1):
+        n = nearest-half_width+i
+        weights[i] = np.exp(-exponent*(n-coord)**2)
+        idx[i] = n%size
+
+@njit(cache=True,fastmath=True)
+def _spread_to_grid(coords,s_vals,half_width,exponent,scales,grid):
+    '''
+    @brief add each value times the separable gaussian kernel around its fractional (x,y,z) grid coordinates to a grid
+    @param[in] coords - (3,position) fractional grid coordinates
+    @param[in] s_vals - complex value at each position
+    @param[in] half_width - kernel half width along each dimension (0 for dimensions that are not gridded)
+    @param[in] exponent - kernel is exp(-exponent*(n-coords)**2)
+    @param[in] scales - (3,max grid size) values to multiply the kernel by at each grid index
+    @param[in/out] grid - complex (nx,ny,nz) grid to add to
+    '''
+    ix = np.empty(2*half_width[0]+1,dtype=np.int64); wx = np.empty(2*half_width[0]+1)
+    iy = np.empty(2*half_width[1]+1,dtype=np.int64); wy = np.empty(2*half_width[1]+1)
+    iz = np.empty(2*half_width[2]+1,dtype=np.int64); wz = np.empty(2*half_width[2]+1)
+    for p in range(coords.shape[1]):
+        _gaussian_taps(coords[0,p],half_width[0],exponent,grid.shape[0],ix,wx)
+        _gaussian_taps(coords[1,p],half_width[1],exponent,grid.shape[1],iy,wy)
+        _gaussian_taps(coords[2,p],half_width[2],exponent,grid.shape[2],iz,wz)
+        for c in range(len(iz)):
+            wz[c] *= scales[2,iz[c]]
+        for a in range(len(ix)):
+            wa = wx[a]*scales[0,ix[a]]
+            for b in range(len(iy)):
+                val = s_vals[p]*(wa*wy[b]*scales[1,iy[b]])
+                for c in range(len(iz)):
+                    grid[ix[a],iy[b],iz[c]] += val*wz[c]
+
+@njit(cache=True,fastmath=True)
+def _interpolate_grid(coords,spectra,half_width,exponent,out):
+    '''
+    @brief gaussian interpolate a block of periodic spectra at fractional (x,y,z) grid coordinates
+    @param[in] coords - (3,angle) fractional grid coordinates
+    @param[in] spectra - complex (frequency,nx,ny,nz) spectra
+    @param[in] half_width - kernel half width along each dimension (0 for dimensions that are not gridded)
+    @param[in] exponent - kernel is exp(-exponent*(n-coords)**2)
+    @param[out] out - complex (angle,frequency) interpolated values
+    '''
+    ix = np.empty(2*half_width[0]+1,dtype=np.int64); wx = np.empty(2*half_width[0]+1)
+    iy = np.empty(2*half_width[1]+1,dtype=np.int64); wy = np.empty(2*half_width[1]+1)
+    iz = np.empty(2*half_width[2]+1,dtype=np.int64); wz = np.empty(2*half_width[2]+1)
+    for t in range(coords.shape[1]):
+        _gaussian_taps(coords[0,t],half_width[0],exponent,spectra.shape[1],ix,wx)
+        _gaussian_taps(coords[1,t],half_width[1],exponent,spectra.shape[2],iy,wy)
+        _gaussian_taps(coords[2,t],half_width[2],exponent,spectra.shape[3],iz,wz)
+        for f in range(spectra.shape[0]):
+            val = 0j
+            for a in range(len(ix)):
+                for b in range(len(iy)):
+                    row = spectra[f,ix[a],iy[b]]
+                    row_val = 0j
+                    for c in range(len(iz)):
+                        row_val += wz[c]*row[iz[c]]
+                    val += wx[a]*wy[b]*row_val
+            out[t,f] = val
+
+def beamform_nufft(s_weighted,positions,azimuth,elevation,freqs,out_vals,**arg_options):
+    '''
+    @brief Beamform an aperture with arbitrary 3D positions using a type 3 (nonuniform to nonuniform) NUFFT.
+        For each frequency the measurements are spread onto a lambda/4 grid with a gaussian kernel,
+        zero padded by 2 and transformed with an FFT. The spectrum is then gaussian interpolated at the k-space
+        location of each angle and the two kernels are divided out (deapodized).
+        The grid step is scaled with each frequency so every angle is at the same spectrum bin for all frequencies.
+        This is O(N*w**d+G*log(G)+M*w**d) per frequency for N positions, M angles, G grid points, and w kernel
+        taps along each of the d dimensions the positions vary in, instead of O(N*M) for the direct sum.
+    @param[in] s_weighted - weighted measurements normalized by the sum of the weights (frequency x position)
+    @param[in] positions - measurement positions in meters (position x [x,y,z,alpha,beta,gamma])
+    @param[in] azimuth - flattened azimuth angles (degrees)
+    @param[in] elevation - flattened elevation angles (degrees)
+    @param[in] freqs - frequency of each row of s_weighted
+    @param[out] out_vals - (angle x frequency) array to write the beamformed values into
+    @param[in/OPT] arg_options - keyword arguments as follows:
+        nufft_tol - requested relative accuracy which sets the kernel width (default 1e-4)
+        antenna_pattern - AntennaPattern Class parameter to include. All positions must have the same rotation (default None)
+        max_block_memory - bytes allowed for a block of spectra (default 32 MB)
+    @note The error relative to the largest beamformed value is typically about 0.2*nufft_tol.
+        Only dimensions the positions vary in are gridded, so a planar aperture is a 2D transform
+    '''
+    options = {}
+    options['nufft_tol'] = 1e-4
+    options['antenna_pattern'] = None
+    options['max_block_memory'] = 2**25
+    for key,val in six.iteritems(arg_options):
+        options[key] = val
+    [half_width,exponent] = get_nufft_kernel(options['nufft_tol'])
+    
+    #antenna values can only be divided out after the sum if all positions are rotated the same
+    antenna_values = np.ones((len(azimuth),1))
+    if options['antenna_pattern'] is not None:
+        if np.ptp(positions[:,5])>0:
+            raise Exception("The nufft backend does not support an antenna_pattern with different position rotations")
+        antenna_values = options['antenna_pattern'].get_values(azimuth[np.newaxis,:],
+                            np.zeros((1,len(azimuth))))[0][:,np.newaxis]
+    
+    #grid the dimensions that the positions vary in around the center of the aperture
+    xyz = np.asarray(positions,dtype=np.float64)[:,:3]
+    center = (xyz.max(axis=0)+xyz.min(axis=0))/2
+    gridded = np.ptp(xyz,axis=0)>0
+    rel_pos = np.where(gridded,xyz-center,0).T
+    dim_half_width = np.where(gridded,half_width,0).astype(np.int64)
+    k_vals = get_k(np.asarray(freqs,dtype=np.float64))
+    min_step = np.pi/(NUFFT_OVERSAMPLE*k_vals.max())
+    half_extent = [int(np.ceil(np.ptp(p)/(2*min_step)))+hw+1 for p,hw in zip(rel_pos,dim_half_width)] #grid points spread onto
+    grid_shape = [next_fast_len(2*2*n) if g else 1 for n,g in zip(half_extent,gridded)] #zero padded by 2
+    #gaussian interpolation of the spectrum needs the grid multiplied by exp(pi**2*n**2/(nfft**2*exponent))
+    grid_scale = np.ones((3,max(grid_shape)))
+    for d in np.flatnonzero(gridded):
+        n = np.fft.fftfreq(grid_shape[d])*grid_shape[d]
+        grid_scale[d,:grid_shape[d]] = np.exp(np.pi**2*n**2/(grid_shape[d]**2*exponent))
+    
+    #spectrum bin of each angle (k*kvec*step*nfft/(2*pi) = kvec*nfft/(2*NUFFT_OVERSAMPLE) for every frequency)
+    k_vecs = get_k_vectors(azimuth,elevation)
+    center_phase = k_vecs.T@center
+    bin_coords = np.where(gridded[:,np.newaxis],k_vecs*(np.array(grid_shape)[:,np.newaxis]/(2*NUFFT_OVERSAMPLE)),0)
+    deapodize = (exponent/np.pi)**gridded.sum()*np.exp(np.pi**2*(k_vecs[gridded]**2).sum(axis=0)/(4*NUFFT_OVERSAMPLE**2*exponent))
+    
+    freq_block_size = max(int(options['max_block_memory']//(16*np.prod(grid_shape))),1)
+    for freq_start in range(0,len(freqs),freq_block_size):
+        freq_slice = slice(freq_start,freq_start+freq_block_size)
+        block_k = k_vals[freq_slice]
+        spectra = np.zeros([len(block_k)]+grid_shape,dtype=np.complex128)
+        for i,k in enumerate(block_k): #grid coordinates are position/(pi/(NUFFT_OVERSAMPLE*k))
+            _spread_to_grid(rel_pos*(NUFFT_OVERSAMPLE*k/np.pi),s_weighted[freq_start+i].astype(np.complex128),
+                            dim_half_width,exponent,grid_scale,spectra[i])
+        spectra = fftn(spectra,axes=(1,2,3),overwrite_x=True)
+        vals = np.empty((len(azimuth),len(block_k)),dtype=np.complex128)
+        _interpolate_grid(bin_coords,spectra,dim_half_width,exponent,vals)
+        #deapodize and shift from the center of the aperture
+        vals *= deapodize[:,np.newaxis]*np.exp(-1j*center_phase[:,np.newaxis]*block_k)
+        out_vals[:,freq_slice] = vals/antenna_values
+
+#%% Monte Carlo beamforming over position uncertainty
+def get_pattern_data(complex_values,data_type='mag_db'):
+    '''
+    @brief get a type of data from complex beamformed values like CalculatedSyntheticAperture.get_data
+    @param[in] complex_values - complex beamformed values
+    @param[in/OPT] data_type - 'mag_db','mag','phase','phase_d','real', or 'imag' (default 'mag_db')
+    '''
+    data_dict = {
+        'mag_db':lambda v: 20*np.log10(np.abs(v)),
+        'mag':np.abs,
+        'phase':np.angle,
+        'phase_d':lambda v: np.angle(v)*180./np.pi,
+        'real':np.real,
+        'imag':np.imag
+        }
+    return data_dict[data_type](complex_values)
+
+def beamform_monte_carlo_blocks(s_weighted,positions,perturbations,azimuth,elevation,freqs,**arg_options):
+    '''
+    @brief Beamform every realization of perturbed positions and calculate statistics of the patterns.
+        For each block of angles and frequency the realizations are beamformed as a batched contraction of
+        (realization x position x angle) steering vectors. Only the realizations of a single block are stored
+        (percentiles need all of them) so memory is bounded by max_block_memory instead of growing with the angles.
+    @param[in] s_weighted - weighted measurements normalized by the sum of the weights (frequency x position)
+    @param[in] positions - nominal measurement positions in meters (position x [x,y,z,alpha,beta,gamma])
+    @param[in] perturbations - values to add to the positions for each realization (realization x position x 6)
+    @param[in] azimuth - flattened azimuth angles (degrees)
+    @param[in] elevation - flattened elevation angles (degrees)
+    @param[in] freqs - frequency of each row of s_weighted
+    @param[in/OPT] arg_options - keyword arguments as follows:
+        data_type - type of data to calculate statistics of (see get_pattern_data) (default 'mag_db')
+        percentiles - list of percentiles to calculate (default [2.5,97.5])
+        antenna_pattern - AntennaPattern Class parameter to include (default None)
+        max_block_memory - bytes allowed for a block of steering vectors, a block of realizations, and the
+            perturbed partial steering vectors (and antenna values) of a block of angles (default 32 MB)
+        verbose - whether or not to print progress (default False)
+    @return [mean,standard deviation,percentiles] of (angle x frequency) and (percentile x angle x frequency)
+    '''
+    options = {}
+    options['data_type'] = 'mag_db'
+    options['percentiles'] = [2.5,97.5]
+    options['antenna_pattern'] = None
+    options['max_block_memory'] = 2**25
+    options['verbose'] = False
+    for key,val in six.iteritems(arg_options):
+        options[key] = val
+    antenna_pattern = options['antenna_pattern']
+    num_reps = perturbations.shape[0]
+    num_pos = positions.shape[0]
+    percentiles = np.atleast_1d(options['percentiles'])
+    mean_vals = np.empty((len(azimuth),len(freqs)))
+    std_vals = np.empty_like(mean_vals)
+    pct_vals = np.empty((len(percentiles),)+mean_vals.shape)
+    
+    #the realizations take the place of the frequencies in each block of steering vectors
+    [angle_block_size,rep_block_size] = get_block_sizes(num_pos,len(azimuth),max_block_memory=options['max_block_memory'])
+    angle_block_size = min(angle_block_size,max(options['max_block_memory']//(16*num_reps),1)) #complex128 realizations
+    bytes_per_rep_angle = num_pos*(4 if antenna_pattern is None else 12) #float32 psv and complex64 antenna values
+    angle_block_size = min(angle_block_size,max(options['max_block_memory']//(bytes_per_rep_angle*num_reps),1))
+    [angle_block_size,rep_block_size] = get_block_sizes(num_pos,len(azimuth),angle_block_size,max_block_memory=options['max_block_memory'])
+    angle_starts = range(0,len(azimuth),angle_block_size)
+    k_vals = get_k(freqs)
+    az_angles = positions[:,5]-positions[:,5].mean() #with current coordinates system azimuth=gamma
+    if options['verbose']: pc = ProgressCounter(len(angle_starts)*len(freqs),'    Calculating block',update_period=1)
+    for angle_start in angle_starts:
+        angle_slice = slice(angle_start,angle_start+angle_block_size)
+        k_vecs = get_k_vectors(azimuth[angle_slice],elevation[angle_slice]).astype(np.float32)
+        psv_vecs = calculate_partial_steering_vectors(positions,azimuth[angle_slice],elevation[angle_slice]).astype(np.float32)
+        #the perturbed positions do not depend on frequency so only calculate them once per block of angles
+        #psv of the perturbed positions is the nominal plus the perturbation dotted with k_vecs
+        rep_psv = psv_vecs+np.matmul(perturbations[:,:,:3].astype(np.float32),k_vecs)
+        antenna_values = None
+        if(antenna_pattern is not None):
+            az_adj = -1*(az_angles+perturbations[:,:,5])[...,np.newaxis]+azimuth[angle_slice]
+            antenna_values = antenna_pattern.get_values(az_adj,np.zeros(az_adj.shape)).astype(np.complex64)
+        rep_vals = np.empty((num_reps,psv_vecs.shape[-1]),dtype=np.complex128)
+        for i,k in enumerate(k_vals):
+            for rep_start in range(0,num_reps,rep_block_size):
+                rep_slice = slice(rep_start,rep_start+rep_block_size)
+                rep_antenna_values = None if antenna_values is None else antenna_values[rep_slice]
+                rep_vals[rep_slice] = beamform_frequency_block(s_weighted[i:i+1],rep_psv[rep_slice],k,rep_antenna_values)[0]
+            data_vals = get_pattern_data(rep_vals,options['data_type'])
+            mean_vals[angle_slice,i] = data_vals.mean(axis=0)
+            std_vals[angle_slice,i] = data_vals.std(axis=0)
+            pct_vals[:,angle_slice,i] = np.percentile(data_vals,percentiles,axis=0)
+            if options['verbose']: pc.update()
+    if options['verbose']: pc.finalize()
+    return mean_vals,std_vals,pct_vals
+
+#%% Beamforming the realizations of MUF results
+def beamform_realizations(s_weighted,positions,azimuth,elevation,freqs,**arg_options):
+    '''
+    @brief Beamform many realizations of the measurements at the same positions (e.g. MUF monte carlo data).
+        The steering vectors of each block of angles and frequencies are only calculated once and 
+        contracted with every realization in a single batched matrix multiply
+    @param[in] s_weighted - weighted measurements normalized by the sum of the weights (realization x frequency x position)
+    @param[in] positions - measurement positions in meters (position x [x,y,z,alpha,beta,gamma])
+    @param[in] azimuth - flattened azimuth angles (degrees)
+    @param[in] elevation - flattened elevation angles (degrees)
+    @param[in] freqs - frequency of each column of s_weighted
+    @param[in/OPT] arg_options - keyword arguments as follows:
+        antenna_pattern - AntennaPattern Class parameter to include (default None)
+        max_block_memory - bytes allowed for a block of steering vectors (default 32 MB)
+        use_vectorized - use vectorized numba operations for the steering vectors (default False)
+    @return complex64 array of beamformed values (realization x angle x frequency)
+    '''
+    options = {}
+    options['antenna_pattern'] = None
+    options['max_block_memory'] = 2**25
+    options['use_vectorized'] = False
+    for key,val in six.iteritems(arg_options):
+        options[key] = val
+    antenna_pattern = options['antenna_pattern']
+    num_reps,num_freqs,num_pos = np.shape(s_weighted)
+    s_weighted = np.moveaxis(np.asarray(s_weighted,dtype=np.complex64),0,1) #(frequency,realization,position)
+    s_real = np.ascontiguousarray(s_weighted.real); s_imag = np.ascontiguousarray(s_weighted.imag)
+    out_vals = np.empty((num_reps,len(azimuth),num_freqs),dtype=np.complex64)
+    [angle_block_size,freq_block_size] = get_block_sizes(num_pos,len(azimuth),max_block_memory=options['max_block_memory'])
+    az_angles = positions[:,5]-positions[:,5].mean() #with current coordinates system azimuth=gamma
+    for angle_start in range(0,len(azimuth),angle_block_size):
+        angle_slice = slice(angle_start,angle_start+angle_block_size)
+        psv_vecs = calculate_partial_steering_vectors(positions,azimuth[angle_slice],elevation[angle_slice]).astype(np.float32)
+        antenna_values = None
+        if(antenna_pattern is not None):
+            az_adj = -1*az_angles[:,np.newaxis]+azimuth[angle_slice]
+            antenna_values = antenna_pattern.get_values(az_adj,np.zeros(az_adj.shape)).astype(np.complex64)
+        for freq_start in range(0,num_freqs,freq_block_size):
+            freq_slice = slice(freq_start,freq_start+freq_block_size)
+            sv_real,sv_imag = get_steering_vector_parts(psv_vecs,get_k(freqs[freq_slice]),antenna_values,options['use_vectorized'])
+            sr = s_real[freq_slice]; si = s_imag[freq_slice] #(frequency,realization,position)@(frequency,position,angle)
+            block_vals = np.empty(sr.shape[:2]+sv_real.shape[-1:],dtype=np.complex64)
+            block_vals.real = np.matmul(sr,sv_real)-np.matmul(si,sv_imag)
+            block_vals.imag = np.matmul(sr,sv_imag)+np.matmul(si,sv_real)
+            out_vals[:,angle_slice,freq_slice] = np.moveaxis(block_vals,0,-1)
+    return out_vals
+
+def _read_realization_values(file_path,load_key,freq_idx):
+    '''@brief read the values of a key at frequency indices from a realization file'''
+    return TouchstoneArray(file_path).S[load_key].raw[freq_idx]
+
+class BeamformStatistic(object):
+    '''
+    @brief statistics of the beamformed patterns of MUF realizations. Like MUFStatistic, the
+        estimate, confidence_interval['+'/'-'], and standard_uncertainty['+'/'-'] are stored,
+        but each is a CalculatedSyntheticAperture
+    @param[in] stats - dictionary of (angle x frequency) values from StreamingStatistics.get_statistics
+    @param[in] AZIMUTH - meshgrid of the azimuth angles (degrees)
+    @param[in] ELEVATION - meshgrid of the elevation angles (degrees)
+    @param[in] freqs - sorted frequencies of the values
+    @param[in] num_realizations - number of realizations the statistics were calculated from
+    @param[in/OPT] ci_percentage - confidence interval percentage (default 95)
+    @param[in/OPT] arg_options - passed to each CalculatedSyntheticAperture
+    '''
+    def __init__(self,stats,AZIMUTH,ELEVATION,freqs,num_realizations,ci_percentage=95,**arg_options):
+        '''@brief Constructor'''
+        self.num_realizations = num_realizations
+        self.ci_percentage = ci_percentage
+        def create_csa(values):
+            csa = CalculatedSyntheticAperture(AZIMUTH,ELEVATION,**arg_options)
+            csa.allocate_frequency_data(freqs)[...] = values
+            return csa
+        self.estimate = create_csa(stats['estimate'])
+        self.confidence_interval = {'+':create_csa(stats['confidence_interval'][0]),'-':create_csa(stats['confidence_interval'][1])}
+        self.standard_uncertainty = {'+':create_csa(stats['standard_uncertainty'][0]),'-':create_csa(stats['standard_uncertainty'][1])}
+        
+    def get_statistics(self):
+        '''@return estimate,ci_+,ci_-,std_+,std_- (CalculatedSyntheticAperture) like MUFStatistic.get_statistics'''
+        return (self.estimate,self.confidence_interval['+'],self.confidence_interval['-'],
+                self.standard_uncertainty['+'],self.standard_uncertainty['-'])
+    
+class MUFBeamformResult(object):
+    '''
+    @brief beamformed patterns with uncertainties like a MUFResult
+    @param[in] nominal - CalculatedSyntheticAperture of the nominal values
+    @param[in/OPT] monte_carlo - BeamformStatistic of the monte carlo realizations (default None)
+    @param[in/OPT] perturbed - BeamformStatistic of the perturbed realizations (default None)
+    '''
+    def __init__(self,nominal,monte_carlo=None,perturbed=None):
+        '''@brief Constructor'''
+        self.nominal = nominal
+        self.monte_carlo = monte_carlo
+        self.perturbed = perturbed
+
+#%% parallel beamforming
+def _to_shared_memory(arr,copy=True):
+    '''
+    @brief place an array in a new block of shared memory
+    @param[in] arr - array to share
+    @param[in/OPT] copy - copy the values of arr (otherwise zeros) (default True)
+    @return [SharedMemory object,(name,shape,dtype) description to attach with _from_shared_memory]
+    '''
+    arr = np.asarray(arr)
+    shm = shared_memory.SharedMemory(create=True,size=max(arr.nbytes,1))
+    shared_arr = np.ndarray(arr.shape,dtype=arr.dtype,buffer=shm.buf)
+    if copy: shared_arr[...] = arr
+    else: shared_arr[...] = 0
+    return shm,(shm.name,arr.shape,arr.dtype.str)
+
+def _from_shared_memory(desc):
+    '''
+    @brief attach to an array created with _to_shared_memory
+    @param[in] desc - (name,shape,dtype) description of the shared array
+    @return [SharedMemory object,ndarray using the shared buffer]
+    '''
+    shm = shared_memory.SharedMemory(name=desc[0])
+    return shm,np.ndarray(desc[1],dtype=desc[2],buffer=shm.buf)
+
+_worker_shared = {} #shared memory and options attached in each beamforming worker process
+
+def _init_beamform_worker(shared_descs,block_options):
+    '''@brief attach each worker process to the shared beamforming arrays'''
+    _worker_shared['shm'] = []
+    for name,desc in shared_descs.items():
+        shm,arr = _from_shared_memory(desc)
+        _worker_shared['shm'].append(shm) #keep a reference so the buffer stays open
+        _worker_shared[name] = arr
+    _worker_shared['options'] = block_options
+
+def _beamform_worker(angle_slice,freq_slice):
+    '''@brief beamform a range of angles and frequencies from the shared arrays'''
+    ws = _worker_shared
+    beamform_blocks(ws['s_weighted'][freq_slice],ws['positions'],ws['azimuth'][angle_slice],
+                    ws['elevation'][angle_slice],ws['freqs'][freq_slice],
+                    ws['out_vals'][angle_slice,freq_slice],**ws['options'])
+    
+def split_beamform_tasks(num_angles,num_freqs,n_workers,tasks_per_worker=4):
+    '''
+    @brief split the beamforming across frequencies (or across angles if there are fewer frequencies than workers)
+    @param[in] num_angles - number of angles being beamformed
+    @param[in] num_freqs - number of frequencies being beamformed
+    @param[in] n_workers - number of worker processes
+    @param[in/OPT] tasks_per_worker - number of tasks to create for each worker to balance the load (default 4)
+    @return list of [angle_slice,freq_slice] for each task
+    '''
+    num_tasks = n_workers*tasks_per_worker
+    if num_freqs>=n_workers:
+        edges = np.linspace(0,num_freqs,min(num_tasks,num_freqs)+1).astype(int)
+        return [[slice(0,num_angles),slice(a,b)] for a,b in zip(edges[:-1],edges[1:])]
+    else:
+        edges = np.linspace(0,num_angles,min(num_tasks,num_angles)+1).astype(int)
+        return [[slice(a,b),slice(0,num_freqs)] for a,b in zip(edges[:-1],edges[1:])]
+
+def beamform_blocks_parallel(s_weighted,positions,azimuth,elevation,freqs,out_vals,n_workers=None,**arg_options):
+    '''
+    @brief Run beamform_blocks across a pool of processes. The measurements, positions, angles
+        and output are placed in shared memory so they are not pickled to each worker. Each worker
+        writes its (angle,frequency) block directly into the shared output.
+    @param[in] s_weighted,positions,azimuth,elevation,freqs - see beamform_blocks
+    @param[out] out_vals - (angle x frequency) array to write the beamformed values into
+    @param[in/OPT] n_workers - number of processes to use. None will use all cpus (default None)
+    @param[in/OPT] arg_options - keyword arguments passed to beamform_blocks in each worker
+    '''
+    if n_workers is None:
+        n_workers = os.cpu_count()
+    verbose = arg_options.pop('verbose',False)
+    in_arrays = {'s_weighted':s_weighted,'positions':positions,'azimuth':azimuth,
+                 'elevation':elevation,'freqs':freqs}
+    shm_list = []
+    shared_descs = {}
+    try:
+        for name,arr in in_arrays.items():
+            shm,shared_descs[name] = _to_shared_memory(np.ascontiguousarray(arr))
+            shm_list.append(shm)
+        out_shm,shared_descs['out_vals'] = _to_shared_memory(out_vals,copy=False)
+        shm_list.append(out_shm)
+        tasks = split_beamform_tasks(len(azimuth),len(freqs),n_workers)
+        with ProcessPoolExecutor(n_workers,initializer=_init_beamform_worker,
+                                 initargs=(shared_descs,arg_options)) as executor:
+            futures = [executor.submit(_beamform_worker,*task) for task in tasks]
+            if verbose: pc = ProgressCounter(len(futures),'    Calculating task',update_period=1)
+            for future in as_completed(futures):
+                future.result() #raise any errors from the workers
+                if verbose: pc.update()
+            if verbose: pc.finalize()
+        #merge the values from the shared output
+        out_vals[...] = np.ndarray(out_vals.shape,dtype=out_vals.dtype,buffer=out_shm.buf)
+    finally:
+        for shm in shm_list:
+            shm.close()
+            shm.unlink()
+
+def _beamform_metafile_worker(metafile_path,az_vals,el_vals,freq_list,arg_options):
+    '''@brief beamform a single metafile and return the values to create a CalculatedSyntheticAperture'''
+    mybf = SamuraiBeamform(metafile_path,**arg_options)
+    if arg_options.get('window',None) is not None:
+        mybf.set_cosine_sum_window_by_name(arg_options['window'])
+    mycsa = mybf.beamform_azel(az_vals,el_vals,freq_list=freq_list,**arg_options)
+    return mycsa.azimuth,mycsa.elevation,mycsa.complex_values,mycsa.freq_list,mybf.options
+
+def beamform_metafiles(metafile_paths,az_vals,el_vals,freq_list='all',n_workers=None,**arg_options):
+    '''
+    @brief Beamform multiple metafiles (e.g. from split_metafile) with one metafile per process.
+    @param[in] metafile_paths - list of paths to metafiles to beamform
+    @param[in] az_vals - azimuth angles (radians). These will be meshgridded like SamuraiBeamform.beamform_azel
+    @param[in] el_vals - elevation angles (radians)
+    @param[in/OPT] freq_list - list of frequencies to calculate for 'all' will do all frequencies
+    @param[in/OPT] n_workers - number of processes to use. None will use all cpus (default None)
+    @param[in/OPT] arg_options - keyword arguments passed to SamuraiBeamform and SamuraiBeamform.beamform_azel.
+        Additionally:
+            window - name of a cosine sum window to apply (e.g. 'hamming') (default None)
+    @return list of CalculatedSyntheticAperture objects in the same order as metafile_paths
+    '''
+    with ProcessPoolExecutor(n_workers) as executor:
+        futures = [executor.submit(_beamform_metafile_worker,mf_path,az_vals,el_vals,freq_list,arg_options) 
+                       for mf_path in metafile_paths]
+        csa_list = []
+        for future in futures:
+            [azimuth,elevation,complex_values,freqs,bf_options] = future.result()
+            csa_list.append(CalculatedSyntheticAperture(azimuth,elevation,complex_values,freqs,**bf_options))
+    return csa_list
+
+
+import unittest
+from samurai.base.TouchstoneEditor import SnpEditor
+from samurai.analysis.support.SamuraiPostProcess import SteeringVectorCache
+class TestSamuraiBeamform(unittest.TestCase):
+    '''@brief test beamforming on a small synthetic aperture'''
+    
+    def get_synthetic_beamform(self,freqs=np.linspace(26.5e9,40e9,7)):
+        '''@brief create a beamform object with random data on a 9x9 planar grid'''
+        rng = np.random.default_rng(0)
+        locs = np.arange(9)*3. #3mm steps
+        [X,Y] = np.meshgrid(locs,locs)
+        pos = np.zeros((X.size,6))
+        pos[:,0] = X.flatten(); pos[:,1] = Y.flatten()
+        mybf = SamuraiBeamform(units='mm')
+        mybf.all_positions = pos
+        s_data = []
+        for i in range(X.size):
+            snp = SnpEditor([2,freqs])
+            snp.raw = rng.normal(size=snp.shape)+1j*rng.normal(size=snp.shape)
+            s_data.append(snp)
+        mybf.all_s_parameter_data = s_data
+        return mybf
+    
+    def get_reference_values(self,mybf,AZ,EL):
+        '''@brief double precision per-frequency beamforming to compare against'''
+        psv_vecs = mybf.get_partial_steering_vectors(AZ,EL)
+        s_vals = mybf.s_parameter_data[...,0]
+        weights = mybf.weights
+        ref_vals = [np.dot(s_vals[:,i]*weights,np.exp(-1j*get_k(f)*psv_vecs))/weights.sum() 
+                        for i,f in enumerate(mybf.freq_list)]
+        return np.stack(ref_vals,axis=-1).reshape(AZ.shape+(-1,))
+    
+    def test_block_beamform(self):
+        '''@brief compare block beamforming to a per-frequency calculation'''
+        mybf = self.get_synthetic_beamform()
+        mybf.set_cosine_sum_window_by_name('hamming')
+        az = np.arange(-90,91,10); el = np.arange(-60,61,20)
+        [AZ,EL] = np.meshgrid(az,el)
+        ref_vals = self.get_reference_values(mybf,AZ,EL)
+        for block_size in [1,3,'auto']:
+            mycsa = mybf.beamform_azel(np.deg2rad(az),np.deg2rad(el),freq_block_size=block_size)
+            self.assertTrue(np.all(mycsa.freq_list==mybf.freq_list))
+            err = np.abs(mycsa.complex_values-ref_vals).max()/np.abs(ref_vals).max()
+            self.assertLess(err,1e-4,'Block size %s' %block_size)
             
-            # sum(value_at_position*steering_vector) for each angle
-            # now calculate the values at each angle
-            #beamformed_vals = np.dot(s21_current*self.weights,steering_vectors/antenna_values)/self.weights.sum()
-            beamformed_vals = np.dot(s21_weighted,sv_div_ants)/self.weights.sum()
+    def test_angle_tiling(self):
+        '''@brief a small memory limit should tile the angles and give the same values'''
+        mybf = self.get_synthetic_beamform()
+        az = np.arange(-90,91,5); el = np.arange(-60,61,10)
+        [AZ,EL] = np.meshgrid(az,el)
+        ref_vals = self.get_reference_values(mybf,AZ,EL)
+        self.assertEqual(get_block_sizes(81,AZ.size,max_block_memory=81*8*50),[50,1])
+        mycsa = mybf.beamform_azel(np.deg2rad(az),np.deg2rad(el),max_block_memory=81*8*50)
+        err = np.abs(mycsa.complex_values-ref_vals).max()/np.abs(ref_vals).max()
+        self.assertLess(err,1e-4)
             
-            #now pack into our CSA (CaluclateSynbteticAperture)
-            mycsa.add_frequency_data(np.reshape(beamformed_vals,azimuth.shape),freq)
-            #csa_list.append(CalculatedSyntheticAperture(azimuth,elevation,np.reshape(beamformed_vals,azimuth.shape)))
-        vc.finalize()
-        if antenna_pattern is not None:
-            ant_vals = CalculatedSyntheticAperture(azimuth,elevation,np.reshape(antenna_values[1,:],azimuth.shape),**self.options)
-        else:
-            ant_vals = None
+    def test_parallel_beamform(self):
+        '''@brief splitting across processes should match the serial values'''
+        mybf = self.get_synthetic_beamform()
+        az = np.deg2rad(np.arange(-90,91,10)); el = np.deg2rad(np.arange(-60,61,20))
+        serial_csa = mybf.beamform_azel(az,el)
+        for freq_list in ['all',mybf.freq_list[:1]]: #split by frequency then by angle
+            par_csa = mybf.beamform_azel(az,el,freq_list=freq_list,n_workers=2)
+            num_freqs = len(par_csa.freq_list)
+            self.assertTrue(np.allclose(par_csa.complex_values,serial_csa.complex_values[...,:num_freqs]))
+        tasks = split_beamform_tasks(10,3,2)
+        covered = np.zeros((10,3),dtype=int)
+        for angle_slice,freq_slice in tasks:
+            covered[angle_slice,freq_slice] += 1
+        self.assertTrue(np.all(covered==1))
+            
+    def test_steering_cache(self):
+        '''@brief beamforming the same geometry again should use the cached steering vectors'''
+        mybf = self.get_synthetic_beamform()
+        mycache = SteeringVectorCache()
+        az = np.deg2rad(np.arange(-90,91,10)); el = np.deg2rad(np.arange(-60,61,20))
+        ref_csa = mybf.beamform_azel(az,el)
+        mybf.beamform_azel(az,el,steering_cache=mycache,freq_list=mybf.freq_list[:2])
+        mycsa = mybf.beamform_azel(az,el,steering_cache=mycache)
+        self.assertEqual([mycache.hits,mycache.misses],[1,1])
+        self.assertTrue(np.all(mycsa.complex_values==ref_csa.complex_values))
+            
+    def test_phase_recurrence(self):
+        '''@brief stepping the phase across a uniform sweep should match calculating each frequency directly'''
+        mybf = self.get_synthetic_beamform(freqs=np.linspace(26.5e9,40e9,301))
+        self.assertTrue(is_uniform_spacing(mybf.freq_list))
+        self.assertFalse(is_uniform_spacing(np.delete(mybf.freq_list,5)))
+        az = np.deg2rad(np.arange(-90,91,5)); el = np.deg2rad(np.arange(-60,61,20))
+        direct_csa = mybf.beamform_azel(az,el,phase_recurrence=False)
+        max_vals = np.abs(direct_csa.complex_values).max()
+        for renorm_period in [301,64]: #without and with renormalization
+            rec_csa = mybf.beamform_azel(az,el,phase_recurrence=True,renorm_period=renorm_period)
+            err = np.abs(rec_csa.complex_values-direct_csa.complex_values).max()/max_vals
+            self.assertLess(err,1e-5,'Relative error %g with renorm_period %d' %(err,renorm_period))
+            
+    def test_fft_beamform(self):
+        '''@brief FFT beamforming on a uniform planar grid should match the direct sum'''
+        mybf = self.get_synthetic_beamform()
+        mybf.set_cosine_sum_window_by_name('hamming')
+        grid = get_uniform_planar_grid(mybf.get_positions('m'))
+        self.assertEqual(grid['shape'],[9,9])
+        self.assertTrue(np.allclose(grid['step'],[0.003,0.003]))
+        az = np.deg2rad(np.arange(-90,91,3)); el = np.deg2rad(np.arange(-60,61,6))
+        direct_csa = mybf.beamform_azel(az,el)
+        fft_csa = mybf.beamform_azel(az,el,backend='fft')
+        err = np.abs(fft_csa.complex_values-direct_csa.complex_values).max()/np.abs(direct_csa.complex_values).max()
+        self.assertLess(err,1e-4)
+        #perturbed positions are no longer on the grid
+        mybf.perturb_positions_normal([0.1,0.1,0.1,0,0,0],units='mm')
+        self.assertIsNone(get_uniform_planar_grid(mybf.get_positions('m')))
+        with self.assertRaises(Exception):
+            mybf.beamform_azel(az,el,backend='fft')
 
-        return mycsa
-        #return csa_list,steering_vectors,s21_current,x_locs,y_locs,z_locs,delta_r
+    def test_nufft_beamform(self):
+        '''@brief NUFFT beamforming should match the direct sum within the requested tolerance'''
+        mybf = self.get_synthetic_beamform()
+        mybf.set_cosine_sum_window_by_name('hamming')
+        az = np.arange(-90,91,3); el = np.arange(-60,61,6)
+        [AZ,EL] = np.meshgrid(az,el)
+        ref_vals = self.get_reference_values(mybf,AZ,EL) #planar grid (only x and y are gridded)
+        nufft_csa = mybf.beamform_azel(np.deg2rad(az),np.deg2rad(el),backend='nufft',nufft_tol=1e-6)
+        err = np.abs(nufft_csa.complex_values-ref_vals).max()/np.abs(ref_vals).max()
+        self.assertLess(err,1e-5)
+        mybf.perturb_positions_normal([0.5,0.5,0.5,0,0,0],units='mm') #tracked positions vary in 3D
+        ref_vals = self.get_reference_values(mybf,AZ,EL)
+        for tol in [1e-2,1e-4,1e-6]:
+            nufft_csa = mybf.beamform_azel(np.deg2rad(az),np.deg2rad(el),backend='nufft',nufft_tol=tol)
+            err = np.abs(nufft_csa.complex_values-ref_vals).max()/np.abs(ref_vals).max()
+            self.assertLess(err,max(tol,1e-5),'Relative error %g with nufft_tol %g' %(err,tol))
 
-    beamforming_farfield = beamform #does not create meshgrid
-    beamforming_farfield_uv = beamform_uv #creates meshgrid
-    beamforming_farfield_azel = beamform_azel #creates meshgrid
+    def test_monte_carlo(self):
+        '''@brief batched Monte Carlo statistics should match perturbing and beamforming each realization'''
+        mybf = self.get_synthetic_beamform(freqs=np.linspace(26.5e9,40e9,3))
+        az = np.deg2rad(np.arange(-90,91,5)); el = np.deg2rad([-10,0,10])
+        rng = np.random.default_rng(1)
+        perturbations = rng.normal(0,[0.5,0.5,0.5,0,0,0],size=(20,81,6)) #mm
+        rep_vals = []
+        for rep_perturbation in perturbations:
+            mybf.all_positions_perturbation = rep_perturbation
+            rep_vals.append(mybf.beamform_azel(az,el).mag_db)
+        mybf.clear_position_perturbation()
+        [AZ,EL] = np.meshgrid(np.rad2deg(az),np.rad2deg(el))
+        [freqs,s_weighted] = mybf.get_weighted_measurements()
+        for max_block_memory in [2**25,81*8*10]: #also split the realizations and angles into blocks
+            [mean_vals,std_vals,pct_vals] = beamform_monte_carlo_blocks(s_weighted,mybf.get_positions('m'),
+                        perturbations/1000,AZ.flatten(),EL.flatten(),freqs,percentiles=[5,50,95],max_block_memory=max_block_memory)
+            self.assertTrue(np.allclose(mean_vals.reshape(AZ.shape+(-1,)),np.mean(rep_vals,axis=0),atol=1e-3))
+            self.assertTrue(np.allclose(std_vals.reshape(AZ.shape+(-1,)),np.std(rep_vals,axis=0),atol=1e-3))
+            self.assertTrue(np.allclose(pct_vals.reshape((3,)+AZ.shape+(-1,)),np.percentile(rep_vals,[5,50,95],axis=0),atol=1e-3))
+        #without uncertainty every realization is the nominal pattern
+        mc = mybf.beamform_monte_carlo(az,el,5,0,seed=0)
+        self.assertEqual(mc['std'].shape,mc['nominal'].complex_values.shape)
+        self.assertTrue(np.allclose(mc['mean'],mc['nominal'].mag_db,atol=1e-3))
+        self.assertTrue(np.all(mc['std']<1e-3))
+        mc_a = mybf.beamform_monte_carlo(az,el,5,0.001,units='mm',seed=0)
+        mc_b = mybf.beamform_monte_carlo(az,el,5,1e-6,seed=0)
+        self.assertTrue(np.allclose(mc_a['percentiles'],mc_b['percentiles']))
+
+    def test_missing_frequency(self):
+        '''@brief frequencies that are not measured should be skipped'''
+        mybf = self.get_synthetic_beamform()
+        freqs = [mybf.freq_list[2],1e9,mybf.freq_list[0]]
+        mycsa = mybf.beamform_azel(np.deg2rad([-10,0,10]),[0],freq_list=freqs,freq_block_size=2)
+        self.assertTrue(np.all(mycsa.freq_list==np.sort(freqs[::2])))
+        self.assertEqual(mycsa.complex_values.shape,(1,3,2))
+
+    def test_masked_beamform(self):
+        '''@brief beamforming a masked aperture should match an aperture with only those positions'''
+        mybf = self.get_synthetic_beamform()
+        az = np.deg2rad(np.arange(-90,91,10)); el = np.deg2rad(np.arange(-60,61,20))
+        for mask_funct in [lambda bf: bf.set_mask(np.arange(18,45)), #3 rows (view)
+                           lambda bf: bf.set_mask_radius(0.007)]: #circle (index array)
+            mask_funct(mybf)
+            mybf.set_cosine_sum_window_by_name('hamming')
+            subbf = SamuraiBeamform(units='mm')
+            subbf.all_positions = mybf.all_positions[mybf.mask]
+            subbf.all_s_parameter_data = [s for s,m in zip(mybf.all_s_parameter_data,mybf.mask) if m]
+            subbf.set_cosine_sum_window_by_name('hamming')
+            ref_vals = subbf.beamform_azel(az,el).complex_values
+            for backend in ['direct','nufft']:
+                mycsa = mybf.beamform_azel(az,el,backend=backend,nufft_tol=1e-6)
+                err = np.abs(mycsa.complex_values-ref_vals).max()/np.abs(ref_vals).max()
+                self.assertLess(err,1e-5,'%s backend' %backend)
+            mc = mybf.beamform_monte_carlo(az,0,5,0.0005,seed=1)
+            self.assertEqual(mc['std'].shape,(1,len(az),len(mybf.freq_list)))
+            mybf.clear_mask()
 
+    def test_muf_beamform(self):
+        '''@brief beamforming all MUF realizations at once should match beamforming each data_meas_num'''
+        import tempfile
+        from samurai.base.MUF.MUFResult import MUFResult,calculate_statistics_from_array
+        from samurai.analysis.support.MetafileController import MetafileController
+        rng = np.random.default_rng(2)
+        freqs = np.linspace(26.5e9,40e9,4)
+        num_reps = 7
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            mf = MetafileController(None)
+            mf.set_wdir(tmp_dir)
+            for i in range(12):
+                paths = []
+                for name in ['nominal']+['mc_{}'.format(r) for r in range(num_reps)]:
+                    snp = SnpEditor([2,freqs])
+                    snp.raw = rng.normal(size=snp.shape)+1j*rng.normal(size=snp.shape)
+                    paths.append(snp.write(os.path.join(tmp_dir,'pos_{}_{}.s2p_binary'.format(i,name))))
+                res = MUFResult()
+                res.set_nominal(paths[0])
+                res.set_monte_carlo(paths[1:])
+                meas_path = os.path.join(tmp_dir,'pos_{}.meas'.format(i))
+                res.write_xml(meas_path)
+                mf.add_measurement(meas_path,position=[(i%4)*3,(i//4)*3,0,0,0,0],units='mm')
+            mf_path = mf.write(os.path.join(tmp_dir,'metafile.json'))
+            az = np.deg2rad(np.arange(-90,91,15)); el = np.deg2rad([-10,0,10])
+            mybf = SamuraiBeamform(mf_path,units='mm')
+            mybf.set_mask(np.arange(1,12)) #the mask and weights should be applied to the realizations
+            mybf.set_cosine_sum_window_by_name('hamming')
+            rep_vals = []
+            for r in range(num_reps):
+                rbf = SamuraiBeamform(mf_path,units='mm',data_type='monte_carlo',data_meas_num=r)
+                rbf.set_mask(np.arange(1,12))
+                rbf.set_cosine_sum_window_by_name('hamming')
+                rep_vals.append(rbf.beamform_azel(az,el).complex_values)
+            ref_stats = calculate_statistics_from_array(np.array(rep_vals))
+            ref_nominal = mybf.beamform_azel(az,el).complex_values
+            for block_size,n_workers in [('auto',1),(3,2)]:
+                res = mybf.beamform_muf(az,el,realization_block_size=block_size,n_workers=n_workers)
+                self.assertIsNone(res.perturbed)
+                self.assertEqual(res.monte_carlo.num_realizations,num_reps)
+                self.assertTrue(np.allclose(res.nominal.complex_values,ref_nominal))
+                scale = np.abs(ref_nominal).max()
+                est,ci_p,ci_m,su_p,su_m = res.monte_carlo.get_statistics()
+                self.assertTrue(np.all(est.freq_list==freqs))
+                for csa,ref in [(est,ref_stats['estimate']),(ci_p,ref_stats['confidence_interval'][0]),(ci_m,ref_stats['confidence_interval'][1]),
+                                (su_p,ref_stats['standard_uncertainty'][0]),(su_m,ref_stats['standard_uncertainty'][1])]:
+                    self.assertLess(np.abs(csa.complex_values-ref).max()/scale,1e-4)
 
 ###############################################################################
 ### Test Cases
@@ -369,7 +1588,6 @@ if __name__=='__main__':
 
     if(testb):
         #write out a horizontal sweep to s parameter files
-        import os
         bf = SamuraiBeamform(r'\\cfs2w\67_ctl\67Internal\DivisionProjects\Channel Model Uncertainty\Measurements\USC\Measurements\8-27-2018\calibrated\metaFile.json',verbose=True)
         #bf.set_cosine_sum_window_by_name('hamming')
         [csa,_] = bf.beamforming_farfield_azel(np.arange(-45,46,1),[0],'all',verbose=True)
@@ -411,20 +1629,11 @@ if __name__=='__main__':
         az_pos = np.arange(-90,90,.1)
         el_pos = 0
         
-        nom_csa,_ = mysp.beamforming_farfield_azel(az_pos,el_pos,40e9,verbose=False)
-        nom_az_vals = nom_csa.get_azimuth_cut(0)[1]
         pos_uncert = [0.001,0.001,0.001,0,0,0]
-        mycsas = []
-        az_vals = []
         num_reps = 100
-        for i in range(num_reps): 
-            print("rep {} Complete".format(i))
-            mysp.perturb_positions_normal(pos_uncert)
-            cur_csa,_ = mysp.beamforming_farfield_azel(az_pos,el_pos,40e9,verbose=False)
-            mycsas.append(cur_csa)
-            az_vals.append(cur_csa.get_azimuth_cut(0)[1])
-        az_vals = np.array(az_vals)
-        az_std = np.std(az_vals,axis=0)
+        mc = mysp.beamform_monte_carlo(np.deg2rad(az_pos),np.deg2rad(el_pos),num_reps,pos_uncert,40e9,verbose=False)
+        nom_az_vals = mc['nominal'].get_azimuth_cut(0)[1]
+        az_std = mc['std'][0,:,0]
         
     if(testd):
         #timing test
@@ -92,7 +92,23 @@ class CalculatedSyntheticAperture:
         else: #else append
             self.complex_values = np.insert(self.complex_values,in_ord,cv,axis=2)
         self.freq_list = np.insert(self.freq_list,in_ord,freqs)
-        
+
+    def allocate_frequency_data(self,freqs,dtype=np.cdouble):
+        '''
+        @brief allocate the complex values for a list of frequencies so they can be
+            filled in place (e.g. a block of angles at a time) instead of appended with add_frequency_data.
+            This replaces any data currently stored.
+        @param[in] freqs - list of frequencies to allocate for (must be sorted)
+        @param[in/OPT] dtype - data type of the allocated values (default np.cdouble)
+        @return A view of self.complex_values reshaped to (angle,frequency) where the angles are the flattened meshgrid
+        '''
+        freqs = np.array(freqs,dtype=float).reshape(-1)
+        if np.any(np.diff(freqs)<0):
+            raise Exception("Frequencies must be sorted to allocate frequency data")
+        self.freq_list = freqs
+        self.complex_values = np.zeros(self.azimuth.shape+(len(freqs),),dtype=dtype)
+        return self.complex_values.reshape((-1,len(freqs)))
+
     def set_options(self,**arg_options):
         '''
         @brief set options of the class
@@ -408,12 +424,14 @@ class CalculatedSyntheticAperture:
                 out_path_format - What the output path of the measurements will look like. 
                     This will be appended to out_dir. any format value (i.e. {}) will be replaced.
                 json_path - Path where the json file will be saved. This will be appended to out_dir.
+                precision - significant digits of values in text files. None writes exact values (default None)
         @return list of SnpEditor classes with the data written out, and list of absolute paths to the files
         '''
         #get input options
         options = {}
         options['out_path_format'] = 'beamformed_{}.s2p_binary'
         options['json_path'] = 'beamformed.json'
+        options['precision'] = None
         for k,v in arg_options.items():
             options[k] = v
         #loop through all of our positions
@@ -428,7 +446,7 @@ class CalculatedSyntheticAperture:
             if not os.path.exists(out_path_dir):
                 os.makedirs(out_path_dir)
             meas_paths.append(os.path.abspath(out_path))
-            mys.write(out_path)
+            mys.write(out_path,precision=options['precision'])
             cur_info = {'filename':out_path}
             meas_info[i].update(cur_info)
             
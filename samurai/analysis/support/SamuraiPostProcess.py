@@ -16,6 +16,7 @@ from mpl_toolkits import mplot3d
 #import json
 
 from samurai.analysis.support.MetafileController import MetafileController 
+from samurai.analysis.support.ApertureCube import ApertureCube,is_aperture_cube
 from samurai.base.SamuraiDict import SamuraiDict
 #from samurai.analysis.support.generic import incomplete,deprecated,verified
 #from samurai.analysis.support.generic import round_arb
@@ -38,13 +39,15 @@ class SamuraiSyntheticApertureAlgorithm:
     def __init__(self,metafile_path=None,**arg_options):
         '''
         @brief initilaize the SamSynthApAlg class  
-        @param[in/OPT] metafile_path - metafile for real measurements (defaults to None)  
+        @param[in/OPT] metafile_path - metafile for real measurements (defaults to None). 
+            This can also be an aperture cube sidecar (*.cube.json)  
         @param[in/OPT] arg_options - keyword arguments as follows. Also passed to MetaFileController from which we inherit  
             - verbose         - whether or not to be verbose (default False)  
             - antenna_pattern - AntennaPattern Class parameter to include (default None)  
             - measured_values_flg - are we using measurements, or simulated data (default True)  
             - load_key        - Key to load values from (e.g. 21,11,12,22) when using measured values (default 21)  
             - load_data       - whether or not to load data on init (default true)  
+            - steering_cache  - SteeringVectorCache to reuse partial steering vectors between calls (default None)  
             - These are also passed to the load_metafile function  
         '''
         #options for the class
@@ -54,6 +57,7 @@ class SamuraiSyntheticApertureAlgorithm:
         self.options['measured_values_flg'] = True
         self.options['load_key']        = 21
         self.options['units']           = 'mm' #units of our position measurements (may want to load from metafile)
+        self.options['steering_cache']  = None #SteeringVectorCache to reuse partial steering vectors
         for key,val in six.iteritems(arg_options):
             self.options[key] = val #set kwargs
             
@@ -65,12 +69,14 @@ class SamuraiSyntheticApertureAlgorithm:
                 }
 
         #initialize so we know if weve loaded them or not
-        self.all_s_parameter_data = None #must be 2D array with axis 0 as each measurement and axis 1 as each position
+        self.all_s_parameter_data = None #list of TouchstoneEditors for each position or an ApertureCube
         self.all_data_perturbation = None #perturbation on our S parameters
         #self.freq_list = None #this is now a property
         self.all_weights = None #weighting for our antennas
         self.all_positions = None #must be in list of [x,y,z,alpha,beta,gamma] points like on robot
         self.all_positions_perturbation = None #perturbations
+        self._mask_index = None #index of the positions in use (None for all positions)
+        self._mask_num_positions = None #number of positions when the mask was set
         self.metafile = None
         if(metafile_path): #if theres a metafile load it
             self.load_metafile(metafile_path,**arg_options)
@@ -78,11 +84,15 @@ class SamuraiSyntheticApertureAlgorithm:
     def load_metafile(self,metafile_path,**arg_options):
         '''
         @brief function to load in our metafile and S parameter data from it
-        @param[in] metafile_path - path to the metafile to load measurement from
+        @param[in] metafile_path - path to the metafile to load measurement from. 
+            Aperture cube sidecars (*.cube.json) are loaded with load_aperture_cube
         @param[in/OPT] freq_mult - how much to multiply the freq by to get hz (e.g. 1e9 for GHz)
         @param[in/OPT] arg_options -keyword arguments passed to MetaFileController.__init__ and MetaFileController.load_data
         '''
+        if is_aperture_cube(metafile_path):
+            return self.load_aperture_cube(metafile_path,**arg_options)
         self.metafile = MetafileController(metafile_path,**arg_options)
+        self.clear_mask() #the mask was for a different aperture
         if arg_options.get('load_data',True): #dont load if arg_options['load_data'] is False
             self.load_data(**arg_options)
             self.all_positions = self.metafile.get_positions()
@@ -103,6 +113,19 @@ class SamuraiSyntheticApertureAlgorithm:
         s_data = self.metafile.load_data(**options)
         self.all_s_parameter_data = s_data
         
+    def load_aperture_cube(self,cube_path,**arg_options):
+        '''
+        @brief load s parameter data and positions from a single file aperture cube.
+            This does not create a TouchstoneEditor for each position
+        @param[in] cube_path - path to the aperture cube sidecar (*.cube.json)
+        @param[in/OPT] arg_options - keyword arguments as follows:
+            memmap - memory map the data instead of reading it (default True)
+        '''
+        cube = ApertureCube(cube_path,memmap=arg_options.get('memmap',True))
+        self.clear_mask() #the mask was for a different aperture
+        self.all_s_parameter_data = cube
+        self.all_positions = cube.positions
+        
     def load_positions_from_file(self,file_path,**arg_options):
         '''
         @brief load positions from a file (like a csv)
@@ -125,9 +148,9 @@ class SamuraiSyntheticApertureAlgorithm:
         '''
         @brief ensure we have loaded all of the data to run the algorithm
         '''
-        if np.any(self.positions==None) or len(self.positions)<1:
+        if self.positions is None or len(self.positions)<1:
             raise(Exception("Positional data not provided"))
-        if np.any(self.s_parameter_data==None) or len(self.s_parameter_data)<1:
+        if self.s_parameter_data is None or len(self.s_parameter_data)<1:
             raise(Exception("S Parameter data not provided"))
         if np.any(self.freq_list==None) or len(self.freq_list)<1:
             raise(Exception("Frequency list not provided"))
@@ -138,22 +161,54 @@ class SamuraiSyntheticApertureAlgorithm:
     ###########################################################################
     ### Positional Functions
     ###########################################################################
+    @property
+    def all_positions(self):
+        '''@brief getter for the raw (unperturbed) positions'''
+        return self._all_positions
+    @all_positions.setter
+    def all_positions(self,positions):
+        '''@brief set the raw positions and invalidate the cached positions'''
+        self._all_positions = positions
+        self.clear_data_cache()
+        self._check_mask_positions(None if positions is None else len(positions))
+        
+    @property
+    def all_positions_perturbation(self):
+        '''@brief getter for the perturbation added to the positions'''
+        return self._all_positions_perturbation
+    @all_positions_perturbation.setter
+    def all_positions_perturbation(self,perturbation):
+        '''@brief set the position perturbation and invalidate the cached positions'''
+        self._all_positions_perturbation = perturbation
+        self.clear_data_cache()
+    
+    def _get_perturbed_positions(self):
+        '''@brief get the cached perturbed positions before masking'''
+        if self.all_positions is None:
+            return None
+        pos = self._data_cache.get('positions',None)
+        if pos is None:
+            pos = np.array(self.all_positions,dtype=float) #always a copy so the raw positions are never changed
+            #now perturb if that is set
+            if self.all_positions_perturbation is not None:
+                pos += self.all_positions_perturbation
+            pos.flags.writeable = False
+            self._data_cache['positions'] = pos
+        return pos
+    
     @property
     def positions(self):
         '''
-        @brief getter for our positions. This will allow us to mask out undesired locations
+        @brief getter for our positions with the mask applied (see set_mask)
+        @note the perturbed positions are cached and returned as a read-only array.
+            Any assignment to all_positions or all_positions_perturbation will clear the cache.
+            If all_positions is changed in place, call clear_data_cache()
         @return all desired positions that are not masked out
-        @todo implement masking
         '''
-        if self.all_positions is not None:
-            #retrun a copy
-            pos = self.all_positions.copy()   
-            #now perturb if that is set. we must return a copy as to not overwrite the original positions
-            if self.all_positions_perturbation is not None:
-                pos += self.all_positions_perturbation
-        else:
-            pos=None
-        return pos
+        pos = self._get_perturbed_positions()
+        if pos is None:
+            return None
+        return self._apply_mask('masked_positions',pos)
     
     def normalize_positions(self,norm_funct=np.mean):
         '''
@@ -341,33 +396,235 @@ class SamuraiSyntheticApertureAlgorithm:
         fig = go.Figure(data=plotly_surf,layout=layout)
         ploff.plot(fig,filename=options['out_name'])
     
+#%% Masking functions
+    ###########################################################################
+    ### Masking Functions
+    ###########################################################################
+    def set_mask(self,mask):
+        '''
+        @brief select which positions to use. positions, s_parameter_data, and weights will then 
+            only return values for these positions. The loaded data is not changed or reloaded
+        @param[in] mask - boolean array (True for positions to use) with a value for each of 
+            self.all_positions or an array of indices into self.all_positions. None clears the mask
+        @note masks of evenly spaced indices (e.g. a block of rows) index the cached data as views without copying
+        @note the mask is cleared when another aperture is loaded or the number of positions changes
+        '''
+        if mask is None:
+            return self.clear_mask()
+        mask = np.asarray(mask)
+        num_positions = len(self.all_positions)
+        if mask.dtype==bool:
+            if mask.shape!=(num_positions,):
+                raise Exception("Boolean mask of shape %s does not match %d positions" %(mask.shape,num_positions))
+            idx = np.flatnonzero(mask)
+        else:
+            idx = np.unique(np.arange(num_positions)[mask.astype(int).reshape(-1)]) #sorted with negative indices supported
+        if idx.size<1:
+            raise Exception("Mask does not select any positions")
+        steps = np.diff(idx)
+        if idx.size==num_positions:
+            idx = None
+        elif idx.size==1 or np.all(steps==steps[0]): #evenly spaced so we can use a view
+            idx = slice(int(idx[0]),int(idx[-1])+1,int(steps[0]) if steps.size else 1)
+        self._mask_index = idx
+        self._mask_num_positions = num_positions
+        self._clear_masked_cache()
+        
+    def set_mask_from_positions(self,predicate,units='m'):
+        '''
+        @brief set the mask from a function of the (unperturbed) positions
+        @param[in] predicate - function taking the [[x,y,z,alpha,beta,gamma],...] array of all positions
+            and returning a boolean array that is True for the positions to use
+        @param[in/OPT] units - units of the positions passed to predicate (default 'm')
+        @example mysp.set_mask_from_positions(lambda pos: pos[:,0]<0.05) #only use positions with x<5cm
+        '''
+        multiplier = self.unit_conversion_dict[self.options['units']]/self.unit_conversion_dict[units]
+        self.set_mask(np.asarray(predicate(np.asarray(self.all_positions)*multiplier),dtype=bool))
+        
+    def set_mask_box(self,min_xyz=None,max_xyz=None,units='m'):
+        '''
+        @brief only use positions inside of a box (including the edges)
+        @param[in/OPT] min_xyz - [x,y,z] minimum values. None for no minimum. Any value can be -np.inf
+        @param[in/OPT] max_xyz - [x,y,z] maximum values. None for no maximum. Any value can be np.inf
+        @param[in/OPT] units - units of min_xyz and max_xyz (default 'm')
+        '''
+        min_xyz = -np.inf if min_xyz is None else np.asarray(min_xyz)
+        max_xyz =  np.inf if max_xyz is None else np.asarray(max_xyz)
+        self.set_mask_from_positions(lambda pos: np.all((pos[:,:3]>=min_xyz)&(pos[:,:3]<=max_xyz),axis=1),units=units)
+        
+    def set_mask_radius(self,radius,center=None,units='m'):
+        '''
+        @brief only use positions within a distance of a point (e.g. a circular sub-aperture)
+        @param[in] radius - maximum distance from center
+        @param[in/OPT] center - [x,y,z] center point. None uses the mean of all positions
+        @param[in/OPT] units - units of radius and center (default 'm')
+        '''
+        def in_radius(pos):
+            pos_center = pos[:,:3].mean(axis=0) if center is None else np.asarray(center)
+            return np.sqrt(np.sum((pos[:,:3]-pos_center)**2,axis=1))<=radius
+        self.set_mask_from_positions(in_radius,units=units)
+        
+    def clear_mask(self):
+        '''
+        @brief clear the mask so that all positions are used
+        '''
+        self._mask_index = None
+        self._mask_num_positions = None
+        self._clear_masked_cache()
+        
+    def _check_mask_positions(self,num_positions):
+        '''
+        @brief clear the mask if the number of positions changed since it was set (e.g. a new aperture was loaded)
+        @param[in] num_positions - number of positions of the new data (None if the data was removed)
+        '''
+        if getattr(self,'_mask_index',None) is not None and num_positions!=self._mask_num_positions:
+            self.clear_mask()
+    
+    @property
+    def mask_index(self):
+        '''
+        @brief getter for the index of the positions in use. This is a slice when no mask is set or the 
+            positions in use are evenly spaced (indexing returns a view), otherwise a sorted index array
+        '''
+        return slice(None) if self._mask_index is None else self._mask_index
+    
+    @property
+    def mask(self):
+        '''
+        @brief getter for a boolean array that is True for each of self.all_positions in use
+        '''
+        mask = np.zeros(len(self.all_positions),dtype=bool)
+        mask[self.mask_index] = True
+        return mask
+    
+    def _apply_mask(self,cache_key,data):
+        '''
+        @brief index the first axis of data by the mask and cache the result until the data or mask changes
+        '''
+        vals = self._data_cache.get(cache_key,None)
+        if vals is None:
+            vals = data[self.mask_index] #view unless the mask is irregular
+            vals.flags.writeable = False
+            self._data_cache[cache_key] = vals
+        return vals
+        
+    def _clear_masked_cache(self):
+        '''@brief remove masked values from the cache, but keep the full data cube'''
+        for key in [k for k in self._data_cache if k.startswith('masked_')]:
+            del self._data_cache[key]
+
 #%% S param functs
     ###########################################################################
     ### s parameter functions
     ########################################################################### 
+    @property
+    def all_s_parameter_data(self):
+        '''@brief getter for the raw list of TouchstoneEditors for each position'''
+        return self._all_s_parameter_data
+    @all_s_parameter_data.setter
+    def all_s_parameter_data(self,s_data):
+        '''@brief set the raw s parameter data and invalidate the cached data cube'''
+        self._all_s_parameter_data = s_data
+        self.clear_data_cache()
+        if isinstance(s_data,ApertureCube):
+            self._check_mask_positions(s_data.num_positions)
+        elif s_data is not None:
+            self._check_mask_positions(len(s_data))
+        
+    @property
+    def all_data_perturbation(self):
+        '''@brief getter for the perturbation added to the s parameter data'''
+        return self._all_data_perturbation
+    @all_data_perturbation.setter
+    def all_data_perturbation(self,perturbation):
+        '''@brief set the s parameter perturbation and invalidate the cached data cube'''
+        self._all_data_perturbation = perturbation
+        self.clear_data_cache()
+        
+    def clear_data_cache(self):
+        '''
+        @brief clear the cached positions, frequencies, and s parameter data cube.
+            This is done automatically when all_s_parameter_data, all_data_perturbation,
+            all_positions, or all_positions_perturbation are set. It must be called
+            explicitly when any of these are changed in place (e.g. editing a TouchstoneEditor)
+        '''
+        self._data_cache = {}
+        
+    def get_s_parameter_cube(self):
+        '''
+        @brief get the unperturbed s parameter data as a single contiguous complex array.
+            This is only packed from the TouchstoneEditors once and then cached until
+            the data is changed or self.options['load_key'] changes. 
+            If the data is an ApertureCube, this is a view of the file instead
+        @return read-only complex array of shape (position,frequency,key) or None if no data is loaded
+        '''
+        if self.all_s_parameter_data is None:
+            return None
+        keys = self.options['load_key']
+        if not hasattr(keys, "__len__"):
+            keys = [keys]
+        keys = tuple(keys)
+        cube_keys,cube = self._data_cache.get('s_parameter_cube',(None,None))
+        if cube is None or cube_keys!=keys:
+            if isinstance(self.all_s_parameter_data,ApertureCube):
+                cube = self.all_s_parameter_data.get_data(keys) #view of the file when possible (no packing)
+            else:
+                num_freqs = len(self.freq_list)
+                cube = np.empty((len(self.all_s_parameter_data),num_freqs,len(keys)),dtype=np.cdouble)
+                for pi,s in enumerate(self.all_s_parameter_data):
+                    for ki,load_key in enumerate(keys):
+                        cube[pi,:,ki] = s.S[load_key].raw #pack directly into the cube
+            cube.flags.writeable = False
+            self._data_cache.pop('s_parameter_data',None) #perturbed data was built from the old cube
+            self._data_cache['s_parameter_cube'] = (keys,cube)
+        return cube
+        
+    def _get_perturbed_s_parameter_data(self):
+        '''@brief get the cached perturbed s parameter data before masking'''
+        cube = self.get_s_parameter_cube()
+        if cube is None or self.all_data_perturbation is None:
+            return cube
+        sp_dat = self._data_cache.get('s_parameter_data',None)
+        if sp_dat is None:
+            perturb = np.asarray(self.all_data_perturbation)
+            sp_dat = cube+perturb.reshape(perturb.shape+(1,)*(cube.ndim-perturb.ndim)) #(position,frequency) perturbations apply to all keys
+            sp_dat.flags.writeable = False
+            self._data_cache['s_parameter_data'] = sp_dat
+        return sp_dat
+    
+    def get_s_parameter_data(self,freq_index=slice(None),key_index=slice(None)):
+        '''
+        @brief get the masked s parameter data for a subset of frequencies and keys.
+            Only the requested values are gathered from the cached cube (no full masked copy is made)
+        @param[in/OPT] freq_index - index, slice, or index array of frequencies (default all)
+        @param[in/OPT] key_index - index, slice, or index array into self.options['load_key'] (default all)
+        @return array of (position,frequency,key) with any integer indexed axes removed. 
+            This is a read-only view when the mask and indices are slices or integers
+        '''
+        data = self._get_perturbed_s_parameter_data()
+        if data is None:
+            return None
+        idx = (self.mask_index,freq_index,key_index)
+        is_basic = [isinstance(i,(slice,int,np.integer)) for i in idx]
+        if all(is_basic):
+            return data[idx]
+        #gather only the requested values
+        idx = [np.arange(n)[i] for n,i in zip(data.shape,idx)]
+        int_axes = tuple(ax for ax,i in enumerate(idx) if np.ndim(i)==0)
+        return data[np.ix_(*[np.atleast_1d(i) for i in idx])].squeeze(axis=int_axes)
+    
     @property
     def s_parameter_data(self):
         '''
-        @brief Getter for our s parameter data. This will allow us to mask out undesired locations.
+        @brief Getter for our s parameter data with the mask applied (see set_mask).
         @note unlike all_s_parameter_data, this will return a numpy array, not a list of SnpEditors
+        @note the data is cached (see get_s_parameter_cube) and returned as a read-only array
         @return all s_parameter_data for desired positions that are not masked out
-        @todo implemment masking
         '''           
-        if self.all_s_parameter_data is not None:
-            sp_dat = []
-            keys = self.options['load_key']
-            if not hasattr(keys, "__len__"):
-                keys = [keys]
-            for s in self.all_s_parameter_data:
-                #self.all_s_parameter_data.append(np.array([s.S[load_key].raw for load_key in keys])) #turn the s parameters into an array
-                data = np.array([s.S[load_key].raw for load_key in keys]) #turn the s parameters into an array
-                sp_dat.append(data.transpose())
-            if self.all_data_perturbation is not None:
-                sp_dat+=self.all_data_perturbation
-            return np.array(sp_dat)
-        else:
-            sp_dat = None
-        return sp_dat
+        sp_dat = self._get_perturbed_s_parameter_data()
+        if sp_dat is None:
+            return None
+        return self._apply_mask('masked_s_parameter_data',sp_dat)
     
     @property
     def freq_list(self):
@@ -376,7 +633,13 @@ class SamuraiSyntheticApertureAlgorithm:
             to ensure it is up to date in case we cut our data.
         '''
         if self.all_s_parameter_data is not None:
-            return self.all_s_parameter_data[0].freq_list
+            freqs = self._data_cache.get('freq_list',None)
+            if freqs is None:
+                if isinstance(self.all_s_parameter_data,ApertureCube):
+                    freqs = self._data_cache['freq_list'] = self.all_s_parameter_data.freq_list
+                else:
+                    freqs = self._data_cache['freq_list'] = self.all_s_parameter_data[0].freq_list
+            return freqs
     
     def perturb_data(self,stdev):
         '''
@@ -428,21 +691,24 @@ class SamuraiSyntheticApertureAlgorithm:
         @note az_u and el_v will be a pair list like from meshgrid. Shape doesnt matter. They will be flattened
         @param[in/OPT] coord - what coordinate system our input values are (azel or uv) (default azel)
         @param[in/OPT] arg_options - keyword argument options as follows
-            - None Yet!
+            - steering_cache - SteeringVectorCache to get the values from (default self.options['steering_cache'])
         @return The calculated partial steering vectors vectors for az_u and el_v at the provided k value, or without a k value.
             The first axis of the returned matrix is the position value .
             The second axis corresponds to the azel values.
         '''
-        #[az,el] = self.to_azel(az_u,el_v,coord) #change to azel
-        #az = np.deg2rad(az.reshape((-1))) #flatten arrays along the desired axis and change to radians
-        #el = np.deg2rad(el.reshape((-1)))
-        #get and center our positions
+        options = {}
+        options['steering_cache'] = self.options['steering_cache']
+        for key,val in six.iteritems(arg_options):
+            options[key] = val
+        #get our positions
         pos = self.get_positions('m')[:,0:3] # positions 4,5,6 are rotations only get xyz
         #pos -= pos.mean(axis=0) #center around mean values
         
         #now calculate our steering vector values
-        k_vecs = get_k_vectors(az_u,el_v,coord,**arg_options)
-        psv_vecs = np.dot(pos,k_vecs) #this will multiply sv_vals by our x,y,z values and sum the three
+        if options['steering_cache'] is not None:
+            psv_vecs = options['steering_cache'].get_partial_steering_vectors(pos,az_u,el_v,coord)
+        else:
+            psv_vecs = calculate_partial_steering_vectors(pos,az_u,el_v,coord) #this will multiply k vectors by our x,y,z values and sum the three
         return psv_vecs
     
     def add_plane_wave(self,az_u,el_v,amplitude_db=-50,coord='azel'):
@@ -476,6 +742,7 @@ class SamuraiSyntheticApertureAlgorithm:
             sv = self.get_steering_vectors(az,el,get_k(freq)) #get the steering vector
             sv_sum = sv.sum(axis=1)*amplitude #sum across freqs and get our amplitude
             self.all_s_parameter_data[:,fi]+=sv_sum
+        self.clear_data_cache() #data was changed in place
     
 
 #%% windowing
@@ -588,21 +855,23 @@ class SamuraiSyntheticApertureAlgorithm:
     def weights(self):
         '''
         @brief getter for our antenna weights
+        @note weights set for every position in self.all_positions are masked. Otherwise the weights
+            are assumed to be for the positions in use (e.g. a window calculated after setting the mask)
         @return all weighting values for desired positions that are not masked out
-        @todo implemment masking
         '''
         if np.any(self.all_weights==None) or len(self.all_weights)<1:
             return np.ones(self.positions.shape[0])
+        elif self._mask_index is not None and len(self.all_weights)==len(self.all_positions):
+            return np.asarray(self.all_weights)[self.mask_index]
         else:
             return self.all_weights
     @weights.setter
     def weights(self,weights):
         '''
         @brief Setter for our antenna weights.
-            For now these weights will be for just our values in use (masking doesnt effect).
-            This means weights will need to be recalculated when masking is done
+            These can either be for all positions or just the positions in use (see set_mask).
+            Weights for just the positions in use will need to be recalculated when the mask changes
         @param[in] weights - weights to set
-        @todo implemment masking
         '''
         self.all_weights = weights
         
@@ -677,6 +946,148 @@ def get_k(freq,eps_r=1,mu_r=1):
     k = 2*np.pi/lam
     return k
 
+def calculate_partial_steering_vectors(positions,az_u,el_v,coord='azel'):
+    '''
+    @brief Calculate partial steering vectors (k_vectors dot position vectors) for a set of positions.
+        To get steering vectors use np.exp(-1j*k*psv_vecs).
+    @param[in] positions - positions in meters. Only the first 3 columns (x,y,z) are used
+    @param[in] az_u - azimuth or u values to get partial steering vectors for
+    @param[in] el_v - elevation or v values to get partial steering vectors for
+    @param[in/OPT] coord - what coordinate system our input values are (azel or uv) (default azel)
+    @return partial steering vectors with the first axis as position and the second as angle
+    '''
+    k_vecs = get_k_vectors(np.asarray(az_u),np.asarray(el_v),coord)
+    return np.dot(np.asarray(positions)[:,0:3],k_vecs)
+
+#%% cache for steering vectors
+import hashlib
+from collections import OrderedDict
+
+class SteeringVectorCache:
+    '''
+    @brief Least recently used cache of partial steering vectors. Values are keyed on a hash of
+        the positions, angles, coordinate system, and data type so the same aperture geometry
+        and angular grid is only calculated once (e.g. for different load keys, windows, or days).
+    @param[in/OPT] max_bytes - maximum number of bytes to keep in memory. The least recently used
+        values are removed when this is exceeded (default 256 MB)
+    @param[in/OPT] cache_dir - directory to also store values in as *.npy files. These persist
+        between sessions and are loaded on a memory miss (default None)
+    @example
+        mycache = SteeringVectorCache(max_bytes=2**30,cache_dir='./steering_cache')
+        mybf = SamuraiBeamform(mf_path,steering_cache=mycache)
+        mycsa = mybf.beamform_azel(az,el)
+        print(mycache.get_stats())
+    '''
+    def __init__(self,max_bytes=2**28,cache_dir=None):
+        '''@brief Constructor'''
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        if cache_dir is not None and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self.clear()
+    
+    def clear(self):
+        '''@brief remove all values from memory and reset the counters (files in cache_dir are kept)'''
+        self._values = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        
+    def __getstate__(self):
+        '''@brief dont pickle the cached values (e.g. when sent to worker processes)'''
+        state = self.__dict__.copy()
+        state['_values'] = OrderedDict()
+        state['nbytes'] = 0
+        return state
+    
+    def __len__(self):
+        return len(self._values)
+        
+    @staticmethod
+    def get_key(positions,az_u,el_v,coord='azel',dtype=np.float64):
+        '''
+        @brief get the hash key for a set of positions and angles
+        @param[in] positions - positions in meters (only x,y,z are used)
+        @param[in] az_u,el_v - angles (or u,v values)
+        @param[in/OPT] coord - coordinate system of the angles (default 'azel')
+        @param[in/OPT] dtype - data type of the stored values (default np.float64)
+        @return hex string key
+        '''
+        hasher = hashlib.sha1()
+        for arr in [np.asarray(positions,dtype=np.float64)[:,0:3],np.asarray(az_u,dtype=np.float64),np.asarray(el_v,dtype=np.float64)]:
+            arr = np.ascontiguousarray(arr)
+            hasher.update(str(arr.shape).encode())
+            hasher.update(arr.tobytes())
+        hasher.update(coord.encode())
+        hasher.update(np.dtype(dtype).str.encode())
+        return hasher.hexdigest()
+    
+    def _get_file_path(self,key):
+        return os.path.join(self.cache_dir,key+'.npy')
+    
+    def get(self,key):
+        '''
+        @brief get a value from the cache. This will check cache_dir if it is not in memory
+        @param[in] key - key from get_key
+        @return the cached array or None if it does not exist
+        '''
+        if key in self._values:
+            self._values.move_to_end(key)
+            self.hits += 1
+            return self._values[key]
+        if self.cache_dir is not None and os.path.exists(self._get_file_path(key)):
+            value = np.load(self._get_file_path(key))
+            self.hits += 1
+            self.disk_hits += 1
+            self._add(key,value)
+            return value
+        self.misses += 1
+        return None
+    
+    def put(self,key,value):
+        '''
+        @brief add a value to the cache (and cache_dir if provided)
+        @param[in] key - key from get_key
+        @param[in] value - array to store. This should not be changed after being cached
+        '''
+        if self.cache_dir is not None and not os.path.exists(self._get_file_path(key)):
+            np.save(self._get_file_path(key),value)
+        self._add(key,value)
+        
+    def _add(self,key,value):
+        '''@brief add to memory and remove least recently used values over max_bytes'''
+        if value.nbytes>self.max_bytes: #never fits
+            return
+        if key in self._values:
+            self.nbytes -= self._values.pop(key).nbytes
+        self._values[key] = value
+        self.nbytes += value.nbytes
+        while self.nbytes>self.max_bytes:
+            self.nbytes -= self._values.popitem(last=False)[1].nbytes
+    
+    def get_partial_steering_vectors(self,positions,az_u,el_v,coord='azel',dtype=np.float64):
+        '''
+        @brief get partial steering vectors from the cache or calculate and cache them
+        @param[in] positions - positions in meters (only x,y,z are used)
+        @param[in] az_u,el_v - angles (or u,v values)
+        @param[in/OPT] coord - coordinate system of the angles (default 'azel')
+        @param[in/OPT] dtype - data type of the values (default np.float64)
+        @return partial steering vectors (position x angle) (see calculate_partial_steering_vectors)
+        '''
+        key = self.get_key(positions,az_u,el_v,coord,dtype)
+        psv_vecs = self.get(key)
+        if psv_vecs is None:
+            psv_vecs = calculate_partial_steering_vectors(positions,az_u,el_v,coord).astype(dtype)
+            self.put(key,psv_vecs)
+        return psv_vecs
+    
+    def get_stats(self):
+        '''@brief get a dictionary of the cache hits, misses, and size'''
+        total = self.hits+self.misses
+        return {'hits':self.hits,'misses':self.misses,'disk_hits':self.disk_hits,
+                'hit_rate':self.hits/total if total else 0.,'num_values':len(self),'nbytes':self.nbytes}
+
 
 from numba import vectorize, complex64,float32
 import cmath
@@ -979,6 +1390,117 @@ class TestSamuraiPostProcess(unittest.TestCase):
         mysp.clear_position_perturbation()
         self.assertTrue(np.all(p_m==mysp.get_positions('m')),'Perturbation not cleared correctly')
         
+    def test_steering_vector_cache(self):
+        #test cache hits, LRU eviction, and loading from disk
+        import tempfile
+        pos = np.random.rand(25,6)*0.1
+        [AZ,EL] = np.meshgrid(np.arange(-90,90,10),np.arange(-40,41,20))
+        psv_size = pos.shape[0]*AZ.size*8 #bytes for a float64 value
+        mycache = SteeringVectorCache(max_bytes=2*psv_size)
+        psv = mycache.get_partial_steering_vectors(pos,AZ,EL)
+        self.assertTrue(np.allclose(psv,calculate_partial_steering_vectors(pos,AZ,EL)))
+        self.assertTrue(mycache.get_partial_steering_vectors(pos,AZ,EL) is psv)
+        self.assertEqual([mycache.hits,mycache.misses],[1,1])
+        mycache.get_partial_steering_vectors(pos,AZ+1,EL)
+        mycache.get_partial_steering_vectors(pos,AZ,EL) #make AZ+1 least recently used
+        mycache.get_partial_steering_vectors(pos,AZ+2,EL) #should remove AZ+1
+        self.assertEqual(len(mycache),2)
+        self.assertLessEqual(mycache.nbytes,mycache.max_bytes)
+        mycache.get_partial_steering_vectors(pos,AZ+1,EL)
+        self.assertEqual([mycache.hits,mycache.misses],[2,4])
+        with tempfile.TemporaryDirectory() as cache_dir:
+            SteeringVectorCache(cache_dir=cache_dir).get_partial_steering_vectors(pos,AZ,EL)
+            mycache = SteeringVectorCache(cache_dir=cache_dir)
+            self.assertTrue(np.all(mycache.get_partial_steering_vectors(pos,AZ,EL)==psv))
+            self.assertEqual([mycache.hits,mycache.disk_hits,mycache.misses],[1,1,0])
+
+    def test_data_cache(self):
+        #test the s parameter cube and positions are only packed once and invalidated on changes
+        from samurai.base.TouchstoneEditor import SnpEditor
+        freqs = np.linspace(26.5e9,40e9,11)
+        mysp = SamuraiSyntheticApertureAlgorithm()
+        mysp.all_positions = np.random.rand(5,6)
+        s_data = []
+        for i in range(5):
+            snp = SnpEditor([2,freqs])
+            snp.raw = np.random.normal(size=snp.shape)+1j*np.random.normal(size=snp.shape)
+            s_data.append(snp)
+        mysp.all_s_parameter_data = s_data
+        s21 = np.array([s.S[21].raw for s in s_data])
+        sp_dat = mysp.s_parameter_data
+        self.assertEqual(sp_dat.shape,(5,len(freqs),1))
+        self.assertTrue(np.all(sp_dat[...,0]==s21))
+        self.assertTrue(mysp.s_parameter_data is sp_dat,'Cube was repacked')
+        self.assertFalse(sp_dat.flags.writeable)
+        pos = mysp.positions
+        self.assertTrue(mysp.positions is pos,'Positions were copied')
+        #perturbations should invalidate
+        mysp.perturb_data(np.full((5,len(freqs)),0.1))
+        self.assertTrue(np.allclose(mysp.s_parameter_data[...,0]-s21,mysp.all_data_perturbation))
+        mysp.all_data_perturbation = None
+        self.assertTrue(np.all(mysp.s_parameter_data==sp_dat))
+        mysp.perturb_positions_normal(1)
+        self.assertTrue(np.allclose(mysp.positions-mysp.all_positions,mysp.all_positions_perturbation))
+        mysp.clear_position_perturbation()
+        self.assertTrue(np.all(mysp.positions==pos))
+        #changing keys or data should invalidate
+        mysp.options['load_key'] = [21,11]
+        self.assertTrue(np.all(mysp.s_parameter_data[...,1]==np.array([s.S[11].raw for s in s_data])))
+        s_data[0].raw = 0
+        mysp.clear_data_cache()
+        self.assertTrue(np.all(mysp.s_parameter_data[0]==0))
+        mysp.all_s_parameter_data = s_data[1:]
+        self.assertEqual(mysp.s_parameter_data.shape[0],4)
+
+    def test_mask(self):
+        #test masking with indices, booleans, and spatial predicates
+        from samurai.base.TouchstoneEditor import SnpEditor
+        freqs = np.linspace(26.5e9,40e9,5)
+        mysp = SamuraiSyntheticApertureAlgorithm(units='mm')
+        [X,Y] = np.meshgrid(np.arange(4)*3.,np.arange(4)*3.)
+        pos = np.zeros((X.size,6)); pos[:,0] = X.flatten(); pos[:,1] = Y.flatten()
+        mysp.all_positions = pos
+        s_data = [SnpEditor([2,freqs]) for i in range(X.size)]
+        for i,snp in enumerate(s_data):
+            snp.raw = i
+        mysp.all_s_parameter_data = s_data
+        cube = mysp.get_s_parameter_cube()
+        mysp.weights = np.arange(X.size)
+        #evenly spaced indices should give views
+        mysp.set_mask(np.arange(4,8))
+        self.assertEqual(mysp.mask_index,slice(4,8,1))
+        self.assertTrue(np.all(mysp.positions==pos[4:8]))
+        self.assertTrue(np.all(mysp.s_parameter_data[:,0,0]==np.arange(4,8)))
+        self.assertTrue(np.shares_memory(mysp.s_parameter_data,cube))
+        self.assertTrue(np.all(mysp.weights==np.arange(4,8)))
+        #irregular masks only gather the requested values
+        mask = np.zeros(X.size,dtype=bool); mask[[0,3,9]] = True
+        mysp.set_mask(mask)
+        self.assertTrue(np.all(mysp.mask==mask))
+        self.assertTrue(np.all(mysp.get_s_parameter_data([1,2],0)==np.array([[0,0],[3,3],[9,9]])))
+        self.assertTrue(np.all(mysp.get_s_parameter_data(1,[0]).shape==(3,1)))
+        mysp.set_mask_box([0,0,0],[3,3,0],units='mm')
+        self.assertTrue(np.all(mysp.s_parameter_data[:,0,0]==[0,1,4,5]))
+        mysp.set_mask_radius(0.003,center=[0,0,0])
+        self.assertTrue(np.all(mysp.s_parameter_data[:,0,0]==[0,1,4]))
+        self.assertTrue(mysp.get_s_parameter_cube() is cube,'Cube was repacked')
+        with self.assertRaises(Exception):
+            mysp.set_mask_box(min_xyz=[1,1,1])
+        mysp.clear_mask()
+        self.assertEqual(mysp.s_parameter_data.shape[0],X.size)
+        #loading data with a different number of positions should clear the mask
+        for num_pos in [X.size+2,4]:
+            mysp.set_mask([0,5,7])
+            mysp.all_positions = np.zeros((num_pos,6))
+            mysp.all_s_parameter_data = [SnpEditor([2,freqs]) for i in range(num_pos)]
+            self.assertEqual(mysp.mask_index,slice(None))
+            self.assertEqual(mysp.positions.shape[0],num_pos)
+            self.assertEqual(mysp.s_parameter_data.shape[0],num_pos)
+        #reloading the same number of positions keeps it
+        mysp.set_mask([0,2])
+        mysp.all_s_parameter_data = [SnpEditor([2,freqs]) for i in range(4)]
+        self.assertEqual(mysp.s_parameter_data.shape[0],2)
+
 
 #%%
 if __name__=='__main__':
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+@brief Storage of numpy arrays as independently compressed frames (zlib or lzma from the standard library).
+    Each frame is compressed on its own so a reader only has to decompress the frames it needs.
+    File layout:
+        MAGIC | frame | frame | ... | json footer | uint64 footer length | MAGIC
+    The footer has the compression settings, the offset, size, shape, and dtype of each frame,
+    and a dictionary of information about the data (e.g. number of rows and columns).
+    The footer is at the end so frames can be written as they are created (e.g. one chunk of an aperture at a time).
+
+@author: ajw5
+"""
+import os
+import json
+import zlib
+import lzma
+import struct
+import threading
+import numpy as np
+from collections import OrderedDict
+
+FRAME_MAGIC = b'SAMZFRM1' #start and end of a framed file
+FRAME_VERSION = 1.0
+FRAME_FOOTER_TAIL = struct.Struct('<Q8s') #footer length and magic at the end of the file
+COMPRESSION_TYPES = ['zlib','lzma']
+
+def _get_shuffle_width(dtype):
+    '''@brief number of bytes of each value to shuffle (the real and imaginary parts of complex values separately)'''
+    dtype = np.dtype(dtype)
+    return dtype.itemsize//2 if dtype.kind=='c' else dtype.itemsize
+
+def compress_frame(data,compression='zlib',level=None,shuffle=True):
+    '''
+    @brief compress an array
+    @param[in] data - numpy array to compress
+    @param[in/OPT] compression - 'zlib' or 'lzma' (default 'zlib')
+    @param[in/OPT] level - compression level (zlib 0-9, lzma preset 0-9). None uses the default of the library
+    @param[in/OPT] shuffle - group the bytes of each value by significance before compressing.
+        The sign, exponent, and upper mantissa bytes of measured data are very repetitive so this compresses much better
+    @return compressed bytes
+    '''
+    data = np.ascontiguousarray(data)
+    if shuffle and data.size:
+        width = _get_shuffle_width(data.dtype)
+        buf = data.view(np.uint8).reshape(-1,width).T.tobytes()
+    else:
+        buf = data.tobytes()
+    if compression=='zlib':
+        return zlib.compress(buf,-1 if level is None else level)
+    elif compression=='lzma':
+        return lzma.compress(buf,preset=level)
+    raise ValueError("Compression '{}' not in {}".format(compression,COMPRESSION_TYPES))
+
+def decompress_frame(buf,shape,dtype,compression='zlib',shuffle=True):
+    '''
+    @brief decompress an array compressed with compress_frame
+    @param[in] buf - compressed bytes
+    @param[in] shape - shape of the array
+    @param[in] dtype - dtype of the array
+    @param[in/OPT] compression - 'zlib' or 'lzma' (default 'zlib')
+    @param[in/OPT] shuffle - whether the bytes were shuffled when compressing
+    @return numpy array of the data
+    '''
+    if compression=='zlib':
+        raw = zlib.decompress(buf)
+    elif compression=='lzma':
+        raw = lzma.decompress(buf)
+    else:
+        raise ValueError("Compression '{}' not in {}".format(compression,COMPRESSION_TYPES))
+    dtype = np.dtype(dtype)
+    if shuffle and len(raw):
+        width = _get_shuffle_width(dtype)
+        data = np.frombuffer(raw,dtype=np.uint8).reshape(width,-1).T.ravel().view(dtype)
+    else:
+        data = np.frombuffer(raw,dtype=dtype).copy()
+    return data.reshape(shape)
+
+def is_framed_file(file_path):
+    '''
+    @brief check if a file was written with FrameWriter
+    @param[in] file_path - path of the file
+    '''
+    with open(file_path,'rb') as fp:
+        return fp.read(len(FRAME_MAGIC))==FRAME_MAGIC
+
+class FrameWriter(object):
+    '''
+    @brief write arrays as compressed frames to a file
+    @param[in] file_path - path of the file to write
+    @param[in/OPT] compression - 'zlib' or 'lzma' (default 'zlib')
+    @param[in/OPT] level - compression level. None uses the default of the library
+    @param[in/OPT] shuffle - shuffle the bytes of each value before compressing (default True)
+    @example
+        with FrameWriter('data.frames',compression='lzma') as fw:
+            for chunk in chunks:
+                fw.write_frame(chunk)
+            fw.info['num_rows'] = 100
+    '''
+    def __init__(self,file_path,compression='zlib',level=None,shuffle=True):
+        '''@brief Constructor'''
+        if compression not in COMPRESSION_TYPES:
+            raise ValueError("Compression '{}' not in {}".format(compression,COMPRESSION_TYPES))
+        self.file_path = file_path
+        self.compression = compression
+        self.level = level
+        self.shuffle = shuffle
+        self.info = {} #extra information to write in the footer
+        self.frames = [] #[offset,size,shape,dtype] of each frame (None if not written yet)
+        self._fp = open(file_path,'wb')
+        self._fp.write(FRAME_MAGIC)
+
+    def write_frame(self,data,index=None):
+        '''
+        @brief compress and write an array
+        @param[in] data - numpy array to write
+        @param[in/OPT] index - index of the frame. Frames can be written in any order (default next index)
+        @return index of the frame
+        '''
+        data = np.asarray(data)
+        if index is None:
+            index = len(self.frames)
+        if index>=len(self.frames):
+            self.frames += [None]*(index+1-len(self.frames))
+        buf = compress_frame(data,self.compression,self.level,self.shuffle)
+        self.frames[index] = [self._fp.tell(),len(buf),list(data.shape),data.dtype.str]
+        self._fp.write(buf)
+        return index
+
+    def close(self):
+        '''@brief write the footer and close the file'''
+        if self._fp is None:
+            return
+        if None in self.frames:
+            raise FrameError("Frame {} of {} was never written".format(self.frames.index(None),self.file_path))
+        footer = {'frame_version':FRAME_VERSION,'compression':self.compression,'shuffle':self.shuffle,
+                  'frames':self.frames,'info':self.info}
+        footer_bytes = json.dumps(footer).encode('utf-8')
+        self._fp.write(footer_bytes)
+        self._fp.write(FRAME_FOOTER_TAIL.pack(len(footer_bytes),FRAME_MAGIC))
+        self._fp.close()
+        self._fp = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        if exc_type is None:
+            self.close()
+        else: #do not leave a file that looks complete
+            self._fp.close()
+            self._fp = None
+
+class FrameReader(object):
+    '''
+    @brief read frames from a file written with FrameWriter. Only the footer is read
+        when opening. Each frame is read and decompressed when it is requested
+    @param[in] file_path - path of the file
+    @param[in/OPT] cache_frames - number of decompressed frames to keep (default 16)
+    '''
+    def __init__(self,file_path,cache_frames=16):
+        '''@brief Constructor'''
+        self.file_path = file_path
+        self.cache_frames = cache_frames
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        with open(file_path,'rb') as fp:
+            if fp.read(len(FRAME_MAGIC))!=FRAME_MAGIC:
+                raise FrameError("{} is not a framed file".format(file_path))
+            if os.fstat(fp.fileno()).st_size<len(FRAME_MAGIC)+FRAME_FOOTER_TAIL.size:
+                raise FrameError("{} was not completely written".format(file_path))
+            fp.seek(-FRAME_FOOTER_TAIL.size,os.SEEK_END)
+            footer_len,magic = FRAME_FOOTER_TAIL.unpack(fp.read(FRAME_FOOTER_TAIL.size))
+            if magic!=FRAME_MAGIC: #the footer is written last
+                raise FrameError("{} was not completely written".format(file_path))
+            fp.seek(-FRAME_FOOTER_TAIL.size-footer_len,os.SEEK_END)
+            footer = json.loads(fp.read(footer_len).decode('utf-8'))
+        self.compression = footer['compression']
+        self.shuffle = footer['shuffle']
+        self.frames = footer['frames']
+        self.info = footer['info']
+
+    @property
+    def num_frames(self):
+        '''@brief number of frames in the file'''
+        return len(self.frames)
+
+    @property
+    def compressed_size(self):
+        '''@brief total number of compressed bytes of all of the frames'''
+        return sum([f[1] for f in self.frames])
+
+    def read_frame(self,index):
+        '''
+        @brief read and decompress a frame
+        @param[in] index - index of the frame
+        @return numpy array of the frame (read-only because it may be shared from the cache)
+        '''
+        with self._lock:
+            data = self._cache.get(index,None)
+            if data is not None:
+                self._cache.move_to_end(index)
+                return data
+        offset,size,shape,dtype = self.frames[index]
+        with open(self.file_path,'rb') as fp:
+            fp.seek(offset)
+            buf = fp.read(size)
+        data = decompress_frame(buf,shape,dtype,self.compression,self.shuffle)
+        data.flags.writeable = False
+        with self._lock:
+            self._cache[index] = data
+            while len(self._cache)>self.cache_frames:
+                self._cache.popitem(last=False)
+        return data
+
+class FrameError(Exception):
+    '''@brief error for malformed framed files'''
+    pass
+
+#%% Unit testing
+import unittest
+class TestCompressedFrames(unittest.TestCase):
+    '''@brief tests for writing and reading compressed frames'''
+
+    def test_frames(self):
+        '''@brief frames written in any order should read back exactly with both compressions'''
+        import tempfile
+        frames = [np.random.rand(5,3),np.random.rand(4)+1j*np.random.rand(4),np.arange(6,dtype=np.uint32),np.empty((0,2))]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for compression in COMPRESSION_TYPES:
+                for shuffle in [True,False]:
+                    fpath = os.path.join(tmp_dir,'test_{}_{}.frames'.format(compression,shuffle))
+                    with FrameWriter(fpath,compression,shuffle=shuffle) as fw:
+                        for i in reversed(range(len(frames))):
+                            fw.write_frame(frames[i],i)
+                        fw.info['test'] = 1
+                    self.assertTrue(is_framed_file(fpath))
+                    fr = FrameReader(fpath,cache_frames=2)
+                    self.assertEqual(fr.info,{'test':1})
+                    for i,frame in enumerate(frames):
+                        self.assertTrue(np.array_equal(fr.read_frame(i),frame))
+                        self.assertEqual(fr.read_frame(i).dtype,frame.dtype)
+                    self.assertEqual(len(fr._cache),2)
+            #a file that was not finished cannot be read
+            fpath = os.path.join(tmp_dir,'unfinished.frames')
+            with self.assertRaises(KeyboardInterrupt):
+                with FrameWriter(fpath) as fw:
+                    fw.write_frame(frames[0])
+                    raise KeyboardInterrupt
+            with self.assertRaises(FrameError):
+                FrameReader(fpath)
+
+if __name__=='__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestCompressedFrames)
+    unittest.TextTestRunner(verbosity=2).run(suite)
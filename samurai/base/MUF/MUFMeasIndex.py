@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+@brief Index of the data paths in MUFResult (*.meas) files. Each *.meas file is parsed once and its
+    nominal, monte carlo, and perturbed paths are stored in a json file (e.g. next to a metafile) so
+    finding a path is a dictionary lookup instead of parsing the xml again.
+    Entries are reparsed when the size or modification time of the *.meas file changes.
+
+@author: ajw5
+"""
+import os
+from concurrent.futures import Executor,ThreadPoolExecutor,ProcessPoolExecutor
+
+from samurai.base.SamuraiDict import SamuraiDict
+from samurai.base.TouchstoneEditor import get_file_key
+from samurai.base.MUF.MUFResult import MUFResult
+from samurai.base.generic import ProgressCounter
+
+MEAS_INDEX_EXTENSION = '.meas_index.json'
+MEAS_INDEX_VERSION = 1.0
+MEAS_DATA_TYPES = ['nominal','monte_carlo','perturbed']
+
+def parse_meas_paths(meas_path):
+    '''
+    @brief parse the data paths of a *.meas file
+    @param[in] meas_path - path to the *.meas file
+    @note the nominal path is found like get_unperturbed_meas (what TouchstoneEditor loads for a *.meas file)
+        and the monte carlo and perturbed paths like MUFItem.get_filepath
+    @return index entry {'key':get_file_key(meas_path),'nominal':path,'monte_carlo':[paths],'perturbed':[paths]}
+    '''
+    key = get_file_key(meas_path) #before parsing so a change while parsing is caught next time
+    muf_res = MUFResult(meas_path,load_nominal=False)
+    wdir = muf_res.working_directory
+    entry = {'key':key}
+    entry['nominal'] = os.path.join(wdir,muf_res.nominal.muf_items[0][1]) if len(muf_res.nominal.muf_items) else meas_path
+    for data_type in ['monte_carlo','perturbed']:
+        entry[data_type] = [it.get_filepath(working_directory=wdir) for it in getattr(muf_res,data_type).muf_items]
+    return entry
+
+def get_meas_index_path(metafile_path):
+    '''@brief path of the index next to a metafile (e.g. path/to/metafile.meas_index.json)'''
+    return os.path.splitext(metafile_path)[0]+MEAS_INDEX_EXTENSION
+
+class MeasIndex(SamuraiDict):
+    '''
+    @brief Index of the nominal, monte carlo, and perturbed paths of *.meas files
+    @param[in/OPT] index_path - path of the index json file. Loaded if it exists. None keeps the index in memory only
+    @example
+        index = MeasIndex('path/to/metafile.meas_index.json')
+        index.update_entries(meas_paths,n_workers=8) #parse new or changed *.meas files
+        index.write()
+        mc_path = index.get_path(meas_paths[0],'monte_carlo',3)
+    '''
+    def __init__(self,index_path=None):
+        '''@brief constructor'''
+        super().__init__()
+        self.index_path = index_path
+        if index_path is not None and os.path.exists(index_path):
+            try:
+                self.load(index_path)
+            except ValueError: #broken index so start over
+                self.clear()
+        if self.get('index_version')!=MEAS_INDEX_VERSION:
+            self.clear()
+        self['index_version'] = MEAS_INDEX_VERSION
+        self['entries'] = self.get('entries',{})
+        self.changed = False #whether entries have changed since loading
+
+    @staticmethod
+    def _get_name(meas_path):
+        '''@brief name of the entry of a *.meas file'''
+        return os.path.normpath(os.path.abspath(meas_path))
+
+    def is_current(self,meas_path):
+        '''
+        @brief check if a *.meas file is in the index and has not changed since it was parsed
+        @param[in] meas_path - path to the *.meas file
+        '''
+        entry = self['entries'].get(self._get_name(meas_path),None)
+        return entry is not None and list(entry['key'])==get_file_key(meas_path)
+
+    def update_entries(self,meas_paths,n_workers=1,executor='thread',verbose=False):
+        '''
+        @brief parse all of the *.meas files that are not in the index or have changed
+        @param[in] meas_paths - list of paths to *.meas files
+        @param[in/OPT] n_workers - number of workers to parse with. 1 parses serially (default 1)
+        @param[in/OPT] executor - 'thread' or 'process' pool or a running concurrent.futures.Executor (default 'thread')
+        @param[in/OPT] verbose - whether or not to print progress (default False)
+        @return number of files that were parsed
+        '''
+        stale = sorted(set([self._get_name(p) for p in meas_paths if not self.is_current(p)]))
+        if not len(stale):
+            return 0
+        if verbose: pc = ProgressCounter(len(stale),'Indexing *.meas files: ',update_period=5)
+        if n_workers==1 and not isinstance(executor,Executor):
+            entries = []
+            for meas_path in stale:
+                entries.append(parse_meas_paths(meas_path))
+                if verbose: pc.update()
+        else:
+            pool = executor
+            if not isinstance(pool,Executor):
+                executor_types = {'thread':ThreadPoolExecutor,'process':ProcessPoolExecutor}
+                if executor not in executor_types:
+                    raise ValueError("Executor '{}' not in {}".format(executor,list(executor_types.keys())))
+                pool = executor_types[executor](n_workers)
+            try:
+                entries = []
+                for entry in pool.map(parse_meas_paths,stale):
+                    entries.append(entry)
+                    if verbose: pc.update()
+            finally:
+                if pool is not executor:
+                    pool.shutdown(wait=True)
+        if verbose: pc.finalize()
+        for name,entry in zip(stale,entries):
+            self['entries'][name] = entry
+        self.changed = True
+        return len(stale)
+
+    def get_paths(self,meas_path,data_type='nominal'):
+        '''
+        @brief get the paths of a type of data of a *.meas file. Files not in the index are parsed and added
+        @param[in] meas_path - path to the *.meas file
+        @param[in/OPT] data_type - nominal,monte_carlo,perturbed (default nominal)
+        @note entries are not checked for changes here (see update_entries)
+        @return list of paths ([nominal path] for nominal)
+        '''
+        if data_type not in MEAS_DATA_TYPES:
+            raise ValueError("Data type '{}' not in {}".format(data_type,MEAS_DATA_TYPES))
+        entry = self['entries'].get(self._get_name(meas_path),None)
+        if entry is None:
+            self.update_entries([meas_path])
+            entry = self['entries'][self._get_name(meas_path)]
+        return [entry['nominal']] if data_type=='nominal' else entry[data_type]
+
+    def get_path(self,meas_path,data_type='nominal',data_meas_num=0):
+        '''
+        @brief get the path of a single measurement of a *.meas file
+        @param[in] meas_path - path to the *.meas file
+        @param[in/OPT] data_type - nominal,monte_carlo,perturbed (default nominal)
+        @param[in/OPT] data_meas_num - which measurement of monte_carlo or perturbed to use (default 0)
+        @return path of the measurement
+        '''
+        paths = self.get_paths(meas_path,data_type)
+        return paths[0] if data_type=='nominal' else paths[data_meas_num]
+
+    def write(self,index_path=None):
+        '''
+        @brief write the index (to a temporary file that is then moved so it is never partially written)
+        @param[in/OPT] index_path - path to write to (default self.index_path)
+        @return path of the index
+        '''
+        if index_path is None:
+            index_path = self.index_path
+        tmp_path = '{}.{}.tmp'.format(index_path,os.getpid())
+        super().write(tmp_path)
+        os.replace(tmp_path,index_path)
+        self.changed = False
+        return index_path
+
+#%% Unit testing
+import unittest
+class TestMeasIndex(unittest.TestCase):
+    '''@brief tests for indexing the paths of *.meas files'''
+
+    wdir = os.path.dirname(__file__)
+    unittest_dir = os.path.join(wdir,'../unittest_data')
+
+    def test_meas_index(self):
+        '''@brief the index should match parsing the *.meas file and be reparsed when the file changes'''
+        import shutil
+        import tempfile
+        from samurai.base.TouchstoneEditor import get_unperturbed_meas
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            shutil.copytree(os.path.join(self.unittest_dir,'meas_test'),os.path.join(tmp_dir,'meas_test'))
+            meas_path = shutil.copy(os.path.join(self.unittest_dir,'meas_test.meas'),tmp_dir)
+            index_path = os.path.join(tmp_dir,'metafile'+MEAS_INDEX_EXTENSION)
+            index = MeasIndex(index_path)
+            self.assertEqual(index.update_entries([meas_path,meas_path],n_workers=2),1)
+            self.assertEqual(index.update_entries([meas_path]),0)
+            index.write()
+            res = MUFResult(meas_path,load_nominal=False)
+            mc_paths = [it.get_filepath(working_directory=res.working_directory) for it in res.monte_carlo.muf_items]
+            index = MeasIndex(index_path) #from the file
+            self.assertFalse(index.changed)
+            self.assertEqual(index.get_paths(meas_path,'monte_carlo'),mc_paths)
+            self.assertEqual(index.get_path(meas_path,'monte_carlo',5),mc_paths[5])
+            self.assertEqual(index.get_path(meas_path),get_unperturbed_meas(meas_path))
+            #a changed file is parsed again
+            res.set_monte_carlo(mc_paths[:3])
+            res.write_xml(meas_path)
+            os.utime(meas_path,ns=(0,1))
+            self.assertFalse(index.is_current(meas_path))
+            self.assertEqual(index.update_entries([meas_path]),1)
+            self.assertEqual(len(index.get_paths(meas_path,'monte_carlo')),3)
+            with self.assertRaises(ValueError):
+                index.get_paths(meas_path,'bad')
+
+if __name__=='__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestMeasIndex)
+    unittest.TextTestRunner(verbosity=2).run(suite)
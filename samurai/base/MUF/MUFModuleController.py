@@ -7,6 +7,8 @@
 
 from lxml import etree as ET
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from samurai.base.SamuraiXML import SamuraiXML,SamuraiXMLElement
 from samurai.base.generic import subprocess_generator, get_name_from_path
 
@@ -114,12 +116,24 @@ class MUFModuleController(SamuraiXML):
             else:
                 raise Exception("No menu loaded")
         self.write(out_path)
-        out_path = os.path.abspath(out_path)
-        command = self.options['exe_path']+' -r '+out_path
-        if verbose: print("Running : '{}'".format(command))
+        command = self.get_command(out_path)
+        if verbose: print("Running : '{}'".format(' '.join(command)))
         exe_generator = subprocess_generator(command)
         for out_line in exe_generator:
             text_function(out_line,*tf_args_tuple,**tf_kwargs_dict)
+            
+    def get_command(self,out_path):
+        '''
+        @brief get the command to run the module on a menu
+        @param[in] out_path - path of the menu to run
+        @note exe_path can also be a list (e.g. ['python','stub.py']) for programs run through an interpreter
+        @return list of arguments of the command
+        '''
+        exe_path = self.options['exe_path']
+        if exe_path is None:
+            raise Exception("No executable path (exe_path) provided")
+        command = list(exe_path) if isinstance(exe_path,(list,tuple)) else [exe_path]
+        return command+['-r',os.path.abspath(out_path)]
         
     def add_item(self,parent_element,item):
         add_muf_xml_items(parent_element,[item])
@@ -168,6 +182,43 @@ class MUFModuleController(SamuraiXML):
         '''
         return self.find('MenuStripComboBoxes')
     
+def run_modules(module_list,out_paths=None,n_workers=None,verbose=False,text_function=print,tf_args_tuple=(),tf_kwargs_dict={}):
+    '''
+    @brief run multiple modules (e.g. a PostProcPy menu for each group of DUTs) at the same time.
+        Each module is run in its own subprocess with at most n_workers running at once
+    @param[in] module_list - list of MUFModuleController to run
+    @param[in/OPT] out_paths - list of paths to write each menu to before running (default to each menu_path)
+    @param[in/OPT] n_workers - maximum number of modules to run at once. None uses the number of cpus (default None)
+    @param[in/OPT] verbose - whether or not to be verbose
+    @param[in/OPT] text_function - function that the output of each module will be passed to 
+        (default is print()). Each line is prefixed with the name of its menu (e.g. '[menu_name] line')
+    @param[in/OPT] tf_args_tuple - tuple of arguments to pass to text_function
+    @param[in/OPT] tf_kwargs_dict - dictionary of kwargs to pass to text_function
+    @note all modules are run even if one fails. The first failure (in module order) is then raised
+    @return list of absolute paths of the menus that were run
+    '''
+    if out_paths is None:
+        out_paths = [module.menu_path for module in module_list]
+    if len(out_paths)!=len(module_list):
+        raise ValueError("{} output paths provided for {} modules".format(len(out_paths),len(module_list)))
+    commands = []
+    for module,out_path in zip(module_list,out_paths): #write the menus before starting anything
+        module.write(out_path)
+        commands.append(module.get_command(out_path))
+    text_lock = threading.Lock() #so lines from different modules are not mixed together
+    def run_command(command,name):
+        if verbose: 
+            with text_lock: print("Running : '{}'".format(' '.join(command)))
+        for out_line in subprocess_generator(command):
+            with text_lock:
+                text_function('[{}] {}'.format(name,out_line),*tf_args_tuple,**tf_kwargs_dict)
+    with ThreadPoolExecutor(n_workers) as executor:
+        futures = [executor.submit(run_command,command,get_name_from_path(out_path)) 
+                   for command,out_path in zip(commands,out_paths)]
+    for future in futures: #raise any errors after everything has finished
+        future.result()
+    return [os.path.abspath(out_path) for out_path in out_paths]
+    
 class MUFItemList:
     '''@brief class to hold a list of MUF items (e.g. Monte Carlos, Perturbed Measurements, etc.)'''
     
@@ -6,7 +6,7 @@ Created on Mon Jun 24 16:02:04 2019
 """
 
 from samurai.base.TouchstoneEditor import TouchstoneEditor,TouchstoneError, SnpEditor,WaveformEditor
-from samurai.base.TouchstoneEditor import TouchstoneParam
+from samurai.base.TouchstoneEditor import TouchstoneParam, TouchstoneArray
 from samurai.base.MUF.MUFModuleController import MUFModuleController, MUFItemList, MUFItem, mufPathFind
 from samurai.base.SamuraiPlotter import SamuraiPlotter
 from samurai.base.generic import complex2magphase, magphase2complex
@@ -15,6 +15,8 @@ from samurai.base.generic import moving_average
 from samurai.base.generic import ProgressCounter
 
 import shutil
+from collections import deque
+from concurrent.futures import Executor,ThreadPoolExecutor,ProcessPoolExecutor
 
 #from xml.dom.minidom import parse, parseString
 import numpy as np
@@ -57,28 +59,86 @@ def set_meas_relative(meas_path,out_path=None):
 
 #%% Statistics operations used in the MUF 
 
+STATISTIC_NAMES = ['estimate','confidence_interval','standard_uncertainty']
+
+def stack_touchstone_data(data):
+    '''
+    @brief stack the data of a list of TouchstoneEditors into a single array
+    @param[in] data - list of TouchstoneEditors with the same frequencies and ports
+    @return complex array of shape (len(data),frequency,column)
+    '''
+    stack = np.empty((len(data),)+np.shape(data[0].raw),dtype=np.cdouble)
+    for i,tnp in enumerate(data):
+        stack[i] = tnp.raw
+    return stack
+
+def get_confidence_interval_indices(num_values,confidence_interval=95):
+    '''
+    @brief get the indices of the sorted values of the lower and upper confidence interval (like the MUF)
+    @param[in] num_values - number of values (e.g. number of monte carlo values)
+    @param[in/OPT] confidence_interval - confidence interval percentage (default 95)
+    @return lo_index,hi_index
+    '''
+    percentage = 0.5*(1-confidence_interval/100)
+    lo_index = int(percentage*num_values)
+    if lo_index<=0: lo_index=1
+    hi_index = num_values-lo_index
+    return lo_index,hi_index
+
+def calculate_statistics_from_array(stack,confidence_interval=95):
+    '''
+    @brief calculate all of the statistics the MUF does from stacked data in a single pass.
+        The magnitude and phase are calculated once and used for all of the statistics
+    @param[in] stack - complex array of shape (value,...) (e.g. (monte carlo,frequency,column) from stack_touchstone_data)
+    @param[in/OPT] confidence_interval - confidence interval percentage (default 95)
+    @note the confidence interval values are found with a partial sort (np.partition) of the
+        magnitude and phase instead of sorting all of the values
+    @return dictionary of complex arrays of shape stack.shape[1:] with keys
+        'estimate' - mean of the magnitude and phase
+        'confidence_interval' - (upper,lower) values of the sorted magnitude and phase
+        'standard_uncertainty' - (mean+std,mean-std) of the magnitude and phase
+    '''
+    m,p = complex2magphase(np.asarray(stack))
+    m_mean = m.mean(0); p_mean = p.mean(0)
+    m_std  = m.std(0) ; p_std  = p.std(0) #mean and stdev of mag/phase
+    lo_index,hi_index = get_confidence_interval_indices(m.shape[0],confidence_interval)
+    kth = [lo_index,hi_index] if hi_index<m.shape[0] else [lo_index] #hi_index is out of range with 1 value
+    m = np.partition(m,kth,axis=0) #done in place since the values are no longer needed
+    p = np.partition(p,kth,axis=0)
+    stats = {}
+    stats['estimate'] = magphase2complex(m_mean,p_mean)
+    stats['confidence_interval'] = (magphase2complex(m[hi_index],p[hi_index]),magphase2complex(m[lo_index],p[lo_index]))
+    stats['standard_uncertainty'] = (magphase2complex(m_mean+m_std,p_mean+p_std),magphase2complex(m_mean-m_std,p_mean-p_std))
+    return stats
+
+def calculate_statistics(data,confidence_interval=95):
+    '''
+    @brief calculate the estimate, confidence interval, and standard uncertainty from a list of
+        TouchstoneEditors. The data is only stacked into a single array once (see calculate_statistics_from_array)
+    @param[in] data - list of TouchstoneEditor data
+    @param[in/OPT] confidence_interval - confidence interval percentage (default 95)
+    @return dictionary with 'estimate':TouchstoneEditor,'confidence_interval':(upper,lower) TouchstoneEditors,
+        and 'standard_uncertainty':(+,-) TouchstoneEditors
+    '''
+    stats = calculate_statistics_from_array(stack_touchstone_data(data),confidence_interval)
+    MyEditor = type(data[0]) #type of the editor to create
+    def create_editor(values):
+        tnp_out = MyEditor([data[0].num_ports,data[0].freq_list])
+        tnp_out.raw = values
+        return tnp_out
+    out = {}
+    for name,values in stats.items():
+        out[name] = tuple([create_editor(v) for v in values]) if isinstance(values,tuple) else create_editor(values)
+    return out
+
 def calculate_estimate(data):
     '''
     @brief calculate the estimate from the input values (mean of the values)
     @param[in] data - list of TouchstoneParameter data
+    @note use calculate_statistics when more than one statistic is needed
     @return Touchstone object with the estimate (mean) of the stats_path values
     '''
-    #create a blank snp file to fill
-    num_ports = round(np.sqrt(len(data[0].wave_dict_keys)-1)) #-1 to ignore the freq_list entry
-    freq_list = data[0].freq_list
-    MyEditor = type(data[0]) #type of the editor to create
-    data_dict = {}
-    for k in data[0].wave_dict_keys: #data for each key
-        data_dict[k] = np.array([tnp.S[k].raw for tnp in data]) 
-    tnp_out = MyEditor([num_ports,freq_list])
-    for wk in tnp_out.waves:
-        for k in tnp_out.wave_dict_keys:
-            data = data_dict[k] #get the data
-            m,p = complex2magphase(data)
-            m_mean = m.mean(0); p_mean = p.mean(0)
-            data_mean = magphase2complex(m_mean,p_mean)
-            tnp_out[(wk,k)][:] = data_mean
-    return tnp_out
+    return calculate_statistics(data)['estimate']
     
 def calculate_confidence_interval(data,confidence_interval=95):
     '''
@@ -86,67 +146,338 @@ def calculate_confidence_interval(data,confidence_interval=95):
         this will calculate both the upper and lower intervals
     @param[in] data - list of TouchstoneEditor files to calculate from
     @param[in/OPT] confidence_interval - confidence interval percentage (default 95)
+    @note use calculate_statistics when more than one statistic is needed
     @return TouchstoneEditor objects for upper(+),lower(-) intervals
     '''
-    #create a blank snp file to fill
-    num_ports = round(np.sqrt(len(data[0].wave_dict_keys)-1)) #-1 to ignore the freq_list entry
-    first_key = data[0].wave_dict_keys[0]
-    freq_list = data[0].freq_list
-    MyEditor = type(data[0]) #type of the editor to create
-    data_dict = {}
-    for k in data[0].wave_dict_keys: #data for each key
-        data_dict[k] = np.array([tnp.S[k].raw for tnp in data])
-    tnp_out_p = MyEditor([num_ports,freq_list])
-    tnp_out_m = MyEditor([num_ports,freq_list])
-    #find percentage and index like in the MUF
-    percentage = 0.5*(1-confidence_interval/100)
-    lo_index = int(percentage*data_dict[first_key].shape[0])
-    if lo_index<=0: lo_index=1
-    hi_index = data_dict[first_key].shape[0]-lo_index
-    for wk in tnp_out_m.waves:
-        for k in tnp_out_p.wave_dict_keys:
-            data = data_dict[k] #get the data
-            #done in the same way as the MUF
-            m,p = complex2magphase(data)
-            m.sort(0); p.sort(0)
-            m_hi = m[hi_index,:]; m_lo = m[lo_index]
-            p_hi = p[hi_index,:]; p_lo = p[lo_index]
-            hi_complex = magphase2complex(m_hi,p_hi)
-            lo_complex = magphase2complex(m_lo,p_lo)
-            tnp_out_p[(wk,k)][:] = hi_complex
-            tnp_out_m[(wk,k)][:] = lo_complex
-    return tnp_out_p,tnp_out_m
+    return calculate_statistics(data,confidence_interval)['confidence_interval']
 
 def calculate_standard_uncertainty(data):
     '''
     @brief calculate standard uncertainty (standard deviation)
     @param[in] data - list of TouchstoneEditor files to calculate from
+    @note use calculate_statistics when more than one statistic is needed
     @return Touchstone objects for upper(+),lower(-) uncerts
     '''
-    #create a blank snp file to fill
-    num_ports = round(np.sqrt(len(data[0].wave_dict_keys)-1)) #-1 to ignore the freq_list entry
-    first_key = data[0].wave_dict_keys[0]
-    freq_list = data[0].freq_list
-    MyEditor = type(data[0]) #type of the editor to create
-    data_dict = {}
-    for k in data[0].wave_dict_keys: #data for each key
-        data_dict[k] = np.array([tnp.S[k].raw for tnp in data])
-    tnp_out_p = MyEditor([num_ports,freq_list])
-    tnp_out_m = MyEditor([num_ports,freq_list])
-    for wk in tnp_out_m.waves:
-        for k in tnp_out_p.wave_dict_keys:
-            data = data_dict[k] #get the data
-            m,p = complex2magphase(data)
-            m_mean = m.mean(0); p_mean = p.mean(0)
-            m_std  = m.std(0) ; p_std  = p.std(0) #mean and stdev of mag/phase
-            m_plus = m_mean+m_std; m_minus = m_mean-m_std
-            p_plus = p_mean+p_std; p_minus = p_mean-p_std
-            data_plus   = magphase2complex(m_plus ,p_plus )
-            data_minus  = magphase2complex(m_minus,p_minus)
-            tnp_out_p[(wk,k)][:] = data_plus
-            tnp_out_m[(wk,k)][:] = data_minus
-    return tnp_out_p,tnp_out_m
+    return calculate_statistics(data)['standard_uncertainty']
+    
+#%% Streaming statistics (one value at a time without holding all of the values)
+
+QUANTILE_METHODS = ['auto','p2','tails']
+STREAMING_MAX_TAIL_VALUES = 64 #largest tail kept for exact confidence intervals with quantile_method='auto'
+
+class WelfordAccumulator(object):
+    '''
+    @brief running mean and variance of arrays added one at a time (Welford's algorithm).
+        Only the count, mean, and sum of squared differences are stored
+    @param[in] shape - shape of each array that will be added
+    '''
+    def __init__(self,shape):
+        '''@brief Constructor'''
+        self.count = 0
+        self.mean = np.zeros(shape)
+        self._m2 = np.zeros(shape) #sum of squared differences from the mean
+        
+    def update(self,values):
+        '''@brief add an array of values'''
+        self.count += 1
+        delta = values-self.mean
+        self.mean += delta/self.count
+        self._m2 += delta*(values-self.mean)
+        
+    def merge(self,other):
+        '''
+        @brief combine with another accumulator (e.g. from another worker) using Chan's formula
+        @param[in] other - WelfordAccumulator to add to this one
+        '''
+        count = self.count+other.count
+        if other.count==0 or count==0:
+            return
+        delta = other.mean-self.mean
+        self.mean += delta*(other.count/count)
+        self._m2 += other._m2+delta**2*(self.count*other.count/count)
+        self.count = count
+        
+    @property
+    def variance(self):
+        '''@brief population variance (like np.var)'''
+        return self._m2/self.count
     
+    @property
+    def std(self):
+        '''@brief population standard deviation (like np.std)'''
+        return np.sqrt(self.variance)
+    
+class P2Quantile(object):
+    '''
+    @brief estimate a quantile of arrays added one at a time with the P-squared algorithm 
+        (Jain and Chlamtac, 1985). Each value of the array has 5 markers so the memory
+        does not depend on the number of arrays added
+    @param[in] quantile - quantile to estimate (0 to 1)
+    @param[in] shape - shape of each array that will be added
+    @note NaN values are treated as the largest value (like np.sort). The result is an estimate
+    '''
+    def __init__(self,quantile,shape):
+        '''@brief Constructor'''
+        self.quantile = quantile
+        self.count = 0
+        self._heights = np.empty((5,)+tuple(shape))
+        self._positions = None #actual marker positions (per value)
+        p = quantile
+        self._desired = np.array([0,2*p,4*p,2+2*p,4]) #desired marker positions after 5 values (0 based)
+        self._increments = np.array([0,p/2,p,(1+p)/2,1])
+        
+    def update(self,values):
+        '''@brief add an array of values'''
+        q = self._heights
+        if self.count<5: #the first 5 values are the markers
+            q[self.count] = values
+            self.count += 1
+            if self.count==5:
+                q.sort(0)
+                self._positions = np.ones(q.shape)*np.arange(5).reshape((5,)+(1,)*(q.ndim-1))
+            return
+        self.count += 1
+        n = self._positions
+        x = np.where(np.isnan(values),q[4],values) #nan is the largest value
+        np.minimum(q[0],x,out=q[0]); np.maximum(q[4],x,out=q[4])
+        cell = (x>=q[1]).astype(int)+(x>=q[2])+(x>=q[3]) #markers above the cell are moved up
+        for i in range(1,5):
+            n[i] += cell<i
+        self._desired += self._increments
+        with np.errstate(invalid='ignore',divide='ignore'):
+            for i in range(1,4): #adjust the middle markers
+                d = self._desired[i]-n[i]
+                up = (d>=1)&(n[i+1]-n[i]>1); down = (d<=-1)&(n[i-1]-n[i]<-1)
+                move = up|down
+                if not move.any(): continue
+                s = np.where(up,1.,-1.)
+                parabolic = q[i]+s/(n[i+1]-n[i-1])*((n[i]-n[i-1]+s)*(q[i+1]-q[i])/(n[i+1]-n[i])
+                                                    +(n[i+1]-n[i]-s)*(q[i]-q[i-1])/(n[i]-n[i-1]))
+                linear = np.where(up,q[i]+(q[i+1]-q[i])/(n[i+1]-n[i]),q[i]-(q[i-1]-q[i])/(n[i-1]-n[i]))
+                new = np.where((q[i-1]<parabolic)&(parabolic<q[i+1]),parabolic,linear)
+                q[i] = np.where(move,new,q[i])
+                n[i] += np.where(move,s,0)
+                
+    @property
+    def value(self):
+        '''@brief current estimate of the quantile'''
+        if self.count>=5:
+            return self._heights[2].copy()
+        vals = np.sort(self._heights[:self.count],axis=0) #not enough values for the markers
+        return vals[int(round(self.quantile*(self.count-1)))]
+    
+class TailOrderStatistic(object):
+    '''
+    @brief exact value at a sorted index near the start or end of arrays added one at a time.
+        Only the num_keep smallest (or largest) values are kept so the memory is 
+        proportional to the tail and not to the number of arrays added
+    @param[in] num_keep - number of values to keep (e.g. index+1 for the smallest values)
+    @param[in] shape - shape of each array that will be added
+    @param[in/OPT] largest - keep the largest values instead of the smallest (default False)
+    @note the values are ordered with np.partition so NaN is the largest value like in calculate_statistics_from_array
+    '''
+    def __init__(self,num_keep,shape,largest=False):
+        '''@brief Constructor'''
+        self.num_keep = num_keep
+        self.largest = largest
+        self._values = np.empty((2*num_keep,)+tuple(shape)) #kept values and a block of new values
+        self._num_values = 0
+        
+    def update(self,values):
+        '''@brief add an array of values'''
+        if self._num_values==self._values.shape[0]:
+            self._reduce()
+        self._values[self._num_values] = values
+        self._num_values += 1
+        
+    def _reduce(self):
+        '''@brief only keep the num_keep smallest/largest values'''
+        num_values = self._num_values
+        if num_values<=self.num_keep:
+            return
+        vals = self._values[:num_values]
+        if self.largest:
+            vals[:] = np.partition(vals,num_values-self.num_keep,axis=0)
+            vals[:self.num_keep] = vals[num_values-self.num_keep:].copy()
+        else:
+            vals[:] = np.partition(vals,self.num_keep-1,axis=0)
+        self._num_values = self.num_keep
+        
+    @property
+    def value(self):
+        '''@brief smallest of the kept largest values (or largest of the kept smallest values)'''
+        self._reduce()
+        vals = self._values[:self._num_values]
+        kth = 0 if self.largest else self._num_values-1
+        return np.partition(vals,kth,axis=0)[kth]
+
+class StreamingStatistics(object):
+    '''
+    @brief calculate the same statistics as calculate_statistics_from_array from values 
+        added one at a time (e.g. one monte carlo file at a time) without holding all of them.
+        The mean and standard deviation of the magnitude and phase use Welford's algorithm. 
+        The confidence interval values are found with a quantile method:
+            - 'tails' - exact values. Memory is proportional to the number of values outside of the interval
+            - 'p2' - P-squared estimate. Memory does not depend on the number of values
+            - 'auto' - 'tails' when at most STREAMING_MAX_TAIL_VALUES values are outside of the interval, otherwise 'p2'.
+                The memory is always bounded and the interval matches the MUF for typical numbers of monte carlo values
+    @param[in] num_values - total number of values that will be added (used for the confidence interval indices)
+    @param[in/OPT] confidence_interval - confidence interval percentage (default 95)
+    @param[in/OPT] quantile_method - 'auto', 'p2', or 'tails' (default 'auto')
+    @example
+        stats = StreamingStatistics(len(paths))
+        for path in paths:
+            stats.update(TouchstoneArray(path).raw)
+        stats = stats.get_statistics()
+    '''
+    def __init__(self,num_values,confidence_interval=95,quantile_method='auto'):
+        '''@brief Constructor'''
+        if quantile_method not in QUANTILE_METHODS:
+            raise ValueError("Quantile method '{}' not in {}".format(quantile_method,QUANTILE_METHODS))
+        self.num_values = num_values
+        self.confidence_interval = confidence_interval
+        if quantile_method=='auto':
+            lo_index,_ = get_confidence_interval_indices(num_values,confidence_interval)
+            quantile_method = 'tails' if lo_index<STREAMING_MAX_TAIL_VALUES else 'p2'
+        self.quantile_method = quantile_method
+        self._accumulators = None #(magnitude,phase) dicts of accumulators
+        
+    @property
+    def count(self):
+        '''@brief number of values added'''
+        return self._accumulators[0]['mean'].count if self._accumulators is not None else 0
+        
+    def _create_accumulators(self,shape):
+        '''@brief create the accumulators for the magnitude or phase'''
+        lo_index,hi_index = get_confidence_interval_indices(self.num_values,self.confidence_interval)
+        acc = {'mean':WelfordAccumulator(shape)}
+        if self.quantile_method=='p2':
+            nm1 = max(self.num_values-1,1)
+            acc['lo'] = P2Quantile(lo_index/nm1,shape)
+            acc['hi'] = P2Quantile(min(hi_index,nm1)/nm1,shape)
+        else:
+            acc['lo'] = TailOrderStatistic(lo_index+1,shape)
+            acc['hi'] = TailOrderStatistic(max(self.num_values-hi_index,1),shape,largest=True)
+        return acc
+        
+    def update(self,values):
+        '''
+        @brief add a value
+        @param[in] values - complex array (e.g. (frequency,column) raw data of a TouchstoneArray)
+        '''
+        if self.count>=self.num_values:
+            raise ValueError("More than the {} expected values were added".format(self.num_values))
+        values = np.asarray(values)
+        if self._accumulators is None:
+            self._accumulators = [self._create_accumulators(values.shape) for i in range(2)]
+        for acc,vals in zip(self._accumulators,complex2magphase(values)):
+            for a in acc.values():
+                a.update(vals)
+        
+    def get_statistics(self):
+        '''
+        @brief get the statistics of the values added so far
+        @return dictionary of complex arrays like calculate_statistics_from_array
+        '''
+        if not self.count:
+            raise ValueError("No values have been added")
+        (m,p) = self._accumulators
+        m_mean,p_mean = m['mean'].mean,p['mean'].mean
+        m_std ,p_std  = m['mean'].std ,p['mean'].std
+        stats = {}
+        stats['estimate'] = magphase2complex(m_mean,p_mean)
+        stats['confidence_interval'] = (magphase2complex(m['hi'].value,p['hi'].value),magphase2complex(m['lo'].value,p['lo'].value))
+        stats['standard_uncertainty'] = (magphase2complex(m_mean+m_std,p_mean+p_std),magphase2complex(m_mean-m_std,p_mean-p_std))
+        return stats
+    
+def _read_touchstone_raw(file_path):
+    '''@brief read the raw data of a touchstone file (used for reading in workers)'''
+    return TouchstoneArray(file_path,cache=False)
+    
+def iter_touchstone_files(file_paths,n_workers=1,executor='thread',max_pending=None):
+    '''
+    @brief read touchstone files in a pool and yield them in order. Only a limited number
+        of files are read ahead so the memory does not depend on the number of files
+    @param[in] file_paths - list of paths of files to read
+    @param[in/OPT] n_workers - number of workers. 1 reads in this thread (default 1)
+    @param[in/OPT] executor - 'thread' or 'process' pool or a running concurrent.futures.Executor (default 'thread')
+    @param[in/OPT] max_pending - maximum number of files read ahead (default 2*n_workers)
+    @return generator of TouchstoneArray
+    '''
+    if n_workers==1 and not isinstance(executor,Executor):
+        for fpath in file_paths:
+            yield _read_touchstone_raw(fpath)
+        return
+    pool = executor
+    if not isinstance(pool,Executor):
+        executor_types = {'thread':ThreadPoolExecutor,'process':ProcessPoolExecutor}
+        if executor not in executor_types:
+            raise ValueError("Executor '{}' not in {}".format(executor,list(executor_types.keys())))
+        pool = executor_types[executor](n_workers)
+    if max_pending is None:
+        max_pending = 2*(n_workers or os.cpu_count() or 1)
+    pending = deque()
+    try:
+        path_iter = iter(file_paths)
+        for fpath in path_iter:
+            pending.append(pool.submit(_read_touchstone_raw,fpath))
+            if len(pending)>=max_pending:
+                break
+        while pending:
+            tnp = pending.popleft().result()
+            for fpath in path_iter: #keep the pool busy
+                pending.append(pool.submit(_read_touchstone_raw,fpath))
+                break
+            yield tnp
+    finally:
+        for future in pending:
+            future.cancel()
+        if pool is not executor:
+            pool.shutdown(wait=True)
+
+def calculate_statistics_streaming(data,confidence_interval=95,**kwargs):
+    '''
+    @brief calculate the estimate, confidence interval, and standard uncertainty like calculate_statistics
+        while only holding a few values at a time (see StreamingStatistics)
+    @param[in] data - list of file paths (read one at a time) or loaded TouchstoneEditors/TouchstoneArrays
+    @param[in/OPT] confidence_interval - confidence interval percentage (default 95)
+    @param[in/OPT] kwargs - keyword arguments as follows
+        - quantile_method - 'auto', 'p2', or 'tails' (default 'auto'. see StreamingStatistics)
+        - n_workers - number of workers to read the files (default 1)
+        - executor - 'thread' or 'process' pool or a running concurrent.futures.Executor (default 'thread')
+    @note the mean and standard deviation match calculate_statistics to rounding. The confidence interval
+        is exact with quantile_method='tails' and an estimate with 'p2'
+    @return dictionary with 'estimate':TouchstoneEditor,'confidence_interval':(upper,lower) TouchstoneEditors,
+        and 'standard_uncertainty':(+,-) TouchstoneEditors
+    '''
+    options = {}
+    options['quantile_method'] = 'auto'
+    options['n_workers'] = 1
+    options['executor'] = 'thread'
+    for k,v in kwargs.items():
+        options[k] = v
+    paths = [d for d in data if isinstance(d,str)]
+    tnp_iter = iter_touchstone_files(paths,n_workers=options['n_workers'],executor=options['executor'])
+    acc = StreamingStatistics(len(data),confidence_interval,options['quantile_method'])
+    template = None
+    try:
+        for d in data:
+            tnp = next(tnp_iter) if isinstance(d,str) else d #files are read in the same order as data
+            acc.update(tnp.raw)
+            if template is None: #keep the first for the ports and frequencies
+                template = TouchstoneArray.from_editor(tnp)
+    finally:
+        tnp_iter.close()
+    out = {}
+    for name,values in acc.get_statistics().items():
+        out[name] = tuple([_create_editor_from_array(template,v) for v in values]) if isinstance(values,tuple) else _create_editor_from_array(template,values)
+    return out
+
+def _create_editor_from_array(template,values):
+    '''@brief create a TouchstoneEditor with the ports and frequencies of a TouchstoneArray and the given values'''
+    template.raw = values
+    return template.to_editor(copy=True)
+
 #%% Operation Function (e.g. FFT) with uncerts
 def calculate_time_domain(fd_w_uncert,key=21,window=None,verbose=False):
     '''
@@ -271,10 +602,17 @@ class MUFResult(MUFModuleController):
     ### Data editing and statistics functions. only operates on loaded data
     ##########################################################################
         
-    def calculate_statistics(self):
-        '''@brief calculate statistics for monte carlo and perturbed data'''
-        self.monte_carlo.calculate_statistics()
-        self.perturbed.calculate_statistics()
+    def calculate_statistics(self,**kwargs):
+        '''
+        @brief calculate statistics for monte carlo and perturbed data
+        @param[in/OPT] kwargs - passed to MUFStatistic.calculate_statistics (e.g. streaming=True)
+        '''
+        options = {}
+        options['working_directory'] = self.working_directory if self.meas_path is not None else ''
+        for k,v in kwargs.items():
+            options[k] = v
+        self.monte_carlo.calculate_statistics(**options)
+        self.perturbed.calculate_statistics(**options)
         
     def run_touchstone_function(self,funct_name,*args,**kwargs):
         '''
@@ -680,24 +1018,38 @@ class MUFStatistic(MUFItemList):
     ###################################################
     ### Statistics Operations
     ###################################################        
-    def calculate_statistics(self):
+    def calculate_statistics(self,**kwargs):
         '''
         @brief Calculate and store all statistics. If self.data has been loaded use that, 
             otherwise load the data.
+        @param[in/OPT] kwargs - keyword arguments as follows
+            - streaming - read one file at a time instead of loading all of the data (default False).
+                Data that is already loaded is used. See calculate_statistics_streaming
+            - working_directory - root point for relative paths when streaming (default '')
+            - | - The rest are passed to calculate_statistics_streaming (e.g. quantile_method,n_workers)
         '''
+        options = {}
+        options['streaming'] = False
+        options['working_directory'] = ''
+        for k,v in kwargs.items():
+            options[k] = v
         if len(self.file_paths) > 2: #make sure we have enough to make a statistic
-            if not self.data or self.data[0] is None:
-                self.load_data()
-            tnp_list = self.data
-            data = self.data
+            if options.pop('streaming'):
+                wdir = options.pop('working_directory')
+                data = [it.data if it.data is not None else it.get_filepath(working_directory=wdir) for it in self.muf_items]
+                stats = calculate_statistics_streaming(data,confidence_interval=self.options['ci_percentage'],**options)
+            else:
+                if not self.data or self.data[0] is None:
+                    self.load_data()
+                stats = calculate_statistics(self.data,confidence_interval=self.options['ci_percentage'])
             #estimate
-            self.estimate = self._calculate_estimate(data)
+            self.estimate = stats['estimate']
             #confidence interval
-            ciu,cil = self._calculate_confidence_interval(data)
+            ciu,cil = stats['confidence_interval']
             self.confidence_interval['+'] = ciu
             self.confidence_interval['-'] = cil
             #and standard uncertainty
-            suu,sul = self._calculate_standard_uncertainty(data)
+            suu,sul = stats['standard_uncertainty']
             self.standard_uncertainty['+'] = suu
             self.standard_uncertainty['-'] = sul
         
@@ -740,31 +1092,6 @@ class MUFStatistic(MUFItemList):
         stm = self.standard_uncertainty['-'].S[key].get_value_from_frequency(freq)
         return est,cip,cim,stp,stm        
     
-    def _calculate_estimate(self,data):
-        '''
-        @brief calculate the estimate from the input values (mean of the values)
-        @param[in] data - list of touchstone editor data
-        @return WnpEditor object with the estimate (mean) of the stats_path values
-        '''
-        return calculate_estimate(data)
-            
-    def _calculate_confidence_interval(self,data):
-        '''
-        @brief calculate the n% confidence interval where n is self.options['ci_percentage']
-            this will calculate both the upper and lower intervals
-        @param[in] data - list of touchstone editor data
-        @return WnpEditor objects for upper(+),lower(-) intervals
-        '''
-        return calculate_confidence_interval(data,confidence_interval=self.options['ci_percentage'])
-    
-    def _calculate_standard_uncertainty(self,data):
-        '''
-        @brief calculate standard uncertainty (standard deviation)
-        @param[in] data - list of touchstone editor data
-        @return WnpEditor objects for upper(+),lower(-) uncerts
-        '''
-        return calculate_standard_uncertainty(data)
-    
     def _complex2magphase(self,data):
         return complex2magphase(data)
     
@@ -874,6 +1201,68 @@ class TestMUFResult(unittest.TestCase):
         res = MUFResult(meas_path,load_nominal=True,load_statistics=True)
         res.calculate_statistics()
         
+    def test_statistics_values(self):
+        '''@brief the single pass statistics should match sorting the magnitude and phase of each key like the MUF'''
+        mc_dir = os.path.join(self.unittest_dir,'meas_test/MonteCarlo')
+        data = [SnpEditor(os.path.join(mc_dir,f)) for f in sorted(os.listdir(mc_dir))]
+        for ci in [95,68,99.9]:
+            stats = calculate_statistics(data,ci)
+            lo_index,hi_index = get_confidence_interval_indices(len(data),ci)
+            for k in data[0].wave_dict_keys:
+                m,p = complex2magphase(np.array([tnp.S[k].raw for tnp in data]))
+                np.testing.assert_array_equal(stats['estimate'].S[k].raw,magphase2complex(m.mean(0),p.mean(0)))
+                np.testing.assert_array_equal(stats['standard_uncertainty'][1].S[k].raw,magphase2complex(m.mean(0)-m.std(0),p.mean(0)-p.std(0)))
+                m.sort(0); p.sort(0)
+                np.testing.assert_array_equal(stats['confidence_interval'][0].S[k].raw,magphase2complex(m[hi_index],p[hi_index]))
+                np.testing.assert_array_equal(stats['confidence_interval'][1].S[k].raw,magphase2complex(m[lo_index],p[lo_index]))
+        #the MUFStatistic and the separate functions should match
+        res = MUFResult()
+        for tnp in data:
+            res.monte_carlo.add_item(tnp)
+        res.monte_carlo.calculate_statistics()
+        self.assertEqual(res.monte_carlo.estimate,calculate_estimate(data))
+        self.assertEqual(res.monte_carlo.confidence_interval['+'],calculate_confidence_interval(data)[0])
+        self.assertEqual(res.monte_carlo.standard_uncertainty['-'],calculate_standard_uncertainty(data)[1])
+        
+    def test_statistics_streaming(self):
+        '''@brief statistics calculated one file at a time should match loading all of the data'''
+        mc_dir = os.path.join(self.unittest_dir,'meas_test/MonteCarlo')
+        mc_paths = [os.path.join(mc_dir,f) for f in sorted(os.listdir(mc_dir))]
+        data = [SnpEditor(p) for p in mc_paths]
+        for ci in [95,68]:
+            stats = calculate_statistics(data,ci)
+            for sdata,n_workers in [(mc_paths,1),(mc_paths,2),(data,1)]:
+                sstats = calculate_statistics_streaming(sdata,ci,n_workers=n_workers)
+                self.assertIsInstance(sstats['estimate'],SnpEditor)
+                self.assertEqual(sstats['estimate'].freq_list.tolist(),stats['estimate'].freq_list.tolist())
+                np.testing.assert_allclose(sstats['estimate'].raw,stats['estimate'].raw,rtol=1e-10,atol=0)
+                for i in range(2): #exact confidence interval and standard uncertainty to rounding
+                    np.testing.assert_array_equal(sstats['confidence_interval'][i].raw,stats['confidence_interval'][i].raw)
+                    np.testing.assert_allclose(sstats['standard_uncertainty'][i].raw,stats['standard_uncertainty'][i].raw,rtol=1e-8,atol=1e-12)
+        #streaming through the *.meas file
+        meas_path = os.path.join(self.unittest_dir,'meas_test.meas')
+        res = MUFResult(meas_path,load_nominal=False,load_statistics=False)
+        res.calculate_statistics(streaming=True,n_workers=2)
+        self.assertIsNone(res.monte_carlo.muf_items[0].data) #nothing was loaded
+        np.testing.assert_array_equal(res.monte_carlo.confidence_interval['-'].raw,calculate_confidence_interval(data)[1].raw)
+        #P-squared estimate of the interval of well behaved data and merging running means
+        rng = np.random.default_rng(1)
+        vals = (1+0.1*rng.standard_normal((1000,20,4)))*np.exp(0.2j*rng.standard_normal((1000,20,4)))
+        acc = StreamingStatistics(len(vals),quantile_method='p2')
+        for v in vals:
+            acc.update(v)
+        with self.assertRaises(ValueError):
+            acc.update(vals[0])
+        sstats = acc.get_statistics()
+        stats = calculate_statistics_from_array(vals)
+        for i in range(2):
+            np.testing.assert_allclose(np.abs(sstats['confidence_interval'][i]),np.abs(stats['confidence_interval'][i]),atol=0.05)
+        wa,wb = WelfordAccumulator(vals.shape[1:]),WelfordAccumulator(vals.shape[1:])
+        for v in vals[:300]: wa.update(np.abs(v))
+        for v in vals[300:]: wb.update(np.abs(v))
+        wa.merge(wb)
+        np.testing.assert_allclose(wa.std,np.abs(vals).std(0),rtol=1e-10)
+        
 class TestUncertaintyOperations(unittest.TestCase):
     '''@brief test operations on data with uncertainty'''
     wdir = os.path.dirname(__file__)
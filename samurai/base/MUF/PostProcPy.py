@@ -33,7 +33,7 @@ class PostProcPy(MUFModuleController):
     def __init__(self,menu_path=None,exe_path=None,**kwargs):
         '''@brief Constructor'''
         kwargs_out = {} #kwargs to pass to mufmodulecontroller superclass
-        kwargs_out['exe_path'] = DEFAULT_POST_PROCESSOR_EXE_PATH
+        kwargs_out['exe_path'] = DEFAULT_POST_PROCESSOR_EXE_PATH if exe_path is None else exe_path
         for k,v in kwargs.items():
             kwargs_out[k] = v
         super().__init__(menu_path,**kwargs_out) # run mmc initialize
@@ -12,7 +12,7 @@ from samurai.base.generic import get_name_from_path
 from samurai.base.generic import ProgressCounter
 from samurai.base.SamuraiDict import SamuraiDict
 from samurai.base.MUF.MUFResult import MUFResult,mufPathFind
-from samurai.base.MUF.MUFResult import calculate_confidence_interval,calculate_estimate,calculate_standard_uncertainty
+from samurai.base.MUF.MUFResult import calculate_statistics
 
 import shutil
 import getpass
@@ -652,16 +652,16 @@ class SamMeasStatistic(list):
         if len(self.file_paths) > 2: #make sure we have enough to make a statistic
             if not self.data or self.data[0] is None:
                 self.load_data()
-            tnp_list = self.data
             data = self.data
+            stats = calculate_statistics(data)
             #estimate
-            self.estimate = calculate_estimate(data)
+            self.estimate = stats['estimate']
             #confidence interval
-            ciu,cil = calculate_confidence_interval(data)
+            ciu,cil = stats['confidence_interval']
             self.confidence_interval['+'] = ciu
             self.confidence_interval['-'] = cil
             #and standard uncertainty
-            suu,sul = calculate_standard_uncertainty(data)
+            suu,sul = stats['standard_uncertainty']
             self.standard_uncertainty['+'] = suu
             self.standard_uncertainty['-'] = sul
         
@@ -9,12 +9,19 @@ import numpy as np
 import pandas as pd
 import copy
 import re
+import json
+import hashlib
+import zipfile
+import tempfile
+import threading
 import operator
-from functools import reduce
+import bisect
+from functools import reduce,lru_cache
 from xml.dom.minidom import parse 
 import warnings
 
 from samurai.base.SamuraiDict import SamuraiDict
+from samurai.base.CompressedFrames import FrameWriter,FrameReader,FRAME_MAGIC
 
 from samurai.base.generic import deprecated
 from samurai.base.generic import moving_average
@@ -48,17 +55,25 @@ import typing
 CVECTOR_T = typing.Iterable[complex]
 
 #%% Some useful functions
+_unperturbed_meas_paths = {} #{absolute *.meas path:(get_file_key,nominal path)} so each file is only parsed once
+
 def get_unperturbed_meas(fname):
     '''
     @brief get the path of the unperturbed (nominal) measurement from a *.meas file
     @param[in] fname - path to the *.meas file
+    @note the path is kept for each file and the file is only parsed again if its size or modification time change
     '''
+    key = get_file_key(fname)
+    cached = _unperturbed_meas_paths.get(key[0],None)
+    if cached is not None and cached[0]==key:
+        return cached[1]
     wdir = os.path.dirname(fname)
     dom = parse(fname)
     msp = dom.getElementsByTagName('MeasSParams').item(0)
     unpt = msp.getElementsByTagName('Item').item(0)
     unpt_name = unpt.getElementsByTagName('SubItem').item(1).getAttribute('Text')
     unpt_path = os.path.join(wdir,unpt_name)
+    _unperturbed_meas_paths[key[0]] = (key,unpt_path)
     return unpt_path
 
 def swap_ports(*args,**kwargs):
@@ -327,6 +342,45 @@ class MultilineFileParser(object):
             raise StopIteration()
             
 #%% IO Functions for touchstone files
+def get_freq_mult(header_str):
+    '''
+    @brief return a value of a frequency multiplier from a header (or string unit)  
+    @param[in] header_str - header to get multiplier from (e.g. 'GHz S RI 50')  
+    @return a multiplier to get from the current units to Hz or None if no match is found  
+    '''
+    unit_strs = re.findall(HEADER_REGEX,header_str)[0]
+    if unit_strs:
+        mult = MULT_DICT.get(unit_strs[0].upper(),None) #assume 1 match if any
+    else:
+        mult = None
+    return mult
+
+TEXT_COMMENT_LINE_REGEX = re.compile(r'^[ \t]*([#!])(.*\n?)',re.MULTILINE) #full comment and header lines
+TEXT_COMMENT_REGEX      = re.compile(r'[#!][^\n]*') #comments anywhere (including end of line)
+TEXT_DATA_LINE_REGEX    = re.compile(r'\S[^\n]*') #non-empty lines
+TEXT_VALUE_REGEX        = re.compile(r'\S+') #a single value
+TEXT_DELIMITER_TABLE    = str.maketrans(',|\t','   ') #all delimiters to spaces
+
+def iter_text_records(text,lines_per_record=1):
+    '''
+    @brief iterate over the first value of each record in the data of a text file
+    @param[in] text - data of the file (comments removed and delimiters changed to spaces)
+    @param[in/OPT] lines_per_record - number of non-empty lines in each record (e.g. 4 for many *.s4p files)
+    @note only the first value of each line is looked at so this is much faster than parsing all of the data
+    @return generator of re.Match of the first value of each record (match.start() is the start of the record)
+    '''
+    pos = 0
+    line_num = 0
+    while pos<len(text):
+        line_end = text.find('\n',pos)
+        line_end = len(text) if line_end<0 else line_end
+        match = TEXT_VALUE_REGEX.search(text,pos,line_end)
+        if match is not None: #skip empty lines
+            if not line_num%lines_per_record:
+                yield match
+            line_num += 1
+        pos = line_end+1
+
 def read_text_touchstone(file_path,**kwargs):
     '''
     @brief Load snp/wnp file data to a table (just like the data is stored in the file)
@@ -334,46 +388,502 @@ def read_text_touchstone(file_path,**kwargs):
     @param[in/OPT] kwargs - keyword args as follows:  
         - read_header - Whether or not to read the header and comments in text files.
                         It is faster to not read the header/comments  
-    @return Dictionary with elements {'data':raw_data,'header':header_string,'comments':['list','of','comments']}
+        - freq_range - (lo,hi) only return rows with lo<=frequency<=hi in Hz (default None for all).
+                       Parsing stops at the first record above hi (frequencies must be increasing)  
+        - header_only - only return the frequency column. The other values are not parsed (default False)  
+    @note The file is read once and the numeric data is converted in bulk. Records split across 
+        multiple lines (e.g. *.s4p) are detected from the number of values on the first data lines
+    @return Dictionary with elements {'data':raw_data,'header':header_string,'comments':['list','of','comments'],
+        'num_cols':number of columns in the file}. With header_only, data is a (frequency x 1) array
     '''
-    #first read in comments
+    with open(file_path,'r') as fp:
+        text = fp.read()
+    #split off the block of comments and header at the start of the file
+    body_start = 0
+    while body_start<len(text):
+        line_end = text.find('\n',body_start)
+        line_end = len(text) if line_end<0 else line_end
+        line = text[body_start:line_end].lstrip()
+        if line and line[0] not in '#!': #first data line
+            break
+        body_start = line_end+1
+    comment_blocks = [text[:body_start]]
+    text = text[body_start:]
+    if '!' in text or '#' in text: #comments in the data (rare)
+        comment_blocks.append(text)
+        text = TEXT_COMMENT_REGEX.sub('',text)
+    #now get the comments and header
     comments = []
     header = DEFAULT_HEADER
     if(kwargs.get('read_header',None)): #flag for reading header for speed
-         with open(file_path,'r') as fp: 
-             for line in fp:
-                 if len(line.strip()):
-                     if(line.strip()[0]=='#'):
-                         header = line
-                         #self.set_header(line) #try and set it. If its not valid it wont be set
-                     elif(line.strip()[0]=='!'):
-                         comments.append(line.strip()[1:])
-                     else: #else its data
-                         pass     
+        for block in comment_blocks:
+            for line_type,line in TEXT_COMMENT_LINE_REGEX.findall(block):
+                if line_type=='#':
+                    header = '#'+line
+                else:
+                    comments.append(line.rstrip())
     else: #dont read comments
-         comments.append('Header and comments NOT read from file')
-    #now read in data from the file with many possible delimiters in cases
-    #of badly formated files
-    fp = MultilineFileParser(file_path)
-    regex_str = r'[ ,|\t]+'
-    rc = re.compile(regex_str)
-    raw_data = np.loadtxt((rc.sub(' ',l) for l in fp),comments=['#','!']) 
-    if raw_data.ndim==1: #case if we have 1 data point only
-        raw_data = np.reshape(raw_data,(1,-1))
-    return {'data':raw_data,'header':header,'comments':comments}
+        comments.append('Header and comments NOT read from file')
+    #change the many possible delimiters of badly formatted files to spaces
+    if ',' in text or '|' in text or '\t' in text:
+        text = text.translate(TEXT_DELIMITER_TABLE)
+    #find the number of values in each record from the first data lines
+    line_iter = (len(m.group().split()) for m in TEXT_DATA_LINE_REGEX.finditer(text))
+    first_line_cols = next(line_iter,0)
+    num_cols = first_line_cols
+    lines_per_record = 1
+    for line_cols in line_iter:
+        if line_cols==first_line_cols: #start of the next record
+            break
+        num_cols += line_cols
+        lines_per_record += 1
+    if num_cols<1:
+        raise MalformedSnpError("No data found in {}".format(file_path))
+    freq_range = kwargs.get('freq_range',None)
+    if kwargs.get('header_only',False) or freq_range is not None:
+        #only look at the first value of each record
+        record_iter = iter_text_records(text,lines_per_record)
+        if kwargs.get('header_only',False):
+            freqs = np.array([float(m.group()) for m in record_iter])
+            if freq_range is not None:
+                freqs = freqs[get_freq_range_slice(freqs,freq_range,header)]
+            return {'data':freqs[:,np.newaxis],'header':header,'comments':comments,'num_cols':num_cols}
+        lo,hi = np.divide(freq_range,get_freq_mult(header))
+        start = stop = len(text)
+        for m in record_iter:
+            freq = float(m.group())
+            if start==len(text) and freq>=lo:
+                start = m.start()
+            if freq>hi: #stop early
+                stop = m.start()
+                break
+        text = text[start:stop]
+    #now convert all of the data at once
+    with warnings.catch_warnings():
+        warnings.simplefilter('error',DeprecationWarning) #raised when the data cannot be fully parsed
+        try:
+            raw_data = np.fromstring(text,dtype=np.float64,sep=' ')
+        except DeprecationWarning:
+            raise MalformedSnpError("Could not parse the data in {}".format(file_path))
+    if raw_data.size%num_cols:
+        raise MalformedSnpError("{} values in {} do not fill records of {} values".format(raw_data.size,file_path,num_cols))
+    raw_data = raw_data.reshape((-1,num_cols))
+    return {'data':raw_data,'header':header,'comments':comments,'num_cols':num_cols}
+
+def get_freq_range_slice(freqs,freq_range,header=DEFAULT_HEADER):
+    '''
+    @brief get the rows of a frequency list inside a range
+    @param[in] freqs - increasing frequencies in the units of header. This can be any sequence
+        (e.g. a memory mapped column) and only about log2(len(freqs)) values are accessed
+    @param[in] freq_range - (lo,hi) range of frequencies to include in Hz (inclusive)
+    @param[in/OPT] header - header of the file for the units of freqs (default GHz)
+    @return slice of the rows inside the range
+    '''
+    lo,hi = np.divide(freq_range,get_freq_mult(header))
+    return slice(bisect.bisect_left(freqs,lo),bisect.bisect_right(freqs,hi))
         
-def read_binary_touchstone(file_path):
+BINARY_HEADER_BYTES = 8 #[num_rows,num_cols] as uint32 before the float64 data (or FRAME_MAGIC if compressed)
+BINARY_CHUNK_ROWS = 256 #rows in each compressed frame of a compressed binary file
+
+def read_binary_touchstone(file_path,memmap=False,freq_range=None,header_only=False):
     '''
     @brief Function to load binary snp/wnp file  
     @param[in] file_path - path of binary file to load  
-    @param[in/OPT] kwargs - keyword args as follows:  
+    @param[in/OPT] memmap - memory map the data instead of reading it. Only the pages that are
+        accessed are read from disk. The map is copy-on-write so changing the data never changes the file
+    @param[in/OPT] freq_range - (lo,hi) only return rows with lo<=frequency<=hi in Hz (default None for all).
+        The rows are found with a binary search of the frequencies and then only those rows are read
+    @param[in/OPT] header_only - only return the frequency column (default False)
+    @note compressed files (see write_binary_touchstone) are read with read_compressed_binary_touchstone
+        and are never memory mapped
+    @return Dictionary with elements {'data':raw_data,'header':header_string,'comments':['list','of','comments'],
+        'num_cols':number of columns in the file}. With header_only, data is a (frequency x 1) array
     '''
-    [num_rows,num_cols] = np.fromfile(file_path,dtype=np.uint32,count=2) 
-    raw_data = np.fromfile(file_path,dtype=np.float64) #read raw data
-    raw_data = raw_data[1:] #remove header
-    raw_data = raw_data.reshape((num_rows,num_cols)) #match the text output
+    with open(file_path,'rb') as fp:
+        header_bytes = fp.read(BINARY_HEADER_BYTES)
+        if header_bytes==FRAME_MAGIC:
+            return read_compressed_binary_touchstone(file_path,freq_range=freq_range,header_only=header_only)
+        [num_rows,num_cols] = np.frombuffer(header_bytes,dtype=np.uint32)
+        num_rows,num_cols = int(num_rows),int(num_cols)
+        data_bytes = os.fstat(fp.fileno()).st_size-BINARY_HEADER_BYTES
+        if data_bytes!=num_rows*num_cols*8:
+            raise MalformedSnpError("Size of {} does not match {}x{} values in the header".format(file_path,num_rows,num_cols))
+        rows = slice(0,num_rows)
+        if (header_only or freq_range is not None) and num_rows:
+            file_freqs = np.memmap(fp,dtype=np.float64,mode='r',offset=BINARY_HEADER_BYTES,shape=(num_rows,num_cols))[:,0]
+            if freq_range is not None:
+                rows = get_freq_range_slice(file_freqs,freq_range,DEFAULT_HEADER)
+            if header_only:
+                raw_data = np.array(file_freqs[rows])[:,np.newaxis]
+            del file_freqs
+        if header_only and not num_rows:
+            raw_data = np.empty((0,1))
+        elif not header_only:
+            num_read = max(rows.stop-rows.start,0)
+            offset = BINARY_HEADER_BYTES+rows.start*num_cols*8
+            if memmap and num_read:
+                raw_data = np.asarray(np.memmap(fp,dtype=np.float64,mode='c',offset=offset,shape=(num_read,num_cols)))
+            else:
+                fp.seek(offset)
+                raw_data = np.fromfile(fp,dtype=np.float64,count=num_read*num_cols).reshape((num_read,num_cols)) #match the text output
     comments = ['Data read from binary file']
-    return {'data':raw_data,'header':DEFAULT_HEADER,'comments':comments}
+    return {'data':raw_data,'header':DEFAULT_HEADER,'comments':comments,'num_cols':num_cols}
+
+def read_compressed_binary_touchstone(file_path,freq_range=None,header_only=False):
+    '''
+    @brief Function to load a compressed binary snp/wnp file. The frequencies are stored in their own frame
+        and the data in frames of rows so only the frames of the requested frequencies are decompressed
+    @param[in] file_path - path of binary file to load  
+    @param[in/OPT] freq_range - (lo,hi) only return rows with lo<=frequency<=hi in Hz (default None for all)
+    @param[in/OPT] header_only - only return the frequency column. No data frames are decompressed (default False)
+    @return Dictionary like read_binary_touchstone
+    '''
+    reader = FrameReader(file_path,cache_frames=1)
+    num_rows,num_cols,chunk_rows = [reader.info[k] for k in ['num_rows','num_cols','chunk_rows']]
+    file_freqs = reader.read_frame(0)
+    rows = slice(0,num_rows)
+    if freq_range is not None and num_rows:
+        rows = get_freq_range_slice(file_freqs,freq_range,DEFAULT_HEADER)
+    num_read = max(rows.stop-rows.start,0)
+    if header_only:
+        raw_data = np.array(file_freqs[rows])[:,np.newaxis]
+    else:
+        raw_data = np.empty((num_read,num_cols),dtype=np.float64)
+        raw_data[:,0] = file_freqs[rows]
+        for ci in range(rows.start//chunk_rows,-(-rows.stop//chunk_rows) if num_read else 0):
+            chunk = reader.read_frame(ci+1)
+            lo,hi = max(rows.start,ci*chunk_rows),min(rows.stop,(ci+1)*chunk_rows)
+            raw_data[lo-rows.start:hi-rows.start,1:] = chunk[lo-ci*chunk_rows:hi-ci*chunk_rows]
+    comments = ['Data read from compressed binary file']
+    return {'data':raw_data,'header':DEFAULT_HEADER,'comments':comments,'num_cols':num_cols}
+
+@lru_cache(maxsize=None)
+def get_column_index(waves,keys):
+    '''
+    @brief get the column index for a TouchstoneEditor. The waves alternate for each key like the data in the file.
+        These are cached because building a MultiIndex is slow compared to loading small files
+    @param[in] waves - tuple of waves (e.g. ('A','B'))
+    @param[in] keys - tuple of keys (e.g. (11,21,12,22))
+    @return pandas MultiIndex of (wave,key) columns
+    '''
+    wave_column_list = list(waves)*len(keys)
+    key_column_list = np.repeat(keys,len(waves))
+    return pd.MultiIndex.from_arrays([wave_column_list,key_column_list])
+
+#%% On disk cache of parsed text files
+TOUCHSTONE_CACHE_ENV = 'SAMURAI_TOUCHSTONE_CACHE' #environment variable of the default cache directory
+TOUCHSTONE_CACHE_EXTENSION = '.npz'
+DEFAULT_CACHE_MAX_BYTES = 2*1024**3 #2 GB
+
+class TouchstoneCache(object):
+    '''
+    @brief On disk cache of parsed text touchstone files. Each file is stored as a binary *.npz entry
+        named from the hash of its absolute path. An entry is only used if the absolute path, size, and 
+        modification time of the file match when it was parsed. Entries are evicted least recently used first
+        (by the modification time of the entry which is updated on each hit) when the cache is larger than max_bytes
+    @param[in] cache_dir - directory to store the cache in (created if it does not exist)
+    @param[in/OPT] max_bytes - maximum size of the cache in bytes (default 2 GB)
+    @note entries are written to a temporary file and moved into place so multiple threads or processes
+        can share a cache directory
+    @example
+        # use a cache for all text files read by TouchstoneEditor
+        set_touchstone_cache('path/to/cache',max_bytes=4*1024**3)
+        
+        # or only for a single file
+        snp = SnpEditor('path/to/file.s2p',cache=TouchstoneCache('path/to/cache'))
+    '''
+    def __init__(self,cache_dir,max_bytes=DEFAULT_CACHE_MAX_BYTES):
+        '''@brief constructor'''
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir,exist_ok=True)
+        self._size = None #running estimate of the size of the cache so we dont list the directory each write
+        self._size_lock = threading.RLock() #threads sharing the cache update the size together
+        
+    def read_text_touchstone(self,file_path,**kwargs):
+        '''
+        @brief cached version of read_text_touchstone. Files are parsed (with the header) and added on a miss
+        @param[in] file_path - path of text file to load  
+        @param[in/OPT] kwargs - keyword args passed to read_text_touchstone (read_header)
+        @return Dictionary with elements {'data':raw_data,'header':header_string,'comments':['list','of','comments']}
+        '''
+        key = get_file_key(file_path)
+        loaded_data = self.get(file_path,key)
+        if loaded_data is None:
+            loaded_data = read_text_touchstone(file_path,read_header=True)
+            self.put(file_path,loaded_data,key)
+        if not kwargs.get('read_header',None): #match read_text_touchstone without the header
+            loaded_data.update({'header':DEFAULT_HEADER,'comments':['Header and comments NOT read from file']})
+        return loaded_data
+    
+    def get(self,file_path,key=None):
+        '''
+        @brief get the parsed data of a file from the cache
+        @param[in] file_path - path of the file
+        @param[in/OPT] key - key of the file from get_file_key (default calculates it)
+        @return Dictionary like read_text_touchstone or None if the file is not cached or has changed
+        '''
+        if key is None:
+            key = get_file_key(file_path)
+        entry_path = self.get_entry_path(file_path)
+        try:
+            with np.load(entry_path,allow_pickle=False) as entry:
+                meta = json.loads(str(entry['meta']))
+                if meta['key']!=key:
+                    return None
+                raw_data = entry['data']
+        except (OSError,ValueError,KeyError,zipfile.BadZipFile): #missing or broken entry
+            return None
+        try:
+            os.utime(entry_path) #mark as recently used
+        except OSError: #evicted by someone else
+            pass
+        return {'data':raw_data,'header':meta['header'],'comments':meta['comments']}
+    
+    def put(self,file_path,loaded_data,key=None):
+        '''
+        @brief add the parsed data of a file to the cache and evict old entries if needed
+        @param[in] file_path - path of the file
+        @param[in] loaded_data - dictionary from read_text_touchstone
+        @param[in/OPT] key - key of the file from get_file_key when it was parsed (default calculates it)
+        @return path to the entry
+        '''
+        if key is None:
+            key = get_file_key(file_path)
+        entry_path = self.get_entry_path(file_path)
+        meta = {'key':key,'header':loaded_data['header'],'comments':loaded_data['comments']}
+        fd,tmp_path = tempfile.mkstemp(suffix='.tmp',dir=self.cache_dir) #unique for each thread and process
+        try:
+            with os.fdopen(fd,'wb') as fp:
+                np.savez(fp,data=loaded_data['data'],meta=np.array(json.dumps(meta)))
+            entry_size = os.path.getsize(tmp_path)
+            os.replace(tmp_path,entry_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        with self._size_lock:
+            if self._size is None:
+                self._size = self.size
+            else:
+                self._size += entry_size
+            if self._size>self.max_bytes:
+                self.evict()
+        return entry_path
+    
+    def warm(self,file_paths):
+        '''
+        @brief parse and add any text files that are not already in the cache
+        @param[in] file_paths - list of paths to the files. Binary files are skipped
+        @return number of files that were parsed
+        '''
+        num_parsed = 0
+        for file_path in file_paths:
+            if file_path.split('_')[-1]=='binary':
+                continue
+            key = get_file_key(file_path)
+            if self.get(file_path,key) is None:
+                self.put(file_path,read_text_touchstone(file_path,read_header=True),key)
+                num_parsed += 1
+        return num_parsed
+    
+    def evict(self,max_bytes=None):
+        '''
+        @brief remove the least recently used entries until the cache is smaller than max_bytes
+        @param[in/OPT] max_bytes - size to reduce the cache to (default self.max_bytes)
+        @return number of entries removed
+        '''
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+        with self._size_lock:
+            entries = sorted(self._get_entry_stats(),key=lambda e: e[1].st_mtime_ns)
+            self._size = sum([st.st_size for _,st in entries])
+            num_removed = 0
+            for entry_path,st in entries:
+                if self._size<=max_bytes:
+                    break
+                try:
+                    os.remove(entry_path)
+                except OSError: #already removed
+                    pass
+                self._size -= st.st_size
+                num_removed += 1
+        return num_removed
+    
+    def clear(self):
+        '''@brief remove all entries from the cache'''
+        return self.evict(0)
+    
+    @property
+    def size(self):
+        '''@brief size of all of the entries in bytes'''
+        return sum([st.st_size for _,st in self._get_entry_stats()])
+    
+    def __len__(self):
+        '''@brief number of entries in the cache'''
+        return len(self._get_entry_stats())
+    
+    def get_entry_path(self,file_path):
+        '''@brief get the path of the cache entry for a file'''
+        name = hashlib.sha1(os.path.abspath(file_path).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir,name+TOUCHSTONE_CACHE_EXTENSION)
+    
+    def _get_entry_stats(self):
+        '''@brief get a list of (path,os.stat_result) of all of the entries'''
+        stats = []
+        for de in os.scandir(self.cache_dir):
+            if de.name.endswith(TOUCHSTONE_CACHE_EXTENSION):
+                try:
+                    stats.append((de.path,de.stat()))
+                except OSError: #removed while listing
+                    pass
+        return stats
+    
+def get_file_key(file_path):
+    '''
+    @brief get the key used to check if a cached file has changed
+    @param[in] file_path - path of the file
+    @return [absolute path,size in bytes,modification time in ns]
+    '''
+    st = os.stat(file_path)
+    return [os.path.abspath(file_path),st.st_size,st.st_mtime_ns]
+
+_touchstone_cache = None #default cache for all TouchstoneEditors
+
+def set_touchstone_cache(cache_dir,max_bytes=DEFAULT_CACHE_MAX_BYTES):
+    '''
+    @brief set the default cache of parsed text files used when reading TouchstoneEditors
+    @param[in] cache_dir - directory of the cache. None disables the default cache
+    @param[in/OPT] max_bytes - maximum size of the cache in bytes (default 2 GB)
+    @note the default cache can also be set with the SAMURAI_TOUCHSTONE_CACHE environment variable.
+        This is also seen by process pools that do not fork (e.g. on Windows)
+    @return the TouchstoneCache (or None)
+    '''
+    global _touchstone_cache
+    _touchstone_cache = False if cache_dir is None else TouchstoneCache(cache_dir,max_bytes)
+    return get_touchstone_cache()
+
+def get_touchstone_cache():
+    '''
+    @brief get the default cache of parsed text files (see set_touchstone_cache)
+    @return the TouchstoneCache or None if there is no default cache
+    '''
+    global _touchstone_cache
+    if _touchstone_cache is None: #check the environment the first time
+        cache_dir = os.environ.get(TOUCHSTONE_CACHE_ENV,None)
+        _touchstone_cache = TouchstoneCache(cache_dir) if cache_dir else False
+    return _touchstone_cache if isinstance(_touchstone_cache,TouchstoneCache) else None
+
+#%% Reading and writing the data tables of files
+def read_touchstone(file_path,ftype=None,read_header=True,memmap=False,cache=None,freq_range=None,header_only=False):
+    '''
+    @brief read the table of data from a text or binary snp/wnp file
+    @param[in] file_path - path of the file to load
+    @param[in/OPT] ftype - 'text' or 'binary'. Default None uses the extension (e.g. *.s2p_binary)
+    @param[in/OPT] read_header - whether or not to read the header and comments in text files
+    @param[in/OPT] memmap - whether or not to memory map binary files
+    @param[in/OPT] cache - TouchstoneCache for text files. None uses get_touchstone_cache() and False disables
+    @param[in/OPT] freq_range - (lo,hi) only return rows with lo<=frequency<=hi in Hz (default None for all)
+    @param[in/OPT] header_only - only return the frequency column (default False)
+    @return Dictionary with elements {'data':raw_data,'header':header_string,'comments':['list','of','comments'],
+        'num_cols':number of columns in the file}
+    '''
+    if ftype is None:
+        ftype = 'binary' if file_path.split('_')[-1]=='binary' else 'text'
+    if ftype=='binary':
+        return read_binary_touchstone(file_path,memmap=memmap,freq_range=freq_range,header_only=header_only)
+    if cache is None:
+        cache = get_touchstone_cache()
+    if isinstance(cache,TouchstoneCache): #the full file is cached so just select from it
+        loaded_data = cache.read_text_touchstone(file_path,read_header=read_header)
+        raw_data = loaded_data['data']
+        loaded_data['num_cols'] = raw_data.shape[1]
+        if freq_range is not None:
+            raw_data = raw_data[get_freq_range_slice(raw_data[:,0],freq_range,loaded_data['header'])]
+        loaded_data['data'] = raw_data[:,:1] if header_only else raw_data
+        return loaded_data
+    return read_text_touchstone(file_path,read_header=read_header,freq_range=freq_range,header_only=header_only)
+
+TEXT_WRITE_CHUNK_ROWS = 4096 #rows formatted at once when writing text files (limits the size of the string)
+
+def write_text_touchstone(file_path,out_data,header=DEFAULT_HEADER,comments=[],delimiter=' ',precision=None):
+    '''
+    @brief write a table of data to a text snp/wnp file
+    @param[in] file_path - path of the file to write
+    @param[in] out_data - (frequency x 1+2*columns) array of [freq,re,im,re,im,...] like read_text_touchstone
+    @param[in/OPT] header - header string (without '#')
+    @param[in/OPT] comments - list of comments (or a single comment string)
+    @param[in/OPT] delimiter - delimiter between values (default ' ')
+    @param[in/OPT] precision - number of significant digits to write. None writes the shortest
+        value that reads back exactly (e.g. 1.5, 2.5E-05) like str(value).upper() (default None)
+    @note with a precision all of the values in a chunk of rows are formatted with a single string format call.
+        Without a precision the time is spent finding the shortest exact string for each value
+        so a precision (e.g. 10) is about 3x faster to write and gives smaller files
+    @return file_path
+    '''
+    out_data = np.asarray(out_data,dtype=np.float64)
+    if precision is not None:
+        line_fmt = delimiter.join(['%.{}G'.format(int(precision))]*out_data.shape[1])+'\n'
+    with open(file_path,'w+') as fp:
+        #write our comments
+        if type(comments) is not list: #assume if its not a list ts a string
+            comments = [comments]
+        for i in range(len(comments)):
+            fp.write('!%s\n' %(comments[i]))
+        #write our header (should just be a single string)
+        fp.write('#%s\n' %(header))
+        #now write out our data. upper() gives E exponents and NAN like the MUF writes
+        for i in range(0,out_data.shape[0],TEXT_WRITE_CHUNK_ROWS):
+            chunk = out_data[i:i+TEXT_WRITE_CHUNK_ROWS]
+            if precision is None:
+                text = ''.join([delimiter.join(map(str,line_data))+'\n' for line_data in chunk])
+            else:
+                text = (line_fmt*chunk.shape[0]) %tuple(chunk.ravel().tolist())
+            fp.write(text.upper())
+    return file_path
+
+def write_binary_touchstone(file_path,out_data,compression=None,level=None,chunk_rows=BINARY_CHUNK_ROWS):
+    '''
+    @brief write a table of data to a binary snp/wnp file
+    @param[in] file_path - path of the file to write
+    @param[in] out_data - (frequency x 1+2*columns) array of [freq,re,im,re,im,...]
+    @param[in/OPT] compression - None for the plain binary format or 'zlib'/'lzma' to compress the
+        frequencies and each chunk of rows separately (see CompressedFrames). Readers detect compressed files
+    @param[in/OPT] level - compression level. None uses the default of the library
+    @param[in/OPT] chunk_rows - number of rows in each compressed frame (default 256)
+    @return file_path
+    '''
+    out_data = np.asarray(out_data,dtype=np.float64)
+    if compression is None:
+        with open(file_path,'wb') as fp:
+            np.array(np.shape(out_data),dtype=np.uint32).tofile(fp)
+            out_data.tofile(fp)
+    else:
+        with FrameWriter(file_path,compression,level) as fw:
+            fw.write_frame(out_data[:,0])
+            for i in range(0,out_data.shape[0],chunk_rows):
+                fw.write_frame(out_data[i:i+chunk_rows,1:])
+            fw.info.update({'num_rows':out_data.shape[0],'num_cols':out_data.shape[1],'chunk_rows':chunk_rows})
+    return file_path
+
+def get_touchstone_write_path(out_file,ftype,default_extension,num_ports,fix_extension=True):
+    '''
+    @brief get the path to write a touchstone file to
+    @param[in] out_file - requested path. if *.[wts]np is the extension the n is replaced with the number of ports
+    @param[in] ftype - 'text' or 'binary'
+    @param[in] default_extension - extension to use when fix_extension is True (e.g. 'snp')
+    @param[in] num_ports - number of ports of the data
+    @param[in/OPT] fix_extension - replace the extension with default_extension (default True)
+    @return path with the corrected extension
+    '''
+    fname,ext = os.path.splitext(out_file)
+    if fix_extension: #just replace the extension with the correct one
+        ext = '.ext' #this will be replaced
+        if ftype=='binary': #add binary if needed
+            ext += '_binary'
+        ext = re.sub(r'(?<=\.).*?((?=_binary)|$)',default_extension,ext)
+    ext = re.sub(r'(?<=[wst])n(?=p)',str(num_ports),ext) #replace if snp
+    return fname+ext
 
 #%% actual file manipulation class
 class TouchstoneEditor(pd.DataFrame):
@@ -393,6 +903,11 @@ class TouchstoneEditor(pd.DataFrame):
         - read_header - True/False whether or not to read in header from text files (faster if false, default to true)  
         - waves - list of what waves we are measuring for self.waves dictionary (default ['A','B'] for s params should be ['S'])  
         - no_load - if True, do not immediatly load the file (default False)  
+        - memmap - if True, memory map binary files. The data is then a copy-on-write view of the file (default False)  
+        - cache - TouchstoneCache for parsed text files. None uses the default from set_touchstone_cache
+                  and False never uses a cache (default None)  
+        - freq_range - (lo,hi) only load frequencies with lo<=freq<=hi in Hz (default None loads all)  
+        - header_only - only load the ports and frequencies. The data is all NaN (default False)  
         - default_extension - default output file extension (e.g. snp,wnp)  
     '''
     
@@ -443,9 +958,11 @@ class TouchstoneEditor(pd.DataFrame):
     def __init__(self,*args,**kwargs):
          '''@brief Constructor'''
          option_keys = ['header'      ,'comments'                     ,'read_header',
-                        'waves'  ,'no_load','default_extension','param_class']
+                        'waves'  ,'no_load','default_extension','param_class','memmap','cache',
+                        'freq_range','header_only']
          option_vals = [DEFAULT_HEADER,copy.deepcopy(DEFAULT_COMMENTS),True,
-                        ['A','B'],False    ,'touchstone'              ,TouchstoneParam]
+                        ['A','B'],False    ,'touchstone'              ,TouchstoneParam,False   ,None   ,
+                        None        ,False]
          self.options = {}
          for key,val in zip(option_keys,option_vals): #extract our options
              self.options[key] = kwargs.pop(key,val) #default value
@@ -477,7 +994,8 @@ class TouchstoneEditor(pd.DataFrame):
          #now load the file
          if not self.options['no_load']:
              if(isinstance(input_file,str)): #if its a string, load a file
-                 self.read(input_file,read_header=self.options['read_header'])
+                 self.read(input_file,read_header=self.options['read_header'],memmap=self.options['memmap'],cache=self.options['cache'],
+                           freq_range=self.options['freq_range'],header_only=self.options['header_only'])
              elif(isinstance(input_file,tuple) or isinstance(input_file,list)):
                  self._create_empty(input_file[0],input_file[1])
              elif input_file is None: #try and guess the number of ports
@@ -509,6 +1027,11 @@ class TouchstoneEditor(pd.DataFrame):
          @param[in/OPT] - kwargs - keyword arguements as follows:  
                  - ftype  - type of file we are loading (e.g. 'text' or 'binary')  
                  - read_header - whether or not to read the header and comments in text files. It is faster to not read the header/comments
+                 - memmap - whether or not to memory map binary files (default False)
+                 - cache - TouchstoneCache for text files. None uses get_touchstone_cache() and False disables (default None)
+                 - freq_range - (lo,hi) only read frequencies with lo<=freq<=hi in Hz. Binary files
+                     only read those rows and text files stop parsing after hi (default None reads all)
+                 - header_only - only read the ports and frequencies. The data is left as NaN (default False)
          '''
          options = {}
          for k,v in kwargs.items():
@@ -537,19 +1060,15 @@ class TouchstoneEditor(pd.DataFrame):
          #now set our keys
          self._gen_dict_keys()
          
-         #if we have a binary file (e.g. *.w2p_binary)
-         if(ftype=='binary'):
-             #first read the header
-             loaded_data = read_binary_touchstone(input_file)  
-         #if we have a text file (e.g. *.w2p)
-         elif(ftype=='text'):
-             loaded_data = read_text_touchstone(input_file,**kwargs)
+         loaded_data = read_touchstone(input_file,ftype=ftype,read_header=options.get('read_header',None),
+                                       memmap=options.get('memmap',False),cache=options.get('cache',None),
+                                       freq_range=options.get('freq_range',None),header_only=options.get('header_only',False))
              
          #now set the variables from the loaded data
          raw_data = loaded_data['data']
          self.set_header(loaded_data['header'])
          self.options['comments'] = loaded_data['comments']
-         num_cols = np.size(raw_data,1) #get the number of columns     
+         num_cols = loaded_data['num_cols'] #get the number of columns in the file
  
          # check if our file is named correctly
          num_ports_from_file = int(round(np.sqrt((num_cols-1)/(len(self.waves)*2)))) #int(round(np.sqrt((num_cols-1)/2))) for snp file wnp has a and b
@@ -564,7 +1083,8 @@ class TouchstoneEditor(pd.DataFrame):
          self._create_empty(num_ports_from_file,freqs)
          
          #file is good if we make it here so continue to unpacking
-         self._extract_data(raw_data)
+         if not options.get('header_only',False):
+             self._extract_data(raw_data)
          
          if round_freqs:
              self.round_freq_list()
@@ -583,9 +1103,16 @@ class TouchstoneEditor(pd.DataFrame):
          @param[in/OPT] kwargs - keyword arguments as follows  
              - fix_extension - whether or not to fix the extension provided by out_file (default True)
                  This ensures the output file extension is correct  
+             - precision - significant digits of values in text files. None writes the
+                 shortest value that reads back exactly (default None)
+             - compression - None, 'zlib', or 'lzma' compression of binary files (default None)
+             - compression_level - level of the compression. None uses the default of the library
          '''
          options = {}
          options['fix_extension'] = True
+         options['precision'] = None
+         options['compression'] = None
+         options['compression_level'] = None
          for k,v in kwargs.items():
              options[k] = v
          
@@ -603,14 +1130,7 @@ class TouchstoneEditor(pd.DataFrame):
              self.round_freq_list() #issue when using Waveforms with time
          
          #clean the output filename
-         fname,ext = os.path.splitext(out_file)
-         if options['fix_extension']: #just replace the extension with the correct one
-             ext = '.ext' #this will be replaced
-             if ftype=='binary': #add binary if needed
-                 ext += '_binary'
-             ext = re.sub('(?<=\.).*?((?=_binary)|$)',self.options['default_extension'],ext)
-         ext = re.sub('(?<=[wst])n(?=p)',str(self.num_ports),ext) #replace if snp
-         out_file = fname+ext
+         out_file = get_touchstone_write_path(out_file,ftype,self.options['default_extension'],self.num_ports,options['fix_extension'])
          
          #get our frequency multiplier
          freq_mult = self._get_freq_mult()
@@ -622,26 +1142,9 @@ class TouchstoneEditor(pd.DataFrame):
          out_data[:,2::2] = self.raw.imag
          
          if(ftype=='binary'): # Write to binary file             
-             with open(out_file,'wb') as fp:
-                 num_rows = len(self.freqs)
-                 num_cols = len(self.wave_dict_keys)*len(self.waves)*2+1
-                 np.array([num_rows,num_cols],dtype=np.uint32).tofile(fp)
-                 out_data.tofile(fp)
-                 
+             write_binary_touchstone(out_file,out_data,options['compression'],options['compression_level'])
          elif(ftype=='text'): #write to text file
-             with open(out_file,'w+') as fp:
-                 #write our comments
-                 if type(comments) is not list: #assume if its not a list ts a string
-                     comments = [comments]
-                 for i in range(len(comments)):
-                     fp.write('!%s\n' %(comments[i]))
-                 #write our header (should just be a single string)
-                 fp.write('#%s\n' %(header))
-                 #now write out our data
-                 for line_data in out_data:
-                     #str(dat).upper is used here because '{:G}'.format gives weird amount of precision
-                     fp.write(delimiter.join([str(dat).upper() for dat in line_data])+'\n')
-                 
+             write_text_touchstone(out_file,out_data,header,comments,delimiter,options['precision'])
          else:
              print('Write Type not implemented')
          return out_file
@@ -649,21 +1152,17 @@ class TouchstoneEditor(pd.DataFrame):
     def _extract_data(self,raw_data):
         '''
         @brief Class to extract data from raw data. This can be overridden for special cases .
-        @note if not overridden this points to the same data as in self._raw  
+        @note if not overridden and the data is RI this points to the same data as raw_data (no copy)
         '''
-        #function to a number stored as complex to RI
-        convert_funct = lambda in_val: in_val; #do nothing if its already RI
+        #the columns are in the same order as the data in the file [(w1,k1),(w2,k1),(w1,k2),...]
+        #so the real,imag pairs can be viewed as complex values
+        data = raw_data[:,1:1+2*self.shape[1]]
+        if data.strides[-1]!=data.itemsize: #must be contiguous real,imag pairs
+            data = np.ascontiguousarray(data)
+        data = data.astype(np.float64,copy=False).view(np.cdouble)
         if re.findall('[dD][bB]',self.options['header']): #we have magphase data
-            convert_funct = DB2RI
-        #now get the data for each port. This assumes that the keys are in the same order as the data (which they should be)
-        for wi,w in enumerate(self.waves):
-            for ki,k in enumerate(self.wave_dict_keys):
-                idx = ki*len(self.waves)*2+(1+2*wi)
-                # Check if we are loading magphase (DB) instead of RI
-                data = raw_data[:,idx]+raw_data[:,idx+1]*1j
-                data = convert_funct(data)
-                #extract to self._raw
-                self[(w,k)] = data
+            data = DB2RI(data)
+        super().__init__(data,index=self.index,columns=self.columns,copy=False)
                 
         #ensure we are labeled as real,imag
         self.set_header(re.sub('[dD][bB]','RI',self.options['header']))
@@ -681,12 +1180,11 @@ class TouchstoneEditor(pd.DataFrame):
         self._gen_dict_keys()
         if self.options['header'] is None: #allow override
             self.set_header(DEFAULT_EMPTY_HEADER) #set the default header
-        #and pack the port data with 0s
+        #and pack the port data with NaNs
         # this will alternate waves like the data is in the file to prevent copy
-        wave_column_list = self.options['waves']*len(self.wave_dict_keys)
-        key_column_list = np.repeat(self.wave_dict_keys,len(self.options['waves']))
-        columns = [wave_column_list,key_column_list]
-        super().__init__(columns=columns,index=pd.Index(freqs,name='frequency'),dtype=np.cdouble)
+        columns = get_column_index(tuple(self.options['waves']),tuple(self.wave_dict_keys))
+        data = np.full((len(freqs),len(columns)),np.nan,dtype=np.cdouble)
+        super().__init__(data,columns=columns,index=pd.Index(freqs,name='frequency'),copy=False)
         #self.round_freq_list()
     
     def set_header(self,header_str):
@@ -713,12 +1211,7 @@ class TouchstoneEditor(pd.DataFrame):
         '''
         if header_str is None:
             header_str = self.options['header']
-        unit_strs = re.findall(HEADER_REGEX,header_str)[0]
-        if unit_strs:
-            mult = MULT_DICT.get(unit_strs[0].upper(),None) #assume 1 match if any
-        else:
-            mult = None
-        return mult
+        return get_freq_mult(header_str)
          
     def _set_num_ports(self,num_ports):
         '''
@@ -1198,6 +1691,281 @@ class WaveformParam(TouchstoneParam):
         self.freqs[:] = times
         
 
+#%% Lightweight numpy version of TouchstoneEditor
+class TouchstoneArray(object):
+    '''
+    @brief Lightweight version of TouchstoneEditor for *.snp and *.wnp files backed by a single complex numpy array.
+        No pandas DataFrame is built so it is much faster to create for many files (e.g. a whole aperture).
+        Use to_editor() when the full TouchstoneEditor is needed.
+    @param[in/OPT] args - path of file to load in or a tuple/list (n,[f1,f2,....]) to create an empty 
+        measurement with n ports and frequencies [f1,f2,...] (like TouchstoneEditor)
+    @param[in/OPT] arg_options - keyword arguments as follows:  
+        - header - header to write out to the file (text only)  
+        - comments - comments to write to file (text only)  
+        - read_header - True/False whether or not to read in header from text files (default True)  
+        - waves - list of waves (default from the extension, ['A','B'] for *.wnp otherwise ['S'])  
+        - memmap - if True, memory map binary files (default False)  
+        - cache - TouchstoneCache for parsed text files (see TouchstoneEditor)  
+        - freq_range - (lo,hi) only load frequencies with lo<=freq<=hi in Hz (default None loads all)  
+        - header_only - only load the ports and frequencies. The data is all NaN (default False)  
+    @note self.raw is a (frequency x column) complex array with the columns in the same 
+        order as the file [(w1,k1),(w2,k1),(w1,k2),...] and self.freqs is in Hz
+    @example
+        s2p = TouchstoneArray('path/to/file.s2p')
+        s21 = s2p.S[21].raw #complex view of the data
+        editor = s2p.to_editor() #SnpEditor of the same data
+    '''
+    __slots__ = ['raw','freqs','options','_ports']
+    
+    def __init__(self,*args,**arg_options):
+        '''@brief Constructor'''
+        self.options = {}
+        self.options['header'] = DEFAULT_HEADER
+        self.options['comments'] = copy.deepcopy(DEFAULT_COMMENTS)
+        self.options['read_header'] = True
+        self.options['waves'] = None
+        self.options['default_extension'] = None
+        self.options['memmap'] = False
+        self.options['cache'] = None
+        self.options['freq_range'] = None
+        self.options['header_only'] = False
+        for k,v in arg_options.items():
+            self.options[k] = v
+        self.raw = None
+        self.freqs = None
+        self._ports = []
+        input_file = args[0] if len(args) else None
+        if isinstance(input_file,str):
+            self.read(input_file,read_header=self.options['read_header'],memmap=self.options['memmap'],cache=self.options['cache'],
+                      freq_range=self.options['freq_range'],header_only=self.options['header_only'])
+        else:
+            self._set_default_waves('.snp')
+            if isinstance(input_file,tuple) or isinstance(input_file,list):
+                self._create_empty(input_file[0],input_file[1])
+    
+    @classmethod
+    def from_editor(cls,editor):
+        '''
+        @brief create from a TouchstoneEditor
+        @param[in] editor - TouchstoneEditor to create from
+        @return TouchstoneArray sharing the data of the editor when possible
+        '''
+        out = cls(header=editor.options['header'],comments=copy.deepcopy(editor.options['comments']),
+                  waves=list(editor.waves),default_extension=editor.options['default_extension'])
+        out._ports = np.array(editor._ports)
+        out.freqs = np.array(editor.freqs,dtype=np.float64)
+        out.raw = editor.raw
+        return out
+    
+    def to_editor(self,copy=False):
+        '''
+        @brief convert to a TouchstoneEditor (SnpEditor or WnpEditor)
+        @param[in/OPT] copy - copy the data. Otherwise the editor uses the same data (default False)
+        @return TouchstoneEditor of the data
+        '''
+        editor_class = {('S',):SnpEditor,('A','B'):WnpEditor}.get(tuple(self.waves),TouchstoneEditor)
+        columns = get_column_index(tuple(self.waves),tuple(self.wave_dict_keys))
+        data = self.raw.copy() if copy else self.raw
+        editor = editor_class(data,index=pd.Index(self.freqs,name='frequency'),columns=columns,copy=False,
+                              header=self.options['header'],comments=self.options['comments'],
+                              waves=list(self.waves),default_extension=self.options['default_extension'])
+        editor._set_num_ports(self.num_ports)
+        return editor
+    
+    def read(self,input_file,round_freqs=True,**kwargs):
+        '''
+        @brief Read in a snp or wnp file
+        @param[in] input_file - path of file to load  
+        @param[in/OPT] round_freqs - round frequencies to the nearest Hz (default True)
+        @param[in/OPT] kwargs - keyword arguments passed to read_touchstone (ftype,read_header,memmap,cache,freq_range,header_only)
+        '''
+        if os.path.splitext(input_file)[-1]=='.meas': #get the nominal solution
+            input_file = get_unperturbed_meas(input_file)
+        file_ext = os.path.splitext(input_file)[-1]
+        self._set_default_waves(file_ext)
+        num_ports = int(''.join(re.findall(r'\d',file_ext)) or 1)
+        self._set_num_ports(num_ports)
+        loaded_data = read_touchstone(input_file,**kwargs)
+        raw_data = loaded_data['data']
+        self.set_header(loaded_data['header'])
+        self.options['comments'] = loaded_data['comments']
+        num_cols = loaded_data['num_cols']
+        if int(round(np.sqrt((num_cols-1)/(len(self.waves)*2))))!=num_ports: #just make sure file matches extension
+            raise MalformedSnpError("Number of ports from extension does not match amount of data in file")
+        if kwargs.get('header_only',False):
+            self._create_empty(num_ports,raw_data[:,0]*self._get_freq_mult())
+            if round_freqs:
+                self.round_freq_list()
+            return
+        self.freqs = raw_data[:,0]*self._get_freq_mult()
+        #real,imag pairs viewed as complex values (no copy)
+        data = raw_data[:,1:]
+        if data.strides[-1]!=data.itemsize:
+            data = np.ascontiguousarray(data)
+        data = data.astype(np.float64,copy=False).view(np.cdouble)
+        if re.findall('[dD][bB]',self.options['header']): #we have magphase data
+            data = DB2RI(data)
+        self.raw = data
+        self.set_header(re.sub('[dD][bB]','RI',self.options['header']))
+        if round_freqs:
+            self.round_freq_list()
+    
+    # also alias to load
+    load = read
+    
+    def write(self,out_file,ftype='default',delimiter=' ',round_freqs=True,**kwargs):
+        '''
+        @brief write out data to touchstone (e.g. *.snp,*.wnp)  
+        @param[in] out_file - path of file name to write to. if *.[ws]np is the extension
+             (e.g *.snp) the n will be replaced with the correct number of ports  
+        @param[in/OPT] ftype - type of file to write out ('default' will write to whatever extension out_file has)  
+        @param[in/OPT] delimiter - delimiter to use when writing text files (default is ' ')  
+        @param[in/OPT] round_freqs - round our frequency list to the nearest hz
+        @param[in/OPT] kwargs - keyword arguments as follows  
+            - fix_extension - whether or not to fix the extension provided by out_file (default True)
+            - precision - significant digits of values in text files (default None, exact)
+            - compression - None, 'zlib', or 'lzma' compression of binary files (default None)
+            - compression_level - level of the compression. None uses the default of the library
+        @return path of the written file
+        '''
+        if ftype=='default':
+            ftype = 'binary' if re.findall('binary',os.path.splitext(out_file)[-1]) else 'text'
+        if round_freqs:
+            self.round_freq_list()
+        out_file = get_touchstone_write_path(out_file,ftype,self.options['default_extension'],
+                                             self.num_ports,kwargs.get('fix_extension',True))
+        out_data = np.empty((self.raw.shape[0],self.raw.shape[1]*2+1),dtype=np.double)
+        out_data[:,0] = self.freqs/self._get_freq_mult()
+        out_data[:,1::2] = self.raw.real
+        out_data[:,2::2] = self.raw.imag
+        if ftype=='binary':
+            write_binary_touchstone(out_file,out_data,kwargs.get('compression',None),kwargs.get('compression_level',None))
+        else:
+            write_text_touchstone(out_file,out_data,self.options['header'],self.options['comments'],
+                                  delimiter,kwargs.get('precision',None))
+        return out_file
+    
+    def _create_empty(self,num_ports,freqs):
+        '''
+        @brief create with all NaNs
+        @param[in] num_ports - number of ports
+        @param[in] freqs - list of frequencies in Hz
+        '''
+        self._set_num_ports(num_ports)
+        if self.options['header'] is None:
+            self.set_header(DEFAULT_EMPTY_HEADER)
+        self.freqs = np.array(freqs,dtype=np.float64)
+        self.raw = np.full((len(self.freqs),len(self.wave_dict_keys)*len(self.waves)),np.nan,dtype=np.cdouble)
+        
+    def _set_default_waves(self,ext):
+        '''@brief set the waves and default extension from a file extension if they were not provided'''
+        is_wnp = bool(re.findall(r'w[\d]+p',ext))
+        if self.options['waves'] is None:
+            self.options['waves'] = ['A','B'] if is_wnp else ['S']
+        if self.options['default_extension'] is None:
+            self.options['default_extension'] = 'wnp' if is_wnp else 'snp'
+    
+    def _gen_dict_keys(self):
+        '''@brief generate the keys for the current ports (e.g. [11,21,12,22] for *.s2p)'''
+        keys = TouchstoneEditor._gen_dict_keys(self)
+        if self.num_ports==2 and self.waves==['S']: #s2p files are ordered [11,21,12,22]
+            keys = keys[[0,2,1,3]]
+        return keys
+    
+    # same as TouchstoneEditor
+    set_header = TouchstoneEditor.set_header
+    _get_freq_mult = TouchstoneEditor._get_freq_mult
+    _set_num_ports = TouchstoneEditor._set_num_ports
+    
+    def round_freq_list(self):
+        '''@brief Round frequencies to nearest Hz'''
+        self.freqs = np.round(self.freqs,decimals=0)
+    
+    def get_column(self,wave,key):
+        '''@brief get the index of the column in self.raw for a wave and key (e.g. 'S',21)'''
+        keys = list(self.wave_dict_keys)
+        if wave not in self.waves or key not in keys:
+            raise KeyError((wave,key))
+        return keys.index(key)*len(self.waves)+self.waves.index(wave)
+    
+    def __getitem__(self,item):
+        '''
+        @brief get a wave (e.g. self['S']) or a parameter (e.g. self[('S',21)])
+        @return TouchstoneArrayWave or TouchstoneArrayParam (whose raw is a view of self.raw)
+        '''
+        if isinstance(item,tuple):
+            return TouchstoneArrayParam(self.raw[:,self.get_column(*item)],self.freqs)
+        if item in self.waves:
+            return TouchstoneArrayWave(self,item)
+        raise KeyError(item)
+    
+    def __getattr__(self,val):
+        '''@brief get a wave (e.g. self.S) or a parameter (e.g. self.S21)'''
+        if val not in TouchstoneArray.__slots__ and not val.startswith('__'):
+            waves = self.waves
+            if val in waves:
+                return self[val]
+            if len(val)>1 and val[0] in waves and val[1:].isdigit():
+                return self[(val[0],int(val[1:]))]
+        raise AttributeError("'{}' object has no attribute '{}'".format(type(self).__name__,val))
+    
+    def __eq__(self,other):
+        '''@brief check total equality of the frequencies, columns, and data'''
+        if isinstance(other,TouchstoneEditor):
+            other = TouchstoneArray.from_editor(other)
+        if not isinstance(other,TouchstoneArray):
+            return NotImplemented
+        return (self.columns==other.columns and np.array_equal(self.freqs,other.freqs)
+                and np.array_equal(self.raw,other.raw,equal_nan=True))
+    
+    @property
+    def wave_dict_keys(self): return self._gen_dict_keys()
+    @property
+    def num_ports(self): return len(self._ports)
+    @property
+    def waves(self): return self.options['waves']
+    @property
+    def freq_list(self): return self.freqs
+    @property
+    def columns(self): return [(w,k) for k in self.wave_dict_keys for w in self.waves]
+    @property
+    def shape(self): return self.raw.shape
+        
+class TouchstoneArrayWave(object):
+    '''@brief all of the parameters of a single wave of a TouchstoneArray (e.g. mys2p.S)'''
+    __slots__ = ['parent','wave']
+    def __init__(self,parent,wave):
+        '''@brief Constructor'''
+        self.parent = parent
+        self.wave = wave
+    def __getitem__(self,key):
+        '''@brief get a parameter (e.g. mys2p.S[21])'''
+        return self.parent[(self.wave,key)]
+    def __setitem__(self,key,val):
+        '''@brief set the values of a parameter (e.g. mys2p.S[21] = 0)'''
+        self.parent[(self.wave,key)].raw[:] = val
+    def keys(self): return self.parent.wave_dict_keys
+    
+class TouchstoneArrayParam(object):
+    '''@brief a single parameter of a TouchstoneArray (e.g. mys2p.S[21]). self.raw is a view of the TouchstoneArray data'''
+    __slots__ = ['raw','freqs']
+    def __init__(self,raw,freqs):
+        '''@brief Constructor'''
+        self.raw = raw
+        self.freqs = freqs
+    def __array__(self,dtype=None): return np.asarray(self.raw,dtype=dtype)
+    def __len__(self): return len(self.raw)
+    @property
+    def freq_list(self): return self.freqs
+    @property
+    def mag(self): return np.abs(self.raw)
+    @property
+    def mag_db(self): return 20*np.log10(self.mag)
+    @property
+    def phase(self): return np.angle(self.raw)
+    @property
+    def phase_d(self): return self.phase*180/np.pi
+    
 #%% Error codes
 class TouchstoneError(Exception):
     '''
@@ -1324,7 +2092,231 @@ class TestTouchstoneEditor(unittest.TestCase):
         s1_11 = copy.deepcopy(s1.S[11].raw)
         s1.swap_ports(1,2)
         self.assertTrue(np.all(s1_11==s1.S[22].raw))
-		
+
+    def test_text_parser(self):
+        '''@brief test parsing text files with comments, mixed delimiters, and multiline records'''
+        import tempfile
+        data = np.random.rand(3,33)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            fpath = os.path.join(tmp_dir,'test.s4p')
+            with open(fpath,'w') as fp:
+                fp.write('! first comment\n\n  !second comment\n#MHz S RI 50\n')
+                for i,vals in enumerate(data):
+                    lines = [vals[:9]]+[vals[j:j+8] for j in range(9,33,8)] #4 ports on 4 lines like a VNA
+                    fp.write('\n'.join([['\t',',',' | '][i].join([repr(v) for v in l]) for l in lines])+'\n')
+                fp.write('! inline comment\n')
+            loaded = read_text_touchstone(fpath,read_header=True)
+            self.assertTrue(np.all(loaded['data']==data))
+            self.assertEqual(loaded['comments'],[' first comment','second comment',' inline comment'])
+            self.assertEqual(loaded['header'],'#MHz S RI 50\n')
+            snp = SnpEditor(fpath)
+            self.assertTrue(np.all(snp.freqs==np.round(data[:,0]*1e6)))
+            self.assertTrue(np.all(snp.S[43].raw==data[:,29]+1j*data[:,30]))
+            with open(fpath,'a') as fp:
+                fp.write('1 2 3\n') #incomplete record
+            with self.assertRaises(MalformedSnpError):
+                read_text_touchstone(fpath)
+
+    def test_text_cache(self):
+        '''@brief test the on disk cache of parsed text files is used, invalidated, and evicted'''
+        import tempfile
+        freqs = np.linspace(26.5e9,40e9,11)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache = TouchstoneCache(os.path.join(tmp_dir,'cache'))
+            fpaths = []
+            for i in range(3):
+                snp = SnpEditor([2,freqs],comments=['file {}'.format(i)])
+                snp.raw = np.random.rand(*snp.shape)+1j*np.random.rand(*snp.shape)
+                fpaths.append(snp.write(os.path.join(tmp_dir,'test_{}.s2p'.format(i))))
+            snp_nocache = SnpEditor(fpaths[0],cache=False)
+            snp_miss = SnpEditor(fpaths[0],cache=cache)
+            self.assertEqual(len(cache),1)
+            snp_hit = SnpEditor(fpaths[0],cache=cache)
+            for s in [snp_miss,snp_hit]:
+                self.assertEqual(s,snp_nocache)
+                self.assertEqual(s.options['comments'],snp_nocache.options['comments'])
+            self.assertEqual(SnpEditor(fpaths[0],cache=cache,read_header=False).options['comments'],
+                             SnpEditor(fpaths[0],cache=False,read_header=False).options['comments'])
+            #changing the file should invalidate the entry
+            snp_new = SnpEditor([2,freqs])
+            snp_new.raw = np.random.rand(*snp_new.shape)+1j*np.random.rand(*snp_new.shape)
+            snp_new.write(fpaths[0])
+            st = os.stat(fpaths[0])
+            os.utime(fpaths[0],ns=(st.st_atime_ns,st.st_mtime_ns+10**9))
+            self.assertIsNone(cache.get(fpaths[0]))
+            self.assertEqual(SnpEditor(fpaths[0],cache=cache),SnpEditor(fpaths[0],cache=False))
+            #the least recently used entries should be evicted
+            self.assertEqual(cache.warm(fpaths),2)
+            self.assertEqual(cache.warm(fpaths),0)
+            for i,fpath in enumerate([fpaths[1],fpaths[0],fpaths[2]]): #set the order they were used
+                os.utime(cache.get_entry_path(fpath),ns=(0,(i+1)*10**9))
+            cache.evict(cache.size-1)
+            self.assertEqual(len(cache),2)
+            self.assertIsNone(cache.get(fpaths[1]))
+            cache.clear()
+            self.assertEqual(len(cache),0)
+            #threads writing the same entry should not collide
+            from concurrent.futures import ThreadPoolExecutor
+            loaded = read_text_touchstone(fpaths[0],read_header=True)
+            with ThreadPoolExecutor(4) as executor:
+                list(executor.map(lambda i: cache.put(fpaths[0],loaded),range(200)))
+            self.assertEqual(len(cache),1)
+            self.assertEqual(os.listdir(cache.cache_dir),[os.path.basename(cache.get_entry_path(fpaths[0]))])
+            self.assertTrue(np.all(cache.get(fpaths[0])['data']==loaded['data']))
+
+    def test_touchstone_array(self):
+        '''@brief test the numpy TouchstoneArray matches TouchstoneEditor for reading, writing, and access'''
+        import tempfile
+        import pickle
+        freqs = np.linspace(26.5e9,40e9,11)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for editor_class,ext in [(SnpEditor,'s2p'),(SnpEditor,'s3p'),(WnpEditor,'w2p')]:
+                editor = editor_class([int(ext[1]),freqs])
+                editor.raw = np.random.rand(*editor.shape)+1j*np.random.rand(*editor.shape)
+                for ftype in ['','_binary']:
+                    fpath = editor.write(os.path.join(tmp_dir,'test.'+ext+ftype))
+                    editor_read = editor_class(fpath)
+                    arr = TouchstoneArray(fpath)
+                    self.assertEqual(arr,editor_read)
+                    self.assertEqual(arr.columns,list(editor_read.columns))
+                    self.assertTrue(np.all(arr.freq_list==editor_read.freq_list))
+                    wave = arr.waves[-1]
+                    self.assertTrue(np.all(arr[wave][21].raw==editor_read[wave][21].raw))
+                    self.assertTrue(np.all(getattr(arr,wave+'12').raw==editor_read[(wave,12)].raw))
+                    #conversion to the editor shares the data
+                    arr_editor = arr.to_editor()
+                    self.assertIsInstance(arr_editor,editor_class)
+                    self.assertEqual(arr_editor,editor_read)
+                    self.assertTrue(np.shares_memory(arr_editor.raw,arr.raw))
+                    self.assertEqual(TouchstoneArray.from_editor(editor_read),arr)
+                    #writing should round trip
+                    out_path = arr.write(os.path.join(tmp_dir,'out.'+ext+ftype))
+                    self.assertEqual(editor_class(out_path),editor_read)
+                    self.assertEqual(pickle.loads(pickle.dumps(arr)),arr)
+            arr = TouchstoneArray([2,freqs])
+            arr.S[21] = 1
+            self.assertTrue(np.all(arr.raw[:,1]==1))
+            self.assertTrue(np.all(np.isnan(arr.raw[:,[0,2,3]])))
+            with self.assertRaises(KeyError):
+                arr.S[33]
+
+    def test_text_writer(self):
+        '''@brief test the text writer matches formatting each value and reads back exactly'''
+        import tempfile
+        out_data = np.random.normal(size=(7,9))*np.logspace(-8,8,9)
+        out_data[:,0] = np.linspace(26.5,40,7)
+        out_data[2,3] = np.nan
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            fpath = write_text_touchstone(os.path.join(tmp_dir,'test.s2p'),out_data,comments=['a comment'])
+            with open(fpath,'r') as fp:
+                lines = fp.read().splitlines()
+            self.assertEqual(lines[:2],['!a comment','#'+DEFAULT_HEADER])
+            self.assertEqual(lines[2:],[' '.join([str(v).upper() for v in l]) for l in out_data]) #previous format
+            loaded = read_text_touchstone(fpath,read_header=True)
+            self.assertTrue(np.array_equal(loaded['data'],out_data,equal_nan=True))
+            for delimiter,precision in [(',',None),(' ',6)]:
+                fpath = write_text_touchstone(os.path.join(tmp_dir,'test.s2p'),out_data,delimiter=delimiter,precision=precision)
+                loaded = read_text_touchstone(fpath)
+                if precision is None:
+                    self.assertTrue(np.array_equal(loaded['data'],out_data,equal_nan=True))
+                else:
+                    self.assertTrue(np.allclose(loaded['data'],out_data,rtol=1e-5,atol=0,equal_nan=True))
+                    self.assertFalse(np.array_equal(loaded['data'],out_data,equal_nan=True))
+            #through the editor
+            snp = SnpEditor([2,np.linspace(26.5e9,40e9,11)])
+            snp.raw = np.random.rand(*snp.shape)+1j*np.random.rand(*snp.shape)
+            self.assertEqual(SnpEditor(snp.write(os.path.join(tmp_dir,'test.s2p'))),snp)
+            snp_approx = SnpEditor(snp.write(os.path.join(tmp_dir,'test.s2p'),precision=8))
+            self.assertTrue(np.allclose(snp_approx.raw,snp.raw,rtol=1e-7,atol=0))
+
+    def test_partial_read(self):
+        '''@brief test reading a frequency range or only the header matches reading everything and cropping'''
+        import tempfile
+        freqs = np.linspace(26.5e9,40e9,136)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            fpaths = []
+            for editor_class,ext in [(SnpEditor,'s2p'),(WnpEditor,'w2p')]:
+                editor = editor_class([2,freqs])
+                editor.raw = np.random.rand(*editor.shape)+1j*np.random.rand(*editor.shape)
+                fpaths += [(editor_class,editor.write(os.path.join(tmp_dir,'test.'+ext+ftype))) for ftype in ['','_binary']]
+            #s4p with records split across lines and comments
+            fpath = os.path.join(tmp_dir,'test.s4p')
+            with open(fpath,'w') as fp:
+                fp.write('!comment\n#Hz S RI 50\n')
+                for f in freqs:
+                    vals = np.random.rand(32)
+                    fp.write(' '.join([repr(f)]+[repr(v) for v in vals[:8]])+'\n')
+                    fp.write('\n'.join([' '.join([repr(v) for v in vals[i:i+8]]) for i in range(8,32,8)])+' !inline\n')
+            fpaths.append((SnpEditor,fpath))
+            cache = TouchstoneCache(os.path.join(tmp_dir,'cache'))
+            for editor_class,fpath in fpaths:
+                full = editor_class(fpath)
+                for freq_range in [(39e9,40e9),(30.1e9,30.2e9),(0,1e9),(26.5e9,26.5e9)]:
+                    expected = full.crop(*freq_range)
+                    for c in [False,cache]:
+                        self.assertEqual(editor_class(fpath,freq_range=freq_range,cache=c),expected,msg=(fpath,freq_range))
+                    self.assertEqual(TouchstoneArray(fpath,freq_range=freq_range),expected)
+                header_only = editor_class(fpath,header_only=True)
+                self.assertEqual(header_only.num_ports,full.num_ports)
+                self.assertTrue(np.all(header_only.freq_list==full.freq_list))
+                self.assertTrue(np.all(np.isnan(header_only.raw)))
+                self.assertEqual(TouchstoneArray(fpath,header_only=True).shape,full.shape)
+            #binary range reads should only read the rows in the range
+            loaded = read_binary_touchstone(fpaths[1][1],freq_range=(39e9,40e9))
+            self.assertEqual(loaded['data'].shape,(np.sum(freqs>=39e9),9))
+
+    def test_compressed_binary(self):
+        '''@brief test compressed binary files read back exactly and only decompress the frames of a frequency range'''
+        import tempfile
+        from unittest import mock
+        from samurai.base.CompressedFrames import FrameReader as frame_reader_class
+        freqs = np.linspace(26.5e9,40e9,1001)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for editor_class,ext in [(SnpEditor,'s2p'),(WnpEditor,'w2p')]:
+                editor = editor_class([2,freqs])
+                editor.raw = np.round(np.random.rand(*editor.shape),3)+1j*np.round(np.random.rand(*editor.shape),3)
+                plain_path = editor.write(os.path.join(tmp_dir,'plain.'+ext+'_binary'))
+                for compression in ['zlib','lzma']:
+                    fpath = editor.write(os.path.join(tmp_dir,'test_{}.{}_binary'.format(compression,ext)),compression=compression)
+                    self.assertLess(os.path.getsize(fpath),os.path.getsize(plain_path))
+                    self.assertEqual(editor_class(fpath),editor)
+                    self.assertEqual(editor_class(fpath,memmap=True),editor)
+                    self.assertEqual(TouchstoneArray(fpath),TouchstoneArray(plain_path))
+                    self.assertEqual(editor_class(fpath,freq_range=(39e9,40e9)),editor.crop(39e9,40e9))
+                    self.assertEqual(editor_class(fpath,freq_range=(0,1e9)).shape[0],0)
+                    self.assertTrue(np.all(editor_class(fpath,header_only=True).freq_list==editor.freq_list))
+                    #only the frequency frame and the frames with rows in the range are decompressed
+                    with mock.patch.object(frame_reader_class,'read_frame',autospec=True,side_effect=frame_reader_class.read_frame) as read_frame:
+                        read_binary_touchstone(fpath,freq_range=(freqs[300],freqs[400]))
+                        self.assertEqual([c[0][1] for c in read_frame.call_args_list],[0,2])
+                        read_frame.reset_mock()
+                        read_binary_touchstone(fpath,header_only=True)
+                        self.assertEqual([c[0][1] for c in read_frame.call_args_list],[0])
+
+    def test_binary_memmap(self):
+        '''@brief test memory mapped binary files match reading them and do not change the file'''
+        import tempfile
+        import mmap
+        snp = SnpEditor([2,np.linspace(26.5e9,40e9,11)])
+        snp.raw = np.random.rand(*snp.shape)+1j*np.random.rand(*snp.shape)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            fpath = snp.write(os.path.join(tmp_dir,'test.s2p_binary'))
+            snp_read = SnpEditor(fpath)
+            snp_map = SnpEditor(fpath,memmap=True)
+            self.assertEqual(snp_read,snp_map)
+            self.assertTrue(np.all(snp_map.S[21].raw==snp.S[21].raw))
+            base = snp_map.raw
+            while getattr(base,'base',None) is not None: #the values should be a view of the map (no copy)
+                base = base.base
+            self.assertIsInstance(base,mmap.mmap)
+            snp_map.S[21] = 0 #copy on write
+            self.assertEqual(SnpEditor(fpath),snp_read)
+            del snp_map #release the map before removing the directory
+            with open(fpath,'ab') as fp:
+                fp.write(b'extra')
+            with self.assertRaises(MalformedSnpError):
+                SnpEditor(fpath,memmap=True)
+
     def test_arithmetic_between_values(self):
         '''
 		@brief test arithmetic operations  
@@ -12,6 +12,10 @@ test_list = [] #classes of unittests to run
 from samurai.base.SamuraiDict import TestSamuraiDict
 test_list.append(TestSamuraiDict)
 
+#%% Compressed frame storage testing
+from samurai.base.CompressedFrames import TestCompressedFrames
+test_list.append(TestCompressedFrames)
+
 #%% Touchstone Editor unit testing
 from samurai.base.TouchstoneEditor import TestTouchstoneEditor
 test_list.append(TestTouchstoneEditor)
@@ -19,11 +23,37 @@ test_list.append(TestTouchstoneEditor)
 #%% MUF Result testing
 from samurai.base.MUF.MUFResult import TestMUFResult
 test_list.append(TestMUFResult)
+from samurai.base.MUF.MUFMeasIndex import TestMeasIndex
+test_list.append(TestMeasIndex)
 
 #%% SamuraiMeasurement Testing
 from samurai.base.SamuraiMeasurement import TestSamuraiMeasurement
 test_list.append(TestSamuraiMeasurement)
 
+#%% MetafileController Testing
+from samurai.analysis.support.MetafileController import TestMetafileController
+test_list.append(TestMetafileController)
+
+#%% MetafileConverter Testing
+from samurai.analysis.support.MetafileConverter import TestMetafileConverter
+test_list.append(TestMetafileConverter)
+
+#%% SamuraiPostProcess Testing
+from samurai.analysis.support.SamuraiPostProcess import TestSamuraiPostProcess
+test_list.append(TestSamuraiPostProcess)
+
+#%% SamuraiBeamform Testing
+from samurai.analysis.support.SamuraiBeamform import TestSamuraiBeamform
+test_list.append(TestSamuraiBeamform)
+
+#%% ApertureCube Testing
+from samurai.analysis.support.ApertureCube import TestApertureCube
+test_list.append(TestApertureCube)
+
+#%% Calibration Testing
+from samurai.analysis.calibration.CalibrateSamurai import TestCalibrateSamurai
+test_list.append(TestCalibrateSamurai)
+
 #%% now run them all
 import time
 time.sleep(0.5) #sleep for a bit to let loaded modules be printed